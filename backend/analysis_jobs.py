@@ -0,0 +1,283 @@
+from datetime import datetime, timedelta, timezone
+from doc_analysis import ProgressCallback
+from llm_scheduler import LlmOverloaded
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Analyses running at once; further jobs wait in the queue
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', '2'))
+# Submissions beyond this many queued jobs are refused
+ANALYSIS_JOB_MAX_QUEUED = int(os.environ.get('ANALYSIS_JOB_MAX_QUEUED', '100'))
+ANALYSIS_JOB_OVERLOAD_RETRIES = int(os.environ.get('ANALYSIS_JOB_OVERLOAD_RETRIES', '5'))
+# A running job whose lease is not renewed for this long is taken over by another worker
+ANALYSIS_JOB_LEASE_SECONDS = float(os.environ.get('ANALYSIS_JOB_LEASE_SECONDS', '60'))
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+# analyze(job, on_progress) -> the analysis response for one job
+AnalyzeJob = Callable[[Dict, ProgressCallback], Awaitable[Dict]]
+
+class JobQueueFull(Exception):
+    pass
+
+async def create_job(db, upload_path: Path, size: int, content_hash: Optional[str], filename: Optional[str],
+                     content_type: Optional[str], session_id: str, large_document: bool, reuse: bool) -> Dict:
+    """Persist a queued analysis job for an upload already spooled to ``upload_path``"""
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": str(uuid.uuid4()),
+        "status": "queued",
+        "progress": {"stage": "queued", "done": 0, "total": 0},
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "content_hash": content_hash,
+        "session_id": session_id,
+        "large_document": large_document,
+        "reuse": reuse,
+        "upload_path": str(upload_path),
+        "owner": None,
+        "lease_until": None,
+        "result": None,
+        "error": None,
+        "status_code": None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None
+    }
+    await db.analysis_jobs.insert_one(job)
+    job.pop('_id', None)
+    return job
+
+class AnalysisJobRunner:
+    """Bounded pool of workers running queued document analyses.
+
+    Job state lives in ``analysis_jobs``; workers pull job ids from an
+    in-process queue, claim the job with a lease that they renew while it
+    runs, report progress into the job document and remove the spooled
+    upload once the job reaches a terminal state. Only the lease holder
+    writes to a job, so a job queued by several processes runs once. Jobs
+    whose lease lapsed, because their process stopped, are picked up by
+    ``resume``; stored chunk results make the rerun cheap.
+    """
+
+    def __init__(self, db, analyze: AnalyzeJob):
+        self.db = db
+        self.analyze = analyze
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._active: Dict[str, asyncio.Task] = {}
+        self._pending: Set[str] = set()
+        self._reclaimer: Optional[asyncio.Task] = None
+
+    def _ensure_workers(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(ANALYSIS_JOB_WORKERS)]
+        return self._queue
+
+    def check_capacity(self) -> None:
+        if self._queue is not None and self._queue.qsize() >= ANALYSIS_JOB_MAX_QUEUED:
+            raise JobQueueFull(f"{ANALYSIS_JOB_MAX_QUEUED} analysis jobs already queued")
+
+    def submit(self, job_id: str) -> None:
+        if job_id in self._pending or job_id in self._active:
+            return
+        self._pending.add(job_id)
+        self._ensure_workers().put_nowait(job_id)
+
+    async def resume(self) -> int:
+        """Queue jobs abandoned by another process, oldest first.
+
+        That is running jobs whose lease expired, and queued jobs nobody has
+        touched for a lease period; a job still held elsewhere is left alone.
+        """
+        now = datetime.now(timezone.utc)
+        stale = now - timedelta(seconds=ANALYSIS_JOB_LEASE_SECONDS)
+        count = 0
+        async for job in self.db.analysis_jobs.find(
+            {"$or": [
+                {"status": "queued", "updated_at": {"$lt": stale}},
+                {"status": "running", "lease_until": {"$not": {"$gte": now}}}
+            ]},
+            projection={"_id": 0, "id": 1}
+        ).sort("created_at", 1):
+            self.submit(job["id"])
+            count += 1
+        return count
+
+    def start(self) -> None:
+        """Keep taking over jobs from processes that stop while this one runs"""
+        if self._reclaimer is None:
+            self._reclaimer = asyncio.create_task(self._reclaim_forever())
+
+    async def _reclaim_forever(self) -> None:
+        while True:
+            await asyncio.sleep(ANALYSIS_JOB_LEASE_SECONDS)
+            try:
+                resumed = await self.resume()
+                if resumed:
+                    logger.info(f"Took over {resumed} abandoned analysis jobs")
+            except Exception as e:
+                logger.error(f"Analysis job reclaim failed: {str(e)}")
+
+    async def shutdown(self) -> None:
+        tasks = list(self._workers)
+        if self._reclaimer is not None:
+            tasks.append(self._reclaimer)
+            self._reclaimer = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+        try:
+            # Let the next process take over our jobs without waiting out the lease
+            await self.db.analysis_jobs.update_many(
+                {"owner": self.owner, "status": "running"},
+                {"$set": {"lease_until": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to release analysis job leases: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len(self._workers),
+            "running": len(self._active),
+            "queued": self._queue.qsize() if self._queue is not None else 0
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._pending.discard(job_id)
+            self._active[job_id] = asyncio.current_task()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Analysis job {job_id} could not be updated: {str(e)}")
+            finally:
+                self._active.pop(job_id, None)
+
+    async def _update(self, job_id: str, fields: Dict) -> bool:
+        """Write to a job this runner holds; False once the lease was lost"""
+        fields["updated_at"] = datetime.now(timezone.utc)
+        result = await self.db.analysis_jobs.update_one(
+            {"id": job_id, "owner": self.owner, "status": "running"}, {"$set": fields}
+        )
+        return result.matched_count > 0
+
+    async def _claim(self, job_id: str) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        claimed = {
+            "status": "running",
+            "owner": self.owner,
+            "lease_until": now + timedelta(seconds=ANALYSIS_JOB_LEASE_SECONDS),
+            "started_at": now,
+            "updated_at": now
+        }
+        job = await self.db.analysis_jobs.find_one_and_update(
+            {"id": job_id, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$not": {"$gte": now}}}
+            ]},
+            {"$set": claimed},
+            projection={"_id": 0}
+        )
+        if job is not None:
+            job.update(claimed)
+        return job
+
+    async def _keep_lease(self, job_id: str) -> None:
+        """Renew the lease until cancelled; returns if another worker took the job"""
+        while True:
+            await asyncio.sleep(ANALYSIS_JOB_LEASE_SECONDS / 3)
+            lease_until = datetime.now(timezone.utc) + timedelta(seconds=ANALYSIS_JOB_LEASE_SECONDS)
+            if not await self._update(job_id, {"lease_until": lease_until}):
+                return
+
+    async def _analyze(self, job: Dict, on_progress: ProgressCallback) -> Dict:
+        for attempt in range(ANALYSIS_JOB_OVERLOAD_RETRIES + 1):
+            try:
+                return await self.analyze(job, on_progress)
+            except LlmOverloaded as e:
+                # Nobody is waiting on the response; back off and queue again
+                if attempt == ANALYSIS_JOB_OVERLOAD_RETRIES:
+                    raise
+                await on_progress("waiting", attempt + 1, ANALYSIS_JOB_OVERLOAD_RETRIES)
+                await asyncio.sleep(e.retry_after)
+
+    async def _run(self, job_id: str) -> None:
+        job = await self._claim(job_id)
+        if job is None:
+            # Finished, or running under another worker's lease
+            return
+
+        async def on_progress(stage: str, done: int, total: int):
+            await self._update(job_id, {"progress": {"stage": stage, "done": done, "total": total}})
+
+        work = asyncio.create_task(self._analyze(job, on_progress))
+        lease = asyncio.create_task(self._keep_lease(job_id))
+        try:
+            # Cancelled by a shutdown, the job stays running until its lease lapses
+            await asyncio.wait({work, lease}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            lease.cancel()
+            if not work.done():
+                work.cancel()
+        if not work.done() or work.cancelled():
+            logger.warning(f"Analysis job {job_id} was taken over by another worker")
+            await asyncio.gather(work, return_exceptions=True)
+            return
+
+        error = work.exception()
+        if error is not None:
+            logger.error(f"Analysis job {job_id} failed: {str(error)}")
+            finished = await self._update(job_id, {
+                "status": "failed",
+                "error": str(getattr(error, "detail", None) or error),
+                "status_code": getattr(error, "status_code", 429 if isinstance(error, LlmOverloaded) else 500),
+                "finished_at": datetime.now(timezone.utc)
+            })
+        else:
+            finished = await self._update(job_id, {
+                "status": "completed",
+                "result": work.result(),
+                "progress": {"stage": "done", "done": 1, "total": 1},
+                "finished_at": datetime.now(timezone.utc)
+            })
+            if finished:
+                logger.info(f"Analysis job {job_id} completed")
+        if finished:
+            Path(job["upload_path"]).unlink(missing_ok=True)
+
+async def get_job(db, job_id: str) -> Optional[Dict]:
+    return await db.analysis_jobs.find_one({"id": job_id}, projection={"_id": 0, "upload_path": 0, "owner": 0, "lease_until": 0})
+
+async def watch_job(db, job_id: str, interval: float = 0.5) -> AsyncIterator[Dict]:
+    """Yield the job document whenever its status or progress changes, until it finishes"""
+    previous = None
+    while True:
+        job = await get_job(db, job_id)
+        if job is None:
+            return
+        progress = job["progress"]
+        state = (job["status"], progress["stage"], progress["done"], progress["total"])
+        if state != previous:
+            previous = state
+            yield job
+        if job["status"] in TERMINAL_STATUSES:
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,468 @@
+from datetime import datetime, timedelta, timezone
+from llm_scheduler import LlmOverloaded
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import orjson
+import os
+import socket
+import time
+import uuid
+import stats
+import versions
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '10000'))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', str(20 * 1024 * 1024)))
+# Concurrent prompts per job; the LLM scheduler still caps each provider
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '8'))
+BATCH_MAX_RUNNING_JOBS = int(os.environ.get('BATCH_MAX_RUNNING_JOBS', '2'))
+# Results are written in bulk once this many are buffered or the interval passes
+BATCH_FLUSH_SIZE = int(os.environ.get('BATCH_FLUSH_SIZE', '100'))
+BATCH_FLUSH_SECONDS = float(os.environ.get('BATCH_FLUSH_SECONDS', '1'))
+BATCH_OVERLOAD_RETRIES = int(os.environ.get('BATCH_OVERLOAD_RETRIES', '5'))
+# A running job whose lease is not renewed for this long is taken over by another worker
+BATCH_LEASE_SECONDS = float(os.environ.get('BATCH_LEASE_SECONDS', '60'))
+
+TERMINAL_STATUSES = ("completed", "failed")
+# Fixed namespace so message ids derived from (batch, index) are stable across resumes
+_MESSAGE_NAMESPACE = uuid.UUID("6f1c1d7e-3b8e-4c8f-9a55-2f1b8d0c7a11")
+
+# call(item) -> (reply, provider, model) for one prompt
+PromptCall = Callable[[Dict], Awaitable[Tuple[str, str, str]]]
+
+class BatchFormatError(Exception):
+    pass
+
+class BatchPrompt(BaseModel):
+    prompt: str = Field(min_length=1)
+    session_id: Optional[str] = None
+    model_provider: Optional[str] = None
+    model_name: Optional[str] = None
+    system_message: Optional[str] = None
+    # Caller's own reference, echoed back in the results
+    custom_id: Optional[str] = None
+
+def parse_batch(body: bytes) -> List[BatchPrompt]:
+    """Parse a JSONL body; blank lines are skipped and ``message`` is accepted for ``prompt``"""
+    prompts = []
+    for number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = orjson.loads(line)
+            if isinstance(data, dict) and "prompt" not in data and "message" in data:
+                data["prompt"] = data.pop("message")
+            prompts.append(BatchPrompt.model_validate(data))
+        except (orjson.JSONDecodeError, ValidationError) as e:
+            if isinstance(e, ValidationError):
+                error = e.errors()[0]
+                detail = f"{'.'.join(str(part) for part in error['loc']) or 'line'}: {error['msg']}"
+            else:
+                detail = "invalid JSON"
+            raise BatchFormatError(f"Line {number}: {detail}")
+        if len(prompts) > BATCH_MAX_ITEMS:
+            raise BatchFormatError(f"Batch exceeds {BATCH_MAX_ITEMS} prompts")
+    if not prompts:
+        raise BatchFormatError("Batch contains no prompts")
+    return prompts
+
+def message_id(batch_id: str, index: int, role: str) -> str:
+    return str(uuid.uuid5(_MESSAGE_NAMESPACE, f"{batch_id}:{index}:{role}"))
+
+async def create_batch(db, prompts: List[BatchPrompt], provider: str, model: str, system_message: str) -> Dict:
+    """Persist a job and its items; prompts without a session go to one job session"""
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    job = {
+        "id": batch_id,
+        "status": "queued",
+        "total": len(prompts),
+        "completed": 0,
+        "failed": 0,
+        "session_id": str(uuid.uuid4()),
+        "model_provider": provider,
+        "model_name": model,
+        "owner": None,
+        "lease_until": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None
+    }
+    items = [
+        {
+            "batch_id": batch_id,
+            "index": index,
+            "custom_id": prompt.custom_id,
+            "prompt": prompt.prompt,
+            "session_id": prompt.session_id or job["session_id"],
+            "model_provider": prompt.model_provider or provider,
+            "model_name": prompt.model_name or model,
+            "system_message": prompt.system_message or system_message,
+            "status": "pending"
+        }
+        for index, prompt in enumerate(prompts)
+    ]
+    await db.chat_batch_items.insert_many(items, ordered=False)
+    await db.chat_batches.insert_one(job)
+    job.pop('_id', None)
+    return job
+
+class BatchRunner:
+    """Runs batch jobs on a bounded pool of workers per job.
+
+    Workers pull pending items, call the model through ``call`` and buffer
+    the outcome; a flusher writes buffered results with one insert_many
+    into ``chat_messages`` and one bulk_write each for the items, the
+    sessions and the job counters. A job runs under a lease that its
+    runner renews, so only one process works on it at a time; a job whose
+    lease lapsed is taken over by ``resume``. Message ids are derived from
+    the batch and item index, so re-running items after a takeover cannot
+    duplicate messages.
+    """
+
+    def __init__(self, db, call: PromptCall):
+        self.db = db
+        self.call = call
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._running: Dict[str, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(BATCH_MAX_RUNNING_JOBS)
+        self._reclaimer: Optional[asyncio.Task] = None
+
+    def start(self, batch_id: str) -> None:
+        if batch_id in self._running:
+            return
+        task = asyncio.create_task(self._run(batch_id))
+        self._running[batch_id] = task
+        task.add_done_callback(lambda _: self._running.pop(batch_id, None))
+
+    async def resume(self) -> int:
+        """Start jobs abandoned by another process.
+
+        That is running jobs whose lease expired, and queued jobs older than
+        a lease period; a job still held elsewhere is left alone.
+        """
+        now = datetime.now(timezone.utc)
+        count = 0
+        async for job in self.db.chat_batches.find(
+            {"$or": [
+                {"status": "queued", "created_at": {"$lt": now - timedelta(seconds=BATCH_LEASE_SECONDS)}},
+                {"status": "running", "lease_until": {"$not": {"$gte": now}}}
+            ]},
+            projection={"_id": 0, "id": 1}
+        ):
+            self.start(job["id"])
+            count += 1
+        return count
+
+    def start_reclaimer(self) -> None:
+        """Keep taking over jobs from processes that stop while this one runs"""
+        if self._reclaimer is None:
+            self._reclaimer = asyncio.create_task(self._reclaim_forever())
+
+    async def _reclaim_forever(self) -> None:
+        while True:
+            await asyncio.sleep(BATCH_LEASE_SECONDS)
+            try:
+                resumed = await self.resume()
+                if resumed:
+                    logger.info(f"Took over {resumed} abandoned batch jobs")
+            except Exception as e:
+                logger.error(f"Batch reclaim failed: {str(e)}")
+
+    async def shutdown(self) -> None:
+        tasks = list(self._running.values())
+        if self._reclaimer is not None:
+            tasks.append(self._reclaimer)
+            self._reclaimer = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            # Let the next process take over our jobs without waiting out the lease
+            await self.db.chat_batches.update_many(
+                {"owner": self.owner, "status": "running"},
+                {"$set": {"lease_until": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            logger.error(f"Failed to release batch leases: {str(e)}")
+
+    async def _claim(self, batch_id: str) -> bool:
+        now = datetime.now(timezone.utc)
+        job = await self.db.chat_batches.find_one_and_update(
+            {"id": batch_id, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$not": {"$gte": now}}}
+            ]},
+            {"$set": {
+                "status": "running",
+                "owner": self.owner,
+                "lease_until": now + timedelta(seconds=BATCH_LEASE_SECONDS),
+                "started_at": now
+            }},
+            projection={"_id": 1}
+        )
+        return job is not None
+
+    def _held(self, batch_id: str) -> Dict:
+        """Filter matching the job only while this runner holds its lease"""
+        return {"id": batch_id, "owner": self.owner, "status": "running"}
+
+    async def _keep_lease(self, batch_id: str) -> None:
+        """Renew the lease until cancelled; returns if another worker took the job"""
+        while True:
+            await asyncio.sleep(BATCH_LEASE_SECONDS / 3)
+            lease_until = datetime.now(timezone.utc) + timedelta(seconds=BATCH_LEASE_SECONDS)
+            renewed = await self.db.chat_batches.update_one(self._held(batch_id), {"$set": {"lease_until": lease_until}})
+            if not renewed.matched_count:
+                return
+
+    async def _run(self, batch_id: str) -> None:
+        async with self._slots:
+            if not await self._claim(batch_id):
+                # Finished, or running under another worker's lease
+                return
+            work = asyncio.create_task(self._process(batch_id))
+            lease = asyncio.create_task(self._keep_lease(batch_id))
+            try:
+                # Cancelled by a shutdown, the job stays running until its lease lapses
+                await asyncio.wait({work, lease}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                lease.cancel()
+                if not work.done():
+                    work.cancel()
+            if not work.done() or work.cancelled():
+                logger.warning(f"Batch {batch_id} was taken over by another worker")
+                await asyncio.gather(work, return_exceptions=True)
+                return
+            try:
+                work.result()
+                # Recount from the items, which stay exact across resumed runs
+                completed, failed = await asyncio.gather(
+                    self.db.chat_batch_items.count_documents({"batch_id": batch_id, "status": "completed"}),
+                    self.db.chat_batch_items.count_documents({"batch_id": batch_id, "status": "failed"})
+                )
+                await self.db.chat_batches.update_one(
+                    self._held(batch_id),
+                    {"$set": {
+                        "status": "completed",
+                        "completed": completed,
+                        "failed": failed,
+                        "finished_at": datetime.now(timezone.utc)
+                    }}
+                )
+                logger.info(f"Batch {batch_id} completed")
+            except Exception as e:
+                logger.error(f"Batch {batch_id} failed: {str(e)}")
+                await self.db.chat_batches.update_one(
+                    self._held(batch_id),
+                    {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}}
+                )
+
+    async def _process(self, batch_id: str) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        async for item in self.db.chat_batch_items.find(
+            {"batch_id": batch_id, "status": "pending"}, projection={"_id": 0}
+        ).sort("index", 1):
+            queue.put_nowait(item)
+        buffer: List[Dict] = []
+        wake = asyncio.Event()
+        workers_done = False
+
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                buffer.append(await self._run_item(item))
+                if len(buffer) >= BATCH_FLUSH_SIZE:
+                    wake.set()
+
+        async def flusher():
+            while not workers_done or buffer:
+                try:
+                    await asyncio.wait_for(wake.wait(), BATCH_FLUSH_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                if buffer:
+                    results = buffer[:]
+                    del buffer[:len(results)]
+                    await self._flush(batch_id, results)
+
+        flush_task = asyncio.create_task(flusher())
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(BATCH_WORKERS, max(1, queue.qsize())))))
+        except BaseException:
+            flush_task.cancel()
+            raise
+        # Let the flusher drain what is left, then stop
+        workers_done = True
+        wake.set()
+        await flush_task
+
+    async def _run_item(self, item: Dict) -> Dict:
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        result = {"item": item, "started_at": started_at}
+        for attempt in range(BATCH_OVERLOAD_RETRIES + 1):
+            try:
+                result["response"], result["provider"], result["model"] = await self.call(item)
+                break
+            except LlmOverloaded as e:
+                # Batch work has no caller waiting; back off and queue again
+                if attempt == BATCH_OVERLOAD_RETRIES:
+                    result["error"] = str(e)
+                    break
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {str(e)}" if str(e) else type(e).__name__
+                break
+        result["latency"] = round(time.perf_counter() - started, 3)
+        result["finished_at"] = datetime.now(timezone.utc)
+        return result
+
+    async def _flush(self, batch_id: str, results: List[Dict]) -> None:
+        messages: List[Dict] = []
+        item_updates: List[UpdateOne] = []
+        completed = failed = 0
+
+        for result in results:
+            item = result["item"]
+            update = {"latency": result["latency"], "finished_at": result["finished_at"]}
+            if "error" in result:
+                failed += 1
+                update.update({"status": "failed", "error": result["error"]})
+            else:
+                completed += 1
+                provider, model = result["provider"], result["model"]
+                requested = f"{item['model_provider']}/{item['model_name']}"
+                user_id = message_id(batch_id, item["index"], "user")
+                assistant_id = message_id(batch_id, item["index"], "assistant")
+                messages.append({
+                    "id": user_id,
+                    "role": "user",
+                    "content": item["prompt"],
+                    "timestamp": result["started_at"],
+                    "session_id": item["session_id"],
+                    "model_provider": item["model_provider"],
+                    "model_name": item["model_name"],
+                    "fallback_from": None
+                })
+                messages.append({
+                    "id": assistant_id,
+                    "role": "assistant",
+                    "content": result["response"],
+                    "timestamp": result["finished_at"],
+                    "session_id": item["session_id"],
+                    "model_provider": provider,
+                    "model_name": model,
+                    "fallback_from": requested if f"{provider}/{model}" != requested else None
+                })
+                update.update({
+                    "status": "completed",
+                    "response": result["response"],
+                    "answered_by": {"provider": provider, "model": model},
+                    "user_message_id": user_id,
+                    "assistant_message_id": assistant_id
+                })
+            item_updates.append(UpdateOne(
+                {"batch_id": batch_id, "index": item["index"], "status": "pending"}, {"$set": update}
+            ))
+
+        duplicates = set()
+        if messages:
+            try:
+                await self.db.chat_messages.insert_many(messages, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate ids are messages already stored before a restart
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                duplicates = {messages[error["index"]]["id"] for error in errors}
+
+        # Session and stats counters only count messages inserted just now
+        sessions: Dict[str, Dict] = {}
+        per_model: Dict[Tuple[str, str], List[datetime]] = {}
+        for message in messages:
+            if message["id"] in duplicates:
+                continue
+            session = sessions.setdefault(message["session_id"], {
+                "count": 0, "last": message["timestamp"], "provider": None, "model": None
+            })
+            session["count"] += 1
+            session["last"] = max(session["last"], message["timestamp"])
+            if message["role"] == "user":
+                session["provider"] = session["provider"] or message["model_provider"]
+                session["model"] = session["model"] or message["model_name"]
+            key = (message["model_provider"], message["model_name"])
+            per_model.setdefault(key, []).append(message["timestamp"])
+        writes = [self.db.chat_batch_items.bulk_write(item_updates, ordered=False)]
+        if sessions:
+            writes.append(self.db.chat_sessions.bulk_write([
+                UpdateOne(
+                    {"id": session_id},
+                    {
+                        "$setOnInsert": {
+                            "id": session_id,
+                            "title": f"Batch {batch_id[:8]}",
+                            "created_at": session["last"],
+                            "model_provider": session["provider"],
+                            "model_name": session["model"]
+                        },
+                        "$max": {"last_message_at": session["last"]},
+                        "$set": {"updated_at": datetime.now(timezone.utc)},
+                        "$inc": {"message_count": session["count"], "version": 1}
+                    },
+                    upsert=True
+                )
+                for session_id, session in sessions.items()
+            ], ordered=False))
+        writes.append(self.db.chat_batches.update_one(
+            self._held(batch_id), {"$inc": {"completed": completed, "failed": failed}}
+        ))
+        outcome = await asyncio.gather(*writes)
+        if sessions:
+            await versions.list_changed(self.db)
+            job = await self.db.chat_batches.find_one(
+                {"id": batch_id}, projection={"_id": 0, "model_provider": 1, "model_name": 1}
+            ) or {}
+            created = list(sessions.values())
+            for index in outcome[1].upserted_ids:
+                stats.record_session_created(
+                    self.db, job.get("model_provider"), job.get("model_name"), created[index]["last"]
+                )
+        for (provider, model), timestamps in per_model.items():
+            stats.record_messages(self.db, timestamps, provider, model)
+
+async def get_batch(db, batch_id: str) -> Optional[Dict]:
+    return await db.chat_batches.find_one({"id": batch_id}, projection={"_id": 0, "owner": 0, "lease_until": 0})
+
+async def watch_batch(db, batch_id: str, interval: float = 1.0) -> AsyncIterator[Dict]:
+    """Yield the job document whenever its progress changes, until it finishes"""
+    previous = None
+    while True:
+        job = await get_batch(db, batch_id)
+        if job is None:
+            return
+        state = (job["status"], job["completed"], job["failed"])
+        if state != previous:
+            previous = state
+            yield job
+        if job["status"] in TERMINAL_STATUSES:
+            return
+        await asyncio.sleep(interval)
+
+async def iter_results(db, batch_id: str) -> AsyncIterator[bytes]:
+    """Item outcomes as JSONL, in submission order"""
+    projection = {
+        "_id": 0, "index": 1, "custom_id": 1, "session_id": 1, "status": 1, "response": 1,
+        "error": 1, "answered_by": 1, "assistant_message_id": 1, "latency": 1
+    }
+    async for item in db.chat_batch_items.find({"batch_id": batch_id}, projection=projection).sort("index", 1):
+        yield orjson.dumps(item) + b"\n"
@@ -0,0 +1,78 @@
+from fastapi import WebSocket
+from typing import Dict, Set
+import asyncio
+import logging
+import orjson
+import os
+
+logger = logging.getLogger(__name__)
+
+# Generations one connection may run at once, across all its sessions
+WS_MAX_INFLIGHT = int(os.environ.get('WS_MAX_INFLIGHT', '4'))
+# Frames buffered for a slow client before the connection is dropped
+WS_SEND_QUEUE = int(os.environ.get('WS_SEND_QUEUE', '1000'))
+
+class Connection:
+    """One client socket with a buffered writer.
+
+    Frames are queued and written by a single task, so concurrent turns and
+    broadcasts never interleave sends; a client that falls
+    ``WS_SEND_QUEUE`` frames behind is disconnected.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.turns: Dict[str, asyncio.Task] = {}
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE)
+        self._writer = asyncio.create_task(self._write())
+
+    def send(self, frame: Dict) -> None:
+        try:
+            self._outbox.put_nowait(frame)
+        except asyncio.QueueFull:
+            logger.warning("WebSocket client too slow, closing connection")
+            self._writer.cancel()
+            asyncio.create_task(self.websocket.close(code=1013))
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                frame = await self._outbox.get()
+                await self.websocket.send_text(orjson.dumps(frame).decode())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket is gone; the receive loop notices and cleans up
+            logger.info(f"WebSocket send failed: {str(e)}")
+
+    async def close(self) -> None:
+        for task in list(self.turns.values()):
+            task.cancel()
+        await asyncio.gather(*self.turns.values(), return_exceptions=True)
+        self._writer.cancel()
+        await asyncio.gather(self._writer, return_exceptions=True)
+
+class ChatHub:
+    """Open WebSocket connections, for pushing session list changes to every client"""
+
+    def __init__(self):
+        self.connections: Set[Connection] = set()
+
+    def connect(self, websocket: WebSocket) -> Connection:
+        connection = Connection(websocket)
+        self.connections.add(connection)
+        return connection
+
+    async def disconnect(self, connection: Connection) -> None:
+        self.connections.discard(connection)
+        await connection.close()
+
+    def publish(self, frame: Dict) -> None:
+        for connection in list(self.connections):
+            connection.send(frame)
+
+    def stats(self) -> Dict:
+        return {
+            "connections": len(self.connections),
+            "inflight": sum(len(connection.turns) for connection in self.connections)
+        }
@@ -0,0 +1,160 @@
+from emergentintegrations.llm.chat import UserMessage
+from llm_scheduler import BATCH
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Token budget for replayed history, per model with a global fallback
+DEFAULT_CONTEXT_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '12000'))
+MODEL_CONTEXT_BUDGETS: Dict[str, int] = json.loads(os.environ.get('CONTEXT_TOKEN_BUDGETS', '{}'))
+CONTEXT_MAX_MESSAGES = int(os.environ.get('CONTEXT_MAX_MESSAGES', '200'))
+SUMMARIES_ENABLED = os.environ.get('CONTEXT_SUMMARIES_ENABLED', 'false').lower() == 'true'
+
+HISTORY_PROJECTION = {"_id": 0, "id": 1, "role": 1, "content": 1, "timestamp": 1}
+
+class ConversationContext(BaseModel):
+    """Windowed history to replay to the model for one turn"""
+    messages: List[Dict[str, str]] = []
+    summary: Optional[str] = None
+    # Id of the newest message in the window; a warm client that has seen
+    # exactly this message can skip the replay
+    marker: Optional[str] = None
+    token_count: int = 0
+    budget: int = DEFAULT_CONTEXT_BUDGET
+    # Newest message that fell out of the window and is not yet summarized
+    overflow_until: Optional[Any] = None
+    # Excerpts recalled from other sessions, sent along with the new prompt
+    recall: Optional[str] = None
+    # Pooled client that served the turn, for LlmClientPool.advance
+    client: Any = None
+
+    def fingerprint(self) -> str:
+        """Stable hash of everything the model sees besides the new prompt"""
+        if not self.messages and not self.summary and not self.recall:
+            return ""
+        payload = json.dumps([self.summary, self.messages] + ([self.recall] if self.recall else []), ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def prompt(self, message: str) -> str:
+        """The text sent to the model for the new user message"""
+        if not self.recall:
+            return message
+        return f"{self.recall}\n\nCurrent message:\n{message}"
+
+    def system_message(self, base: str) -> str:
+        if not self.summary:
+            return base
+        return f"{base}\n\nSummary of the earlier conversation:\n{self.summary}"
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token plus framing)"""
+    return len(text) // 4 + 4
+
+def context_budget(model_name: Optional[str]) -> int:
+    return MODEL_CONTEXT_BUDGETS.get(model_name or "", DEFAULT_CONTEXT_BUDGET)
+
+async def build_context(db, session: Optional[Dict], session_id: str, model_name: Optional[str],
+                        exclude_id: Optional[str] = None) -> ConversationContext:
+    """Load the newest turns of a session that fit the model's token budget.
+
+    History comes from one projected query over the (session_id, timestamp)
+    index, newest first. Turns already folded into the session's rolling
+    summary are skipped, and anything older than the budget allows is left
+    for the next summary refresh.
+    """
+    session = session or {}
+    budget = context_budget(model_name)
+    summary = session.get("context_summary")
+    query: Dict[str, Any] = {"session_id": session_id}
+    if summary and session.get("context_summary_until") is not None:
+        query["timestamp"] = {"$gt": session["context_summary_until"]}
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+
+    budget_left = budget - (estimate_tokens(summary) if summary else 0)
+    window: List[Dict] = []
+    overflow_until = None
+    cursor = db.chat_messages.find(query, projection=HISTORY_PROJECTION).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(CONTEXT_MAX_MESSAGES)
+    async for message in cursor:
+        cost = estimate_tokens(message["content"])
+        if cost > budget_left:
+            overflow_until = message["timestamp"]
+            break
+        budget_left -= cost
+        window.append(message)
+
+    window.reverse()
+    return ConversationContext(
+        messages=[{"role": m["role"], "content": m["content"]} for m in window],
+        summary=summary,
+        marker=window[-1]["id"] if window else None,
+        token_count=budget - budget_left,
+        budget=budget,
+        overflow_until=overflow_until,
+    )
+
+_summary_tasks: Dict[str, asyncio.Task] = {}
+
+def schedule_summary_refresh(db, llm_pool, session_id: str, context: ConversationContext,
+                             provider: str, model: str, scheduler=None) -> None:
+    """Fold turns that overflowed the window into the session's rolling summary"""
+    if not SUMMARIES_ENABLED or context.overflow_until is None:
+        return
+    if session_id in _summary_tasks:
+        return
+    task = asyncio.create_task(_refresh_summary(db, llm_pool, session_id, context, provider, model, scheduler))
+    _summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(session_id, None))
+
+async def _refresh_summary(db, llm_pool, session_id: str, context: ConversationContext,
+                           provider: str, model: str, scheduler=None) -> None:
+    try:
+        session = await db.chat_sessions.find_one(
+            {"id": session_id},
+            projection={"_id": 0, "context_summary": 1, "context_summary_until": 1}
+        ) or {}
+        query: Dict[str, Any] = {"session_id": session_id, "timestamp": {"$lte": context.overflow_until}}
+        previous_until = session.get("context_summary_until")
+        if previous_until is not None:
+            query["timestamp"]["$gt"] = previous_until
+
+        lines = []
+        async for message in db.chat_messages.find(query, projection=HISTORY_PROJECTION).sort("timestamp", 1):
+            lines.append(f"{message['role']}: {message['content']}")
+        if not lines:
+            return
+
+        prompt = (
+            "Update the running summary of this conversation. Keep facts, decisions, "
+            "open questions and code identifiers; drop pleasantries.\n\n"
+            f"Current summary:\n{session.get('context_summary') or '(none)'}\n\n"
+            "New turns:\n" + "\n".join(lines)
+        )
+        summarizer = llm_pool.create(
+            f"summary_{session_id}",
+            "You write compact conversation summaries for an AI assistant's memory.",
+            provider,
+            model
+        )
+        if scheduler is None:
+            summary = str(await summarizer.send_message(UserMessage(text=prompt)))
+        else:
+            # Background work; yields to interactive chat
+            async with scheduler.slot(provider, model, BATCH):
+                summary = str(await summarizer.send_message(UserMessage(text=prompt)))
+
+        # Only apply if no other worker advanced the summary meanwhile
+        await db.chat_sessions.update_one(
+            {"id": session_id, "context_summary_until": previous_until},
+            {"$set": {"context_summary": summary, "context_summary_until": context.overflow_until}}
+        )
+    except Exception as e:
+        logger.error(f"Summary refresh failed for session {session_id}: {str(e)}")
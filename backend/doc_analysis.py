@@ -0,0 +1,160 @@
+from datetime import datetime, timezone
+from emergentintegrations.llm.chat import UserMessage
+from llm_scheduler import BATCH
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_SYSTEM_MESSAGE = "You are AJ STUDIOZ AI document analyzer. Analyze uploaded documents and provide comprehensive insights."
+# Bump when the prompts change so stored chunk results are not reused
+ANALYSIS_PROMPT_VERSION = "v1"
+ANALYSIS_CHUNK_TOKENS = max(1, int(os.environ.get('ANALYSIS_CHUNK_TOKENS', '3000')))
+ANALYSIS_CONCURRENCY = max(1, int(os.environ.get('ANALYSIS_CONCURRENCY', '4')))
+# Partial analyses combined per reduce call; below 2 a reduce round would never shrink the layer
+ANALYSIS_REDUCE_FANIN = max(2, int(os.environ.get('ANALYSIS_REDUCE_FANIN', '8')))
+
+ProgressCallback = Callable[[str, int, int], Awaitable[None]]
+
+def split_into_chunks(text: str, chunk_tokens: int = ANALYSIS_CHUNK_TOKENS) -> List[str]:
+    """Split text into roughly token-sized chunks, preferring paragraph breaks"""
+    max_chars = chunk_tokens * 4
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            # Back off to the last paragraph or line break in the second half
+            for separator in ("\n\n", "\n", ". "):
+                cut = text.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
+def document_key(text: str, provider: str, model: str, chunk_tokens: int = ANALYSIS_CHUNK_TOKENS) -> str:
+    header = f"{ANALYSIS_PROMPT_VERSION}|{provider}|{model}|{chunk_tokens}|"
+    return hashlib.sha256(header.encode('utf-8') + text.encode('utf-8')).hexdigest()
+
+async def analyze_large_document(db, llm_pool, text: str, filename: str, provider: str, model: str,
+                                 on_progress: Optional[ProgressCallback] = None,
+                                 scheduler=None, queue_timeout: Optional[float] = None, policy=None) -> Dict:
+    """Map-reduce analysis of a document too large for one prompt.
+
+    Chunks are analyzed concurrently under a semaphore and each partial
+    result is stored in ``document_chunk_analyses`` as soon as it lands, so
+    a retry of the same document only re-runs the chunks that are missing.
+    The partials are then reduced, in groups if needed, into one report.
+    With a ``scheduler`` every call also waits for a batch-priority slot,
+    and with a ``policy`` it gets timeouts, retries and the circuit breaker.
+    Fallback models are not used here, since stored chunk results are keyed
+    by the requested model.
+    """
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    key = document_key(text, provider, model)
+    chunks = split_into_chunks(text)
+    if not chunks:
+        raise ValueError("Document has no text to analyze")
+
+    async def report(stage: str, done: int, total: int):
+        logger.info(f"Document {key[:12]} {stage}: {done}/{total}")
+        if on_progress is not None:
+            await on_progress(stage, done, total)
+
+    async def attempt(session_id: str, prompt: str, timeout: Optional[float]) -> str:
+        # Each call gets a fresh client so concurrent chunks never share history
+        chat = llm_pool.create(session_id, ANALYSIS_SYSTEM_MESSAGE, provider, model)
+        if scheduler is None:
+            return str(await asyncio.wait_for(chat.send_message(UserMessage(text=prompt)), timeout))
+        async with scheduler.slot(provider, model, BATCH, timeout=queue_timeout):
+            return str(await asyncio.wait_for(chat.send_message(UserMessage(text=prompt)), timeout))
+
+    async def ask(session_id: str, prompt: str) -> str:
+        if policy is None:
+            return await attempt(session_id, prompt, None)
+        result, _, _ = await policy.run(
+            provider, model, lambda _provider, _model, timeout: attempt(session_id, prompt, timeout),
+            allow_fallback=False
+        )
+        return result
+
+    # Resume from partial results left by an earlier attempt
+    partials: Dict[int, str] = {}
+    async for doc in db.document_chunk_analyses.find(
+        {"document_key": key}, projection={"_id": 0, "chunk_index": 1, "result": 1}
+    ):
+        partials[doc["chunk_index"]] = doc["result"]
+    resumed = len(partials)
+    await report("map", resumed, len(chunks))
+
+    semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+
+    async def analyze_chunk(index: int, chunk: str):
+        async with semaphore:
+            result = await ask(
+                f"analysis_{key[:12]}_{index}",
+                f"This is part {index + 1} of {len(chunks)} of the document '{filename}'. "
+                f"Extract the key points, facts, figures and open issues from this part:\n\n{chunk}"
+            )
+        await db.document_chunk_analyses.update_one(
+            {"document_key": key, "chunk_index": index},
+            {"$set": {
+                "result": result,
+                "filename": filename,
+                "model_provider": provider,
+                "model_name": model,
+                "created_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        partials[index] = result
+        await report("map", len(partials), len(chunks))
+
+    map_started = time.perf_counter()
+    await asyncio.gather(*(
+        analyze_chunk(index, chunk) for index, chunk in enumerate(chunks) if index not in partials
+    ))
+    timings["map"] = round(time.perf_counter() - map_started, 3)
+
+    # Reduce in groups until a single report remains
+    reduce_started = time.perf_counter()
+    layer = [partials[index] for index in range(len(chunks))]
+    round_number = 0
+    while len(layer) > 1 or round_number == 0:
+        groups = [layer[i:i + ANALYSIS_REDUCE_FANIN] for i in range(0, len(layer), ANALYSIS_REDUCE_FANIN)]
+        final = len(groups) == 1
+
+        async def reduce_group(index: int, group: List[str]) -> str:
+            notes = "\n\n".join(f"--- Notes {n + 1} ---\n{part}" for n, part in enumerate(group))
+            instruction = (
+                "Combine these notes on the document into one analysis with key insights, "
+                "a summary and recommendations."
+                if final else
+                "Merge these notes on consecutive parts of the document, keeping every key point."
+            )
+            async with semaphore:
+                return await ask(f"analysis_{key[:12]}_reduce_{round_number}_{index}",
+                                 f"{instruction} Document: '{filename}'.\n\n{notes}")
+
+        layer = list(await asyncio.gather(*(reduce_group(i, g) for i, g in enumerate(groups))))
+        round_number += 1
+        await report("reduce", round_number, round_number + (0 if final else 1))
+    timings["reduce"] = round(time.perf_counter() - reduce_started, 3)
+    timings["total"] = round(time.perf_counter() - started, 3)
+
+    return {
+        "analysis": layer[0],
+        "document_key": key,
+        "chunk_count": len(chunks),
+        "resumed_chunks": resumed,
+        "timings": timings,
+    }
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from typing import Dict, Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Filenames and sessions remembered per document, most recent last
+DOCUMENT_MAX_REFERENCES = int(os.environ.get('DOCUMENT_MAX_REFERENCES', '50'))
+# Extracted text above this many UTF-8 bytes is not cached; stays well under the 16MB document limit
+DOCUMENT_TEXT_CACHE_BYTES = int(os.environ.get('DOCUMENT_TEXT_CACHE_BYTES', str(8 * 1024 * 1024)))
+
+async def record_upload(db, content_hash: str, size: int, filename: Optional[str],
+                        content_type: Optional[str], kind: Optional[str], session_id: str) -> Dict:
+    """Register an upload in the content-addressed ``documents`` store.
+
+    One upsert per upload keeps the file metadata, the last
+    ``DOCUMENT_MAX_REFERENCES`` filenames and sessions it was seen under,
+    and hands back any text already extracted for the same bytes.
+    """
+    now = datetime.now(timezone.utc)
+    return await db.documents.find_one_and_update(
+        {"content_hash": content_hash},
+        {
+            "$setOnInsert": {
+                "content_hash": content_hash,
+                "size": size,
+                "kind": kind,
+                "content_type": content_type,
+                "first_seen_at": now
+            },
+            "$set": {"last_seen_at": now},
+            "$push": {
+                "filenames": {"$each": [filename], "$slice": -DOCUMENT_MAX_REFERENCES},
+                "sessions": {"$each": [session_id], "$slice": -DOCUMENT_MAX_REFERENCES}
+            },
+            "$inc": {"upload_count": 1}
+        },
+        projection={"_id": 0, "text": 1, "upload_count": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def store_text(db, content_hash: str, text: str) -> None:
+    """Cache extracted text on the document; too large or failing writes are skipped"""
+    size = len(text.encode('utf-8'))
+    if size > DOCUMENT_TEXT_CACHE_BYTES:
+        logger.info(f"Not caching text of document {content_hash[:12]}: {size} bytes")
+        return
+    try:
+        await db.documents.update_one({"content_hash": content_hash}, {"$set": {"text": text}})
+    except Exception as e:
+        # Only a cache; the analysis goes on with the text in hand
+        logger.warning(f"Failed to cache text of document {content_hash[:12]}: {str(e)}")
+
+async def find_reusable_analysis(db, content_hash: str, provider: str, model: str,
+                                 prompt_version: str, mode: str) -> Optional[Dict]:
+    """Latest stored analysis of the same bytes under the same model and prompt"""
+    return await db.document_analyses.find_one(
+        {
+            "content_hash": content_hash,
+            "model_provider": provider,
+            "model_name": model,
+            "prompt_version": prompt_version,
+            "mode": mode
+        },
+        projection={"_id": 0},
+        sort=[("created_at", -1)]
+    )
@@ -0,0 +1,181 @@
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, Optional
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+EXTRACTOR_PROCESSES = int(os.environ.get('EXTRACTOR_PROCESSES', '2'))
+# Upper bound on extracted text kept per document
+MAX_EXTRACTED_CHARS = int(os.environ.get('MAX_EXTRACTED_CHARS', '2000000'))
+# Uncompressed size allowed for a DOCX body; WordprocessingML markup outweighs its text many times over
+DOCX_MAX_XML_BYTES = int(os.environ.get('DOCX_MAX_XML_BYTES', str(MAX_EXTRACTED_CHARS * 16)))
+
+class ExtractionError(Exception):
+    pass
+
+# Extractors run in worker processes, so they take a path and return text
+def extract_pdf(path: str) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("PDF extraction requires the pypdf package")
+    reader = PdfReader(path)
+    pages = []
+    size = 0
+    for number, page in enumerate(reader.pages, start=1):
+        text = page.extract_text() or ""
+        pages.append(f"[Page {number}]\n{text}")
+        size += len(text)
+        if size >= MAX_EXTRACTED_CHARS:
+            break
+    return "\n\n".join(pages)
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def extract_docx(path: str) -> str:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            # Checked before and while inflating, as the declared size may lie
+            if archive.getinfo("word/document.xml").file_size > DOCX_MAX_XML_BYTES:
+                raise ExtractionError("DOCX document body is too large")
+            with archive.open("word/document.xml") as entry:
+                document = entry.read(DOCX_MAX_XML_BYTES + 1)
+    except (zipfile.BadZipFile, KeyError):
+        raise ExtractionError("Not a valid DOCX file")
+    if len(document) > DOCX_MAX_XML_BYTES:
+        raise ExtractionError("DOCX document body is too large")
+    paragraphs = []
+    for paragraph in ET.fromstring(document).iter(f"{_WORD_NS}p"):
+        text = "".join(node.text or "" for node in paragraph.iter(f"{_WORD_NS}t"))
+        if text:
+            paragraphs.append(text)
+    return "\n".join(paragraphs)
+
+class _HTMLTextParser(HTMLParser):
+    SKIP = {"script", "style", "noscript", "template"}
+    BLOCK = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skipping += 1
+        elif tag in self.BLOCK:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skipping:
+            self._skipping -= 1
+
+    def handle_data(self, data):
+        if not self._skipping and data.strip():
+            self.parts.append(data.strip() + " ")
+
+def _read_text(path: str) -> str:
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read(MAX_EXTRACTED_CHARS)
+
+def extract_html(path: str) -> str:
+    parser = _HTMLTextParser()
+    parser.feed(_read_text(path))
+    lines = (line.strip() for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+def extract_csv(path: str) -> str:
+    text = _read_text(path)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096])
+    except csv.Error:
+        dialect = csv.excel
+    rows = csv.reader(io.StringIO(text), dialect)
+    return "\n".join(" | ".join(cell.strip() for cell in row) for row in rows)
+
+def extract_json(path: str) -> str:
+    text = _read_text(path)
+    try:
+        return json.dumps(json.loads(text), indent=1, ensure_ascii=False)
+    except json.JSONDecodeError:
+        # Truncated or JSON Lines input; hand it over verbatim
+        return text
+
+def extract_plain(path: str) -> str:
+    return _read_text(path)
+
+EXTRACTORS: Dict[str, Callable[[str], str]] = {
+    "pdf": extract_pdf,
+    "docx": extract_docx,
+    "html": extract_html,
+    "csv": extract_csv,
+    "json": extract_json,
+    "markdown": extract_plain,
+    "text": extract_plain,
+}
+
+_EXTENSIONS = {
+    ".pdf": "pdf", ".docx": "docx", ".html": "html", ".htm": "html",
+    ".csv": "csv", ".json": "json", ".md": "markdown", ".markdown": "markdown", ".txt": "text",
+}
+_MIME_TYPES = {
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "text/html": "html",
+    "text/csv": "csv",
+    "application/json": "json",
+    "text/markdown": "markdown",
+}
+
+def detect_kind(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Pick an extractor by extension, then by MIME type"""
+    kind = _EXTENSIONS.get(Path(filename or "").suffix.lower())
+    if kind:
+        return kind
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in _MIME_TYPES:
+        return _MIME_TYPES[content_type]
+    if content_type.startswith("text/"):
+        return "text"
+    return None
+
+def needs_extraction(kind: Optional[str]) -> bool:
+    """Plain text and Markdown are decoded while streaming instead"""
+    return kind is not None and kind not in ("text", "markdown")
+
+def _run_extractor(kind: str, path: str) -> str:
+    try:
+        return EXTRACTORS[kind](path)[:MAX_EXTRACTED_CHARS]
+    except ExtractionError:
+        raise
+    except Exception as e:
+        # Parser errors from malformed files; report them uniformly
+        raise ExtractionError(f"Failed to parse {kind} file: {str(e)}")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Forking would copy the event loop and Mongo driver threads of this process
+        _executor = ProcessPoolExecutor(max_workers=EXTRACTOR_PROCESSES,
+                                        mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def shutdown_extractors() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def extract_text(kind: str, path: Path) -> str:
+    """Run the extractor for ``kind`` in the process pool, off the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _run_extractor, kind, str(path))
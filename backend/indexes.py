@@ -0,0 +1,102 @@
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+from typing import Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Index definitions per collection. create_indexes is idempotent, so these
+# are safe to apply on every startup.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "chat_sessions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("last_message_at", DESCENDING), ("id", DESCENDING)], name="last_message_at_id_desc"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("title", TEXT)], name="title_text"),
+    ],
+    "chat_messages": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("session_id", ASCENDING), ("timestamp", ASCENDING), ("id", ASCENDING)], name="session_timestamp_id"),
+        # Recall index sync walks all messages by (timestamp, id)
+        IndexModel([("timestamp", ASCENDING), ("id", ASCENDING)], name="timestamp_id"),
+        IndexModel([("content", TEXT)], name="content_text"),
+    ],
+    "document_analyses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("session_id", ASCENDING), ("created_at", ASCENDING)], name="session_created_at"),
+        IndexModel([("created_at", ASCENDING), ("id", ASCENDING)], name="created_at_id"),
+        IndexModel(
+            [("content_hash", ASCENDING), ("model_provider", ASCENDING), ("model_name", ASCENDING),
+             ("prompt_version", ASCENDING), ("mode", ASCENDING), ("created_at", DESCENDING)],
+            name="reuse_lookup"
+        ),
+        IndexModel(
+            [("analysis_result", TEXT), ("filename", TEXT)],
+            name="analysis_text", weights={"filename": 3, "analysis_result": 1}
+        ),
+    ],
+    "documents": [
+        IndexModel([("content_hash", ASCENDING)], name="content_hash_unique", unique=True),
+    ],
+    "document_chunk_analyses": [
+        IndexModel([("document_key", ASCENDING), ("chunk_index", ASCENDING)], name="document_chunk_unique", unique=True),
+    ],
+    "chat_batches": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "chat_batch_items": [
+        IndexModel([("batch_id", ASCENDING), ("index", ASCENDING)], name="batch_index_unique", unique=True),
+    ],
+    "analysis_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+    ],
+    "chat_archives": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "stats_rollups": [
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket"),
+    ],
+}
+
+async def ensure_indexes(db) -> None:
+    """Create the indexes backing the hot queries in server.py"""
+    for collection, indexes in INDEXES.items():
+        try:
+            names = await db[collection].create_indexes(indexes)
+            logger.info(f"Indexes ready on {collection}: {', '.join(names)}")
+        except OperationFailure as e:
+            # Most likely duplicate ids in legacy data blocking a unique index
+            logger.error(f"Failed to create indexes on {collection}: {str(e)}")
+
+def _plan_stages(plan: Dict) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+async def verify_query_plans(db) -> Dict[str, bool]:
+    """Explain the hot queries and log any that fall back to a collection scan"""
+    probes = {
+        "session_by_id": db.chat_sessions.find({"id": ""}),
+        "messages_by_session": db.chat_messages.find({"session_id": ""}).sort("timestamp", 1),
+        "sessions_by_recency": db.chat_sessions.find().sort("last_message_at", -1).limit(50),
+        "sessions_created_since": db.chat_sessions.find({"created_at": {"$gte": ""}}),
+        "messages_text_search": db.chat_messages.find({"$text": {"$search": "probe"}}),
+    }
+    results = {}
+    for name, cursor in probes.items():
+        explanation = await cursor.explain()
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        uses_index = "COLLSCAN" not in stages
+        results[name] = uses_index
+        if uses_index:
+            logger.info(f"Query plan {name}: {' <- '.join(stages)}")
+        else:
+            logger.warning(f"Query plan {name} uses COLLSCAN: {' <- '.join(stages)}")
+    return results
@@ -0,0 +1,209 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from llm_scheduler import LlmOverloaded
+import asyncio
+import logging
+import math
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+# attempt(provider, model, timeout) performs one call against one model
+Attempt = Callable[[str, str, float], Awaitable[T]]
+
+# Exception class names raised by the provider SDKs for errors worth retrying
+_TRANSIENT_TYPES = {
+    "APIConnectionError", "APITimeoutError", "Timeout", "RateLimitError", "ServiceUnavailableError",
+    "InternalServerError", "APIError", "ConnectionError", "ClientConnectionError", "ServerDisconnectedError",
+}
+_TRANSIENT_MARKERS = (
+    "timeout", "timed out", "rate limit", "overloaded", "temporarily unavailable",
+    "service unavailable", "bad gateway", "connection reset",
+)
+
+def is_transient(error: BaseException) -> bool:
+    """Best-effort split between provider hiccups and errors a retry cannot fix"""
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in _TRANSIENT_TYPES:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in _TRANSIENT_MARKERS)
+
+class ProviderUnavailable(Exception):
+    """Every candidate model was skipped because its provider circuit is open"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one provider.
+
+    After ``failure_threshold`` transient failures in a row the circuit
+    opens and calls are refused for ``cooldown_seconds``; then a single
+    trial call is let through, which closes the circuit on success and
+    reopens it on failure.
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def retry_after(self) -> int:
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.cooldown_seconds - (time.monotonic() - self.opened_at)))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.trial_in_flight:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+        self.trial_in_flight = False
+
+    def release(self) -> None:
+        """Give back a half-open trial that ended without a verdict"""
+        self.trial_in_flight = False
+
+class LlmPolicy:
+    """Timeout, retry, circuit breaker and fallback rules for model calls.
+
+    ``run`` tries the requested model and then, when fallback is allowed,
+    the configured fallback model of each other provider in
+    ``fallback_chain`` order. Transient errors are retried with full-jitter
+    exponential backoff and count against the provider's breaker; other
+    errors are raised straight away. A local LlmOverloaded moves on to the
+    next candidate without penalising the provider.
+    """
+
+    def __init__(self, timeouts: Optional[Dict[str, float]] = None, default_timeout: float = 60,
+                 max_retries: int = 2, base_delay: float = 0.5, max_delay: float = 8,
+                 fallback_chain: Optional[List[str]] = None, fallback_models: Optional[Dict[str, str]] = None,
+                 breaker_failures: int = 5, breaker_cooldown: float = 30):
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.fallback_chain = fallback_chain or []
+        self.fallback_models = fallback_models or {}
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+        self.fallbacks = 0
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = self._breakers[provider] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+        return breaker
+
+    def timeout_for(self, provider: str, model: str) -> float:
+        """Per-model timeout, keyed "provider/model", then by provider"""
+        return self.timeouts.get(f"{provider}/{model}", self.timeouts.get(provider, self.default_timeout))
+
+    def candidates(self, provider: str, model: str, allow_fallback: bool = True) -> List[Tuple[str, str]]:
+        chain = [(provider, model)]
+        if allow_fallback:
+            for fallback in self.fallback_chain:
+                if fallback != provider and fallback in self.fallback_models:
+                    chain.append((fallback, self.fallback_models[fallback]))
+        return chain
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    async def run(self, provider: str, model: str, attempt: Attempt, allow_fallback: bool = True,
+                  can_retry: Callable[[], bool] = lambda: True) -> Tuple[T, str, str]:
+        """Run ``attempt`` under the policy; returns (result, provider, model) of the call that succeeded.
+
+        ``can_retry`` is consulted before every retry or fallback, so a
+        streaming caller can stop once output has reached the client.
+        """
+        last_error: Optional[BaseException] = None
+        skipped: List[CircuitBreaker] = []
+        for index, (candidate_provider, candidate_model) in enumerate(self.candidates(provider, model, allow_fallback)):
+            if index > 0:
+                if not can_retry():
+                    break
+                self.fallbacks += 1
+                logger.warning(f"Falling back from {provider}/{model} to {candidate_provider}/{candidate_model}")
+            breaker = self.breaker(candidate_provider)
+            timeout = self.timeout_for(candidate_provider, candidate_model)
+            for retry in range(self.max_retries + 1):
+                if not breaker.allow():
+                    skipped.append(breaker)
+                    break
+                try:
+                    result = await attempt(candidate_provider, candidate_model, timeout)
+                except LlmOverloaded as e:
+                    breaker.release()
+                    last_error = e
+                    break
+                except Exception as e:
+                    if not is_transient(e):
+                        breaker.release()
+                        raise
+                    breaker.record_failure()
+                    last_error = e
+                    logger.warning(f"LLM call to {candidate_provider}/{candidate_model} failed "
+                                   f"(attempt {retry + 1}): {type(e).__name__}: {str(e)}")
+                    if retry == self.max_retries or not can_retry():
+                        break
+                    self.retries += 1
+                    await asyncio.sleep(self.backoff(retry))
+                except BaseException:
+                    breaker.release()
+                    raise
+                else:
+                    breaker.record_success()
+                    return result, candidate_provider, candidate_model
+            if last_error is not None and not can_retry():
+                break
+        if last_error is not None:
+            raise last_error
+        raise ProviderUnavailable(
+            f"Provider circuit open for {provider}",
+            min(breaker.retry_after() for breaker in skipped) if skipped else 1
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "retries": self.retries,
+            "fallbacks": self.fallbacks,
+            "fallback_chain": self.fallback_chain,
+            "breakers": {
+                provider: {"state": breaker.state, "failures": breaker.failures, "trips": breaker.trips}
+                for provider, breaker in self._breakers.items()
+            }
+        }
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from emergentintegrations.llm.chat import LlmChat
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import time
+
+PoolKey = Tuple[str, str, str, str]
+
+# Marker held while a turn is in flight; a failed turn leaves it in place so
+# the half-updated client is rebuilt rather than reused
+IN_FLIGHT = object()
+
+class PoolEntry:
+    __slots__ = ("client", "last_used", "marker", "tokens", "superseded")
+
+    def __init__(self, client: LlmChat, last_used: float, marker: object, tokens: int):
+        self.client = client
+        self.last_used = last_used
+        # Id of the newest persisted message this client has seen
+        self.marker = marker
+        self.tokens = tokens
+        # Another turn of the session was stored while this one was in flight
+        self.superseded = False
+
+class LlmClientPool:
+    """Bounded LRU registry of configured LLM clients with idle expiry.
+
+    Clients are keyed by (session_id, provider, model, system message hash),
+    so a session keeps talking to the same warm instance, along with its
+    HTTP connections and in-memory conversation state, until it is evicted
+    for size or has been idle for longer than ``ttl_seconds``.
+
+    When a server-side context is supplied, a warm client is only reused if
+    it has seen exactly the persisted history and stays within the token
+    budget; otherwise it is rebuilt with the windowed history replayed.
+    Turns of one session may overlap (e.g. over the WebSocket), so
+    ``advance`` only credits the client that served the turn, and only if
+    no other turn of the session was stored meanwhile.
+    """
+
+    def __init__(self, api_key: Optional[str], max_size: int = 256, ttl_seconds: float = 900):
+        self.api_key = api_key
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clients: "OrderedDict[PoolKey, PoolEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(session_id: str, provider: str, model: str, system_message: str) -> PoolKey:
+        digest = hashlib.sha256(system_message.encode('utf-8')).hexdigest()[:16]
+        return (session_id, provider, model, digest)
+
+    def get(self, session_id: str, system_message: str, provider: str, model: str, context=None) -> LlmChat:
+        """Return a pooled client, creating and registering one on a miss"""
+        key = self.make_key(session_id, provider, model, system_message)
+        now = time.monotonic()
+
+        entry = self._clients.get(key)
+        if entry is not None:
+            if now - entry.last_used > self.ttl_seconds:
+                # Expired entries are dropped and rebuilt below
+                del self._clients[key]
+                self.evictions += 1
+            elif context is None or (entry.marker == context.marker and entry.tokens <= context.budget):
+                self.hits += 1
+                entry.last_used = now
+                if context is not None:
+                    entry.marker = IN_FLIGHT
+                self._clients.move_to_end(key)
+                return entry.client
+
+        self.misses += 1
+        client = self.create(
+            session_id, system_message, provider, model,
+            initial_messages=context.messages if context else None
+        )
+        self._clients[key] = PoolEntry(
+            client, now,
+            marker=IN_FLIGHT if context else None,
+            tokens=context.token_count if context else 0
+        )
+        self._clients.move_to_end(key)
+        self._evict(now)
+        return client
+
+    def create(self, session_id: str, system_message: str, provider: str, model: str,
+               initial_messages: Optional[List[Dict[str, str]]] = None) -> LlmChat:
+        """Build a client without registering it in the pool"""
+        kwargs = {"initial_messages": initial_messages} if initial_messages else {}
+        return LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message,
+            **kwargs
+        ).with_model(provider, model)
+
+    def advance(self, session_id: str, system_message: str, provider: str, model: str,
+                client: LlmChat, marker: str, tokens: int) -> None:
+        """Record that ``client``, as returned by ``get``, has seen a turn ending at ``marker``"""
+        entry = self._clients.get(self.make_key(session_id, provider, model, system_message))
+        self.turn_stored(session_id, client)
+        # A replaced entry's client never saw this reply, and a superseded one missed another turn's
+        if entry is not None and entry.client is client and not entry.superseded:
+            entry.marker = marker
+            entry.tokens += tokens
+
+    def turn_stored(self, session_id: str, client: Optional[LlmChat] = None) -> None:
+        """Note a stored turn: clients of the session still mid-turn, other than ``client``, missed it"""
+        for key, entry in self._clients.items():
+            if key[0] == session_id and entry.marker is IN_FLIGHT and entry.client is not client:
+                entry.superseded = True
+
+    def discard(self, session_id: str, system_message: str, provider: str, model: str) -> None:
+        self._clients.pop(self.make_key(session_id, provider, model, system_message), None)
+
+    def _evict(self, now: float) -> None:
+        # Oldest entries sit at the front, so stop at the first live one
+        while self._clients:
+            key, entry = next(iter(self._clients.items()))
+            if len(self._clients) <= self.max_size and now - entry.last_used <= self.ttl_seconds:
+                break
+            del self._clients[key]
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._clients),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,205 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import itertools
+import math
+import time
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+
+class LlmOverloaded(Exception):
+    """Raised when a call cannot get a slot: the queue is full or its deadline passed"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class _Lane:
+    __slots__ = ("limit", "active", "hold_seconds")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # Moving average of how long a call keeps its slot
+        self.hold_seconds = 1.0
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "provider", "model", "future", "enqueued")
+
+    def __init__(self, priority: int, seq: int, provider: str, model: str, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.provider = provider
+        self.model = model
+        self.future = future
+        self.enqueued = time.monotonic()
+
+class LlmScheduler:
+    """Admission control for outbound LLM calls.
+
+    Each call needs a free slot in both its provider lane and its model lane.
+    Calls that cannot start right away wait in one bounded queue ordered by
+    priority, then arrival; every release hands freed slots to the first
+    waiters that fit, so a saturated model does not hold up the others.
+    Batch work may only fill ``batch_share`` of a lane, which leaves
+    headroom for interactive chat. A full queue or a missed deadline raises
+    LlmOverloaded with a Retry-After estimate.
+    """
+
+    def __init__(self, provider_limits: Optional[Dict[str, int]] = None,
+                 model_limits: Optional[Dict[str, int]] = None,
+                 default_provider_limit: int = 16, default_model_limit: int = 8,
+                 max_queue: int = 256, batch_share: float = 0.75):
+        self.provider_limits = provider_limits or {}
+        self.model_limits = model_limits or {}
+        self.default_provider_limit = default_provider_limit
+        self.default_model_limit = default_model_limit
+        self.max_queue = max_queue
+        self.batch_share = batch_share
+        self._lanes: Dict[str, _Lane] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_samples: deque = deque(maxlen=1024)
+        self._max_wait = 0.0
+
+    def _lane(self, kind: str, name: str) -> _Lane:
+        key = f"{kind}:{name}"
+        lane = self._lanes.get(key)
+        if lane is None:
+            if kind == "provider":
+                limit = self.provider_limits.get(name, self.default_provider_limit)
+            else:
+                limit = self.model_limits.get(name, self.default_model_limit)
+            lane = self._lanes[key] = _Lane(max(1, limit))
+        return lane
+
+    def _lanes_for(self, provider: str, model: str) -> List[_Lane]:
+        return [self._lane("provider", provider), self._lane("model", f"{provider}/{model}")]
+
+    def _fits(self, lanes: List[_Lane], priority: int) -> bool:
+        for lane in lanes:
+            capacity = lane.limit if priority == INTERACTIVE else max(1, int(lane.limit * self.batch_share))
+            if lane.active >= capacity:
+                return False
+        return True
+
+    def _record_wait(self, waited: float) -> None:
+        self.admitted += 1
+        self._wait_samples.append(waited)
+        self._max_wait = max(self._max_wait, waited)
+
+    def _dispatch(self) -> None:
+        """Start every queued call that now fits, in priority order"""
+        for waiter in list(self._waiters):
+            if waiter.future.done():
+                self._waiters.remove(waiter)
+                continue
+            lanes = self._lanes_for(waiter.provider, waiter.model)
+            if self._fits(lanes, waiter.priority):
+                self._waiters.remove(waiter)
+                for lane in lanes:
+                    lane.active += 1
+                self._record_wait(time.monotonic() - waiter.enqueued)
+                waiter.future.set_result(None)
+
+    def _release(self, provider: str, model: str, held: Optional[float] = None) -> None:
+        for lane in self._lanes_for(provider, model):
+            lane.active -= 1
+            if held is not None:
+                lane.hold_seconds = 0.8 * lane.hold_seconds + 0.2 * held
+        self._dispatch()
+
+    def retry_after(self, provider: str) -> int:
+        """Rough seconds until a queued call for ``provider`` would start"""
+        lane = self._lane("provider", provider)
+        queued = sum(1 for waiter in self._waiters if waiter.provider == provider)
+        estimate = lane.hold_seconds * (queued / lane.limit + 1)
+        return min(60, max(1, math.ceil(estimate)))
+
+    async def acquire(self, provider: str, model: str, priority: int = INTERACTIVE,
+                      timeout: Optional[float] = None) -> None:
+        lanes = self._lanes_for(provider, model)
+        if self._fits(lanes, priority):
+            for lane in lanes:
+                lane.active += 1
+            self._record_wait(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise LlmOverloaded("LLM request queue is full", self.retry_after(provider))
+
+        waiter = _Waiter(priority, next(self._seq), provider, model, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._waiters.sort(key=lambda w: (w.priority, w.seq))
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise LlmOverloaded("Timed out waiting for an LLM slot", self.retry_after(provider))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        elif waiter.future.done() and not waiter.future.cancelled():
+            # Granted just as the caller gave up; hand the slot on
+            self._release(waiter.provider, waiter.model)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str, priority: int = INTERACTIVE,
+                   timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Hold a provider and model slot for the duration of the block"""
+        await self.acquire(provider, model, priority, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(provider, model, time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        waits = sorted(self._wait_samples)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1)
+
+        lanes = {}
+        for key, lane in self._lanes.items():
+            kind, name = key.split(":", 1)
+            if kind == "provider":
+                waiting = sum(1 for w in self._waiters if w.provider == name)
+            else:
+                waiting = sum(1 for w in self._waiters if f"{w.provider}/{w.model}" == name)
+            lanes[key] = {
+                "limit": lane.limit,
+                "active": lane.active,
+                "waiting": waiting,
+                "avg_hold_seconds": round(lane.hold_seconds, 3)
+            }
+        return {
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "queued_interactive": sum(1 for w in self._waiters if w.priority == INTERACTIVE),
+            "queued_batch": sum(1 for w in self._waiters if w.priority == BATCH),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": round(self._max_wait * 1000, 1)
+            },
+            "lanes": lanes
+        }
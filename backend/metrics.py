@@ -0,0 +1,211 @@
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pymongo import monitoring
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Labels = Tuple[Tuple[str, str], ...]
+
+# Requests slower than this are logged with their span breakdown and kept for /api/metrics/slow
+PROFILE_SLOW_REQUESTS = os.environ.get('PROFILE_SLOW_REQUESTS', 'false').lower() == 'true'
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '2000'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '1.0'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def _label_key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+class Histogram:
+    """Cumulative-bucket histogram per label set; safe to observe from driver threads"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[Labels, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items())
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._gauges: List[Tuple[str, str, Callable[[], List[Tuple[Dict[str, str], float]]]]] = []
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]]) -> None:
+        """Register a gauge whose samples are read from ``collect`` at scrape time"""
+        self._gauges.append((name, help_text, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, collect in self._gauges:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge"])
+            try:
+                lines.extend(f"{name}{_format_labels(_label_key(labels))} {value}" for labels, value in collect())
+            except Exception as e:
+                logger.error(f"Gauge {name} failed: {str(e)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP request latency by route")
+REQUEST_BYTES = registry.histogram("http_request_size_bytes", "HTTP request body size", SIZE_BUCKETS)
+RESPONSE_BYTES = registry.histogram("http_response_size_bytes", "HTTP response body size", SIZE_BUCKETS)
+SPAN_SECONDS = registry.histogram("app_span_duration_seconds", "Time spent in each step of a request")
+MONGO_SECONDS = registry.histogram("mongo_command_duration_seconds", "MongoDB command latency")
+MONGO_FAILURES = registry.counter("mongo_command_failures_total", "Failed MongoDB commands")
+
+class RequestTiming:
+    """Span durations collected while one request is handled"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+def begin_request() -> RequestTiming:
+    timing = RequestTiming()
+    _current_timing.set(timing)
+    return timing
+
+def record_span(name: str, seconds: float) -> None:
+    SPAN_SECONDS.observe(seconds, span=name)
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+async def timed(name: str, awaitable: Awaitable[T]) -> T:
+    """Await ``awaitable`` inside a span; handy inside asyncio.gather"""
+    with span(name):
+        return await awaitable
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Feeds driver-reported command latency into the mongo histogram.
+
+    The driver calls this from its own threads, outside the request's
+    context, so commands are aggregated globally rather than per request.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1_000_000, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1_000_000, command=event.command_name)
+        MONGO_FAILURES.inc(command=event.command_name)
+
+# Recent slow requests with their span breakdown
+slow_requests: deque = deque(maxlen=int(os.environ.get('PROFILE_SLOW_KEEP', '100')))
+
+def observe_request(method: str, route: str, status: int, timing: RequestTiming,
+                    request_bytes: Optional[int], response_bytes: Optional[int]) -> float:
+    total = time.perf_counter() - timing.started
+    REQUEST_SECONDS.observe(total, method=method, route=route, status=str(status))
+    if request_bytes is not None:
+        REQUEST_BYTES.observe(request_bytes, method=method, route=route)
+    if response_bytes is not None:
+        RESPONSE_BYTES.observe(response_bytes, method=method, route=route)
+    if PROFILE_SLOW_REQUESTS and total * 1000 >= PROFILE_SLOW_MS and random.random() < PROFILE_SAMPLE_RATE:
+        sample = {
+            "at": time.time(),
+            "method": method,
+            "route": route,
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "spans_ms": {name: round(seconds * 1000, 1) for name, seconds in timing.spans.items()},
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes
+        }
+        slow_requests.append(sample)
+        logger.warning(f"Slow request {method} {route} {sample['total_ms']}ms: {sample['spans_ms']}")
+    return total
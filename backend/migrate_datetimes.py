@@ -0,0 +1,59 @@
+"""Convert ISO string timestamps left by older releases into BSON dates.
+
+Usage: python migrate_datetimes.py [--dry-run]
+
+Each field is rewritten server-side with an update pipeline, touching only
+documents where it is still a string, so the script is safe to re-run and
+to run while the app is serving traffic.
+"""
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pathlib import Path
+from typing import Dict, List
+import asyncio
+import logging
+import os
+import sys
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "chat_sessions": ["created_at", "last_message_at", "context_summary_until"],
+    "chat_messages": ["timestamp"],
+    "document_analyses": ["created_at"],
+    "document_chunk_analyses": ["created_at"],
+    "documents": ["first_seen_at", "last_seen_at"],
+}
+
+async def migrate(db, dry_run: bool = False) -> Dict[str, int]:
+    """Rewrite every string-typed datetime field; returns documents changed per field"""
+    changed = {}
+    for collection, fields in DATETIME_FIELDS.items():
+        for field in fields:
+            query = {field: {"$type": "string"}}
+            name = f"{collection}.{field}"
+            if dry_run:
+                changed[name] = await db[collection].count_documents(query)
+                continue
+            result = await db[collection].update_many(query, [
+                {"$set": {field: {"$dateFromString": {"dateString": f"${field}", "onError": f"${field}"}}}}
+            ])
+            changed[name] = result.modified_count
+            logger.info(f"{name}: converted {result.modified_count} documents")
+    return changed
+
+async def main(dry_run: bool) -> None:
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        changed = await migrate(client[os.environ['DB_NAME']], dry_run)
+        for name, count in changed.items():
+            print(f"{name}: {count} {'to convert' if dry_run else 'converted'}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(main(dry_run="--dry-run" in sys.argv[1:]))
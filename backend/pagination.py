@@ -0,0 +1,54 @@
+from bson import json_util
+from fastapi import HTTPException
+from typing import Any, Dict, Optional, Tuple
+import base64
+
+def encode_cursor(value: Any, item_id: str) -> str:
+    """Build an opaque keyset cursor from a sort value and document id"""
+    # Extended JSON keeps datetimes as datetimes across the round trip
+    raw = json_util.dumps([value, item_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        value, item_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, item_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+async def fetch_keyset_page(collection, query: Dict, field: str, limit: int,
+                            before: Optional[str] = None, after: Optional[str] = None,
+                            projection: Optional[Dict] = None):
+    """Fetch one page of documents ordered by (field, id).
+
+    Pages walk towards older documents by default, or towards newer ones when
+    ``after`` is given. Returns the documents newest first together with the
+    cursor that continues in the same direction, or None on the last page.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    
+    key = decode_cursor(before or after) if (before or after) else None
+    return await fetch_keyset_range(collection, query, field, limit, key, newer=after is not None,
+                                    projection=projection)
+
+async def fetch_keyset_range(collection, query: Dict, field: str, limit: int,
+                             key: Optional[Tuple[Any, str]], newer: bool,
+                             projection: Optional[Dict] = None):
+    """Keyset scan strictly past ``key`` (a decoded cursor) in either direction"""
+    op, direction = ("$gt", 1) if newer else ("$lt", -1)
+    if key is not None:
+        value, item_id = key
+        query = {"$and": [query, {"$or": [
+            {field: {op: value}},
+            {field: value, "id": {op: item_id}}
+        ]}]}
+    
+    docs = await collection.find(query, projection=projection).sort([(field, direction), ("id", direction)]).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1][field], docs[-1]["id"])
+    if newer:
+        docs.reverse()
+    return docs, next_cursor
@@ -0,0 +1,474 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import fcntl
+import logging
+import numpy as np
+import orjson
+import os
+import re
+import shutil
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+RECALL_ENABLED = os.environ.get('RECALL_ENABLED', 'false').lower() == 'true'
+RECALL_INDEX_DIR = Path(os.environ.get('RECALL_INDEX_DIR', '/tmp/recall_index'))
+RECALL_DIMENSIONS = int(os.environ.get('RECALL_DIMENSIONS', '256'))
+RECALL_TOP_K = int(os.environ.get('RECALL_TOP_K', '3'))
+# Cosine similarity below which a hit is not worth injecting
+RECALL_MIN_SCORE = float(os.environ.get('RECALL_MIN_SCORE', '0.35'))
+RECALL_SNIPPET_CHARS = int(os.environ.get('RECALL_SNIPPET_CHARS', '500'))
+# Rows scored per matrix product
+RECALL_BLOCK_ROWS = int(os.environ.get('RECALL_BLOCK_ROWS', '65536'))
+RECALL_BACKFILL_BATCH = 1000
+# How often the owning process pulls new messages and analyses from Mongo
+RECALL_SYNC_SECONDS = float(os.environ.get('RECALL_SYNC_SECONDS', '10'))
+# Documents younger than this wait for the next sync, so late commits are not skipped
+RECALL_SYNC_LAG_SECONDS = float(os.environ.get('RECALL_SYNC_LAG_SECONDS', '30'))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+@lru_cache(maxsize=200_000)
+def _feature(token: str, dimensions: int) -> Tuple[int, float]:
+    """Bucket and sign of a token; CRC32 keeps them stable across processes"""
+    digest = zlib.crc32(token.encode('utf-8'))
+    return digest % dimensions, (1.0 if digest & 0x80000000 else -1.0)
+
+def session_code(session_id: Optional[str]) -> int:
+    return zlib.crc32((session_id or "").encode('utf-8'))
+
+class HashingVectorizer:
+    """Stateless text embedding: signed feature hashing of unigrams and bigrams.
+
+    Needs no vocabulary or model download, so vectors can be produced
+    offline and appended one at a time. Term counts are log-scaled and
+    each vector is L2-normalized, making dot products cosine similarities.
+    """
+
+    def __init__(self, dimensions: int = RECALL_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def transform(self, texts: Iterable[str]) -> np.ndarray:
+        texts = list(texts)
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for first, second in zip(tokens, tokens[1:]):
+                bigram = f"{first} {second}"
+                counts[bigram] = counts.get(bigram, 0) + 1
+            for token, count in counts.items():
+                index, sign = _feature(token, self.dimensions)
+                matrix[row, index] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+def _try_lock(path: Path):
+    """Exclusive non-blocking flock on ``path``; the open handle, or None if another process holds it"""
+    handle = path.open('a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+class VectorIndex:
+    """Append-only vector store backed by a memory-mapped float32 file.
+
+    ``vectors.f32`` holds one row per entry and grows by doubling;
+    ``rows.jsonl`` holds the matching (kind, id, session_id) records and is
+    written after the vector, so its length is the committed row count.
+    Search scores the rows block by block with one matrix product each and
+    keeps the running top k.
+
+    The files have a single writer: the process holding the flock on
+    ``index.lock``. Other processes on the host (e.g. further uvicorn
+    workers) map the same files read-only and pick up new rows with
+    ``refresh``; ``promote`` makes one of them the writer once the lock is
+    released.
+    """
+
+    def __init__(self, directory: Path, dimensions: int = RECALL_DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.count = 0
+        self.writable = False
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._rows: List[Tuple[str, str, Optional[str]]] = []
+        self._ids: Set[Tuple[str, str]] = set()
+        self._rows_offset = 0
+        self._sessions = np.zeros(0, dtype=np.int64)
+        self._lock = threading.Lock()
+        self._file_lock = None
+
+    @property
+    def _vector_path(self) -> Path:
+        return self.directory / "vectors.f32"
+
+    @property
+    def _rows_path(self) -> Path:
+        return self.directory / "rows.jsonl"
+
+    @property
+    def _state_path(self) -> Path:
+        return self.directory / "backfill.json"
+
+    def open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file_lock = _try_lock(self.directory / "index.lock")
+        with self._lock:
+            if self._file_lock is not None:
+                self._open_writer()
+            else:
+                self._rows, self._ids, self._rows_offset = [], set(), 0
+                self.count = 0
+                self._refresh()
+
+    def promote(self) -> bool:
+        """Become the writer if the previous one has released the lock"""
+        if self.writable:
+            return True
+        handle = _try_lock(self.directory / "index.lock")
+        if handle is None:
+            return False
+        with self._lock:
+            self._file_lock = handle
+            self._vectors = None
+            self._open_writer()
+        return True
+
+    def _read_rows(self, offset: int) -> Tuple[List[Tuple[str, str, Optional[str]]], int]:
+        """Complete rows from ``offset`` on, and the offset just past them"""
+        if not self._rows_path.exists():
+            return [], offset
+        with self._rows_path.open('rb') as handle:
+            handle.seek(offset)
+            data = handle.read()
+        rows = []
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                # Still being written, or torn by a crash
+                break
+            try:
+                kind, doc_id, session_id = orjson.loads(line)
+            except (orjson.JSONDecodeError, ValueError):
+                break
+            rows.append((kind, doc_id, session_id))
+            offset += len(line)
+        return rows, offset
+
+    def _stored_rows(self) -> int:
+        return self._vector_path.stat().st_size // (self.dimensions * 4) if self._vector_path.exists() else 0
+
+    def _open_writer(self) -> None:
+        # Private directories left behind by earlier versions that gave every worker its own index
+        for stale in self.directory.glob("worker-*"):
+            handle = _try_lock(stale / "index.lock") if stale.is_dir() else None
+            if handle is not None:
+                handle.close()
+                shutil.rmtree(stale, ignore_errors=True)
+        self.writable = True
+        stored = self._stored_rows()
+        rows = self._read_rows(0)[0][:stored]
+        self._rows = rows
+        self._ids = {(kind, doc_id) for kind, doc_id, _ in rows}
+        self.count = len(rows)
+        self._sessions = np.array([session_code(row[2]) for row in rows], dtype=np.int64)
+        self._resize(max(stored, 4096))
+        # Rewrite the row file if it ran ahead of the vectors
+        with self._rows_path.open('wb') as handle:
+            handle.writelines(orjson.dumps(list(row)) + b"\n" for row in rows)
+
+    def refresh(self) -> int:
+        """Pick up rows the writer appended since the last call; returns how many"""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        if self.writable:
+            return 0
+        rows, offset = self._read_rows(self._rows_offset)
+        if not rows:
+            return 0
+        stored = self._stored_rows()
+        if stored > self._capacity:
+            self._vectors = np.memmap(self._vector_path, dtype=np.float32, mode='r', shape=(stored, self.dimensions))
+            self._capacity = stored
+        self._rows.extend(rows)
+        self._ids.update((kind, doc_id) for kind, doc_id, _ in rows)
+        self._sessions = np.concatenate([
+            self._sessions[:self.count], np.array([session_code(row[2]) for row in rows], dtype=np.int64)
+        ])
+        self._rows_offset = offset
+        self.count = len(self._rows)
+        return len(rows)
+
+    def _resize(self, capacity: int) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with self._vector_path.open('ab') as handle:
+            handle.truncate(capacity * self.dimensions * 4)
+        self._vectors = np.memmap(self._vector_path, dtype=np.float32, mode='r+', shape=(capacity, self.dimensions))
+        sessions = np.zeros(capacity, dtype=np.int64)
+        sessions[:self.count] = self._sessions[:self.count]
+        self._sessions = sessions
+        self._capacity = capacity
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self._ids
+
+    def append(self, rows: List[Tuple[str, str, Optional[str]]], vectors: np.ndarray) -> int:
+        """Append rows not indexed yet; returns how many were added"""
+        with self._lock:
+            if not self.writable:
+                raise RuntimeError("Recall index is read-only in this process")
+            keep = [i for i, row in enumerate(rows) if (row[0], row[1]) not in self._ids]
+            rows, vectors = [rows[i] for i in keep], vectors[keep]
+            if not rows:
+                return 0
+            needed = self.count + len(rows)
+            if needed > self._capacity:
+                capacity = self._capacity
+                while capacity < needed:
+                    capacity *= 2
+                self._resize(capacity)
+            self._vectors[self.count:needed] = vectors
+            self._vectors.flush()
+            with self._rows_path.open('ab') as handle:
+                handle.writelines(orjson.dumps(list(row)) + b"\n" for row in rows)
+            self._rows.extend(rows)
+            self._ids.update((kind, doc_id) for kind, doc_id, _ in rows)
+            self._sessions[self.count:needed] = [session_code(row[2]) for row in rows]
+            self.count = needed
+            return len(rows)
+
+    def search(self, vector: np.ndarray, k: int, exclude_session: Optional[str] = None,
+               min_score: float = 0.0) -> List[Tuple[float, Tuple[str, str, Optional[str]]]]:
+        """Top ``k`` rows by cosine similarity, optionally skipping one session's rows"""
+        with self._lock:
+            count = self.count
+            best_scores = np.zeros(0, dtype=np.float32)
+            best_rows = np.zeros(0, dtype=np.int64)
+            excluded = session_code(exclude_session) if exclude_session else None
+            for start in range(0, count, RECALL_BLOCK_ROWS):
+                end = min(count, start + RECALL_BLOCK_ROWS)
+                scores = self._vectors[start:end] @ vector
+                if excluded is not None:
+                    scores[self._sessions[start:end] == excluded] = -1.0
+                if len(scores) > k:
+                    top = np.argpartition(scores, -k)[-k:]
+                else:
+                    top = np.arange(len(scores))
+                best_scores = np.concatenate([best_scores, scores[top]])
+                best_rows = np.concatenate([best_rows, top + start])
+                if len(best_scores) > k:
+                    keep = np.argpartition(best_scores, -k)[-k:]
+                    best_scores, best_rows = best_scores[keep], best_rows[keep]
+            order = np.argsort(-best_scores)
+            return [
+                (float(best_scores[i]), self._rows[best_rows[i]])
+                for i in order if best_scores[i] >= min_score
+            ]
+
+    def backfill_state(self) -> Optional[Dict]:
+        if not self._state_path.exists():
+            return None
+        return orjson.loads(self._state_path.read_bytes())
+
+    def save_backfill_state(self, state: Dict) -> None:
+        # Written after the rows it covers, and replaced atomically
+        scratch = self._state_path.with_suffix(".tmp")
+        scratch.write_bytes(orjson.dumps(state))
+        os.replace(scratch, self._state_path)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                if self.writable:
+                    self._vectors.flush()
+                self._vectors = None
+            if self._file_lock is not None:
+                self._file_lock.close()
+                self._file_lock = None
+            self.writable = False
+
+class RecallIndex:
+    """Semantic recall over stored chat messages and document analyses.
+
+    Only the process that owns the index files ingests: it appends its own
+    chat turns and analyses as they happen and, every
+    ``RECALL_SYNC_SECONDS``, pulls everything else stored in Mongo past a
+    saved (date, id) watermark, which covers turns served by other workers.
+    Other processes only search, reloading the rows the owner added.
+    """
+
+    def __init__(self, directory: Path = RECALL_INDEX_DIR, dimensions: int = RECALL_DIMENSIONS):
+        self.vectorizer = HashingVectorizer(dimensions)
+        self.index = VectorIndex(directory, dimensions)
+        self._maintainer: Optional[asyncio.Task] = None
+
+    def open(self) -> None:
+        self.index.open()
+        if not self.index.writable:
+            logger.info(f"Recall index in {self.index.directory} is owned by another process; opened read-only")
+        logger.info(f"Recall index ready with {self.index.count} vectors")
+
+    def start(self, db) -> None:
+        """Keep the index in step with Mongo, or with the owning process"""
+        if self._maintainer is None:
+            self._maintainer = asyncio.create_task(self._maintain(db))
+
+    async def _maintain(self, db) -> None:
+        while True:
+            try:
+                if await asyncio.to_thread(self.index.promote):
+                    await self.sync(db)
+                else:
+                    await asyncio.to_thread(self.index.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Recall index sync failed: {str(e)}")
+            await asyncio.sleep(RECALL_SYNC_SECONDS)
+
+    def close(self) -> None:
+        if self._maintainer is not None:
+            self._maintainer.cancel()
+            self._maintainer = None
+        self.index.close()
+
+    def _append(self, items: List[Tuple[str, str, Optional[str], str]]) -> int:
+        items = [item for item in items if item[3] and item[3].strip() and item[:2] not in self.index]
+        if not items:
+            return 0
+        vectors = self.vectorizer.transform(item[3] for item in items)
+        return self.index.append([item[:3] for item in items], vectors)
+
+    async def add_messages(self, messages: List[Dict]) -> None:
+        if not self.index.writable:
+            # The owning process picks these up from Mongo
+            return
+        try:
+            await asyncio.to_thread(self._append, [
+                ("message", message["id"], message["session_id"], message["content"]) for message in messages
+            ])
+        except Exception as e:
+            logger.error(f"Recall index append failed: {str(e)}")
+
+    async def add_analysis(self, analysis: Dict) -> None:
+        if not self.index.writable:
+            return
+        try:
+            await asyncio.to_thread(self._append, [
+                ("analysis", analysis["id"], analysis["session_id"], analysis["analysis_result"])
+            ])
+        except Exception as e:
+            logger.error(f"Recall index append failed: {str(e)}")
+
+    async def sync(self, db) -> int:
+        """Index documents stored since the saved watermark.
+
+        Documents newer than ``RECALL_SYNC_LAG_SECONDS`` are left for the
+        next run, so writes from other workers that commit slightly out of
+        order are not skipped. The watermark is saved after every batch and
+        rows already indexed are skipped, so an interrupted run resumes
+        without duplicates.
+        """
+        state = self.index.backfill_state() or {}
+        cursors = state.get("cursors", {})
+        for kind, cursor in list(cursors.items()):
+            if cursor == "done":
+                # Written by the one-off backfill this replaced: indexed up to its cutoff
+                cursors[kind] = [state["until"], ""]
+        state = {"cursors": cursors}
+        upto = datetime.now(timezone.utc) - timedelta(seconds=RECALL_SYNC_LAG_SECONDS)
+        total = 0
+        sources = (
+            ("message", db.chat_messages, "timestamp", "content"),
+            ("analysis", db.document_analyses, "created_at", "analysis_result"),
+        )
+        for kind, collection, date_field, text_field in sources:
+            query: Dict = {date_field: {"$lt": upto}}
+            cursor = cursors.get(kind)
+            if cursor is not None:
+                after_date, after_id = datetime.fromisoformat(cursor[0]), cursor[1]
+                query["$or"] = [
+                    {date_field: {"$gt": after_date}},
+                    {date_field: after_date, "id": {"$gt": after_id}}
+                ]
+            batch: List[Tuple[str, str, Optional[str], str]] = []
+            async for doc in collection.find(
+                query, projection={"_id": 0, "id": 1, "session_id": 1, date_field: 1, text_field: 1}
+            ).sort([(date_field, 1), ("id", 1)]):
+                batch.append((kind, doc["id"], doc.get("session_id"), doc.get(text_field) or ""))
+                cursors[kind] = [doc[date_field].isoformat(), doc["id"]]
+                if len(batch) >= RECALL_BACKFILL_BATCH:
+                    total += await asyncio.to_thread(self._append, batch)
+                    batch = []
+                    self.index.save_backfill_state(state)
+            if batch:
+                total += await asyncio.to_thread(self._append, batch)
+            self.index.save_backfill_state(state)
+        if total:
+            logger.info(f"Recall index synced {total} entries from Mongo")
+        return total
+
+    async def recall(self, db, text: str, exclude_session: Optional[str] = None, k: int = RECALL_TOP_K,
+                     min_score: float = RECALL_MIN_SCORE) -> List[Dict]:
+        """Best matching earlier messages and analyses, with their stored text"""
+        def search():
+            return self.index.search(self.vectorizer.transform([text])[0], k, exclude_session, min_score)
+
+        hits = await asyncio.to_thread(search)
+        if not hits:
+            return []
+        message_ids = [row[1] for _, row in hits if row[0] == "message"]
+        analysis_ids = [row[1] for _, row in hits if row[0] == "analysis"]
+        messages, analyses = await asyncio.gather(
+            db.chat_messages.find(
+                {"id": {"$in": message_ids}},
+                projection={"_id": 0, "id": 1, "role": 1, "content": 1, "timestamp": 1}
+            ).to_list(len(message_ids)) if message_ids else asyncio.sleep(0, []),
+            db.document_analyses.find(
+                {"id": {"$in": analysis_ids}},
+                projection={"_id": 0, "id": 1, "filename": 1, "analysis_result": 1, "created_at": 1}
+            ).to_list(len(analysis_ids)) if analysis_ids else asyncio.sleep(0, [])
+        )
+        docs = {doc["id"]: doc for doc in messages + analyses}
+        results = []
+        for score, (kind, doc_id, session_id) in hits:
+            doc = docs.get(doc_id)
+            if doc is None:
+                # Deleted since it was indexed
+                continue
+            results.append({
+                "type": kind,
+                "id": doc_id,
+                "session_id": session_id,
+                "score": round(score, 4),
+                "role": doc.get("role"),
+                "filename": doc.get("filename"),
+                "content": (doc.get("content") or doc.get("analysis_result") or "")[:RECALL_SNIPPET_CHARS],
+                "date": doc.get("timestamp") or doc.get("created_at")
+            })
+        return results
+
+def format_recall(hits: List[Dict]) -> Optional[str]:
+    """Render recalled snippets as a block to put in front of the prompt"""
+    if not hits:
+        return None
+    lines = []
+    for hit in hits:
+        source = f"document {hit['filename']}" if hit["type"] == "analysis" else hit["role"]
+        lines.append(f"[{source}] {hit['content']}")
+    return "Possibly relevant excerpts from earlier conversations:\n" + "\n".join(lines)
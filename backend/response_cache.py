@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from typing import Dict, Optional
+import hashlib
+import json
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS_CONFLICT = 85
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+def normalize_prompt(text: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivial variants share a key"""
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+def cache_key(prompt: str, system_message: str, provider: str, model: str,
+              context_hash: Optional[str] = None) -> str:
+    payload = json.dumps(
+        [normalize_prompt(prompt), system_message.strip(), provider, model, context_hash or ""],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """Two-tier cache of model responses.
+
+    The in-process LRU answers repeat prompts on the same worker; the
+    optional Mongo tier shares entries across workers and expires them with
+    a TTL index on ``created_at``.
+    """
+
+    def __init__(self, db=None, max_entries: int = 1024, ttl_seconds: int = 3600):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self) -> None:
+        if self.db is None:
+            return
+        await self.db.response_cache.create_indexes([
+            IndexModel([("key", ASCENDING)], name="key_unique", unique=True),
+        ])
+        try:
+            await self.db.response_cache.create_indexes([
+                IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=self.ttl_seconds),
+            ])
+        except OperationFailure as e:
+            if e.code != INDEX_OPTIONS_CONFLICT:
+                raise
+            # RESPONSE_CACHE_TTL_SECONDS changed since the index was built; update it in place
+            await self.db.command(
+                "collMod", "response_cache",
+                index={"name": "created_at_ttl", "expireAfterSeconds": self.ttl_seconds}
+            )
+            logger.info(f"Response cache TTL index updated to {self.ttl_seconds}s")
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            response, stored_at = entry
+            if now - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._entries[key]
+
+        if self.db is not None:
+            doc = await self.db.response_cache.find_one({"key": key}, projection={"_id": 0, "response": 1})
+            if doc:
+                self._remember(key, doc["response"], now)
+                self.hits += 1
+                return doc["response"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: str, model_info: Dict) -> None:
+        self._remember(key, response, time.monotonic())
+        if self.db is None:
+            return
+        try:
+            await self.db.response_cache.update_one(
+                {"key": key},
+                {"$set": {
+                    "response": response,
+                    "model_provider": model_info.get("provider"),
+                    "model_name": model_info.get("model"),
+                    "created_at": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            # The cache is best effort; a failed write must not fail the turn
+            logger.warning(f"Response cache write failed: {str(e)}")
+
+    def _remember(self, key: str, response: str, now: float) -> None:
+        self._entries[key] = (response, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared": self.db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,293 @@
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import BulkWriteError
+from typing import Dict, List, Optional
+import asyncio
+import bson
+import gzip
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+RETENTION_ENABLED = os.environ.get('RETENTION_ENABLED', 'false').lower() == 'true'
+# Sessions without a message or a rehydration for this long are moved to the archive
+RETENTION_IDLE_DAYS = float(os.environ.get('RETENTION_IDLE_DAYS', '90'))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', '3600'))
+# Sessions archived per sweep query; a sweep keeps going until none are left
+RETENTION_BATCH = int(os.environ.get('RETENTION_BATCH', '100'))
+# Messages removed per delete_many when purging a deleted session
+RETENTION_DELETE_BATCH = int(os.environ.get('RETENTION_DELETE_BATCH', '1000'))
+# How long a purge keeps watching a deleted session for replies from turns that were in flight
+RETENTION_PURGE_GRACE_SECONDS = float(os.environ.get('RETENTION_PURGE_GRACE_SECONDS', '300'))
+# A rehydration claim older than this is considered abandoned and may be taken over
+REHYDRATE_CLAIM_SECONDS = float(os.environ.get('REHYDRATE_CLAIM_SECONDS', '60'))
+# zstd needs the zstandard package and falls back to gzip without it
+ARCHIVE_CODEC = os.environ.get('ARCHIVE_CODEC', 'zstd').lower()
+# Stays under the 16MB document limit; bigger sessions are left unarchived
+ARCHIVE_MAX_BLOB_BYTES = int(os.environ.get('ARCHIVE_MAX_BLOB_BYTES', str(15 * 1024 * 1024)))
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+def archive_codec() -> str:
+    if ARCHIVE_CODEC == 'zstd' and _zstd() is None:
+        return 'gzip'
+    return ARCHIVE_CODEC
+
+def compress(messages: List[Dict], codec: str) -> bytes:
+    """Messages as one BSON document, so datetimes survive the round trip, then compressed"""
+    raw = bson.encode({"messages": messages})
+    if codec == 'zstd':
+        return _zstd().ZstdCompressor(level=10).compress(raw)
+    return gzip.compress(raw, compresslevel=6)
+
+def decompress(blob: bytes, codec: str) -> List[Dict]:
+    if codec == 'zstd':
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError("Archive was written with zstd but the zstandard package is not installed")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    else:
+        raw = gzip.decompress(blob)
+    return bson.decode(raw)["messages"]
+
+class RetentionManager:
+    """Moves idle sessions to ``chat_archives`` and purges deleted ones.
+
+    Archiving keeps the session document (the session list and its ETags
+    are unaffected) but replaces its messages with one compressed blob and
+    marks the session ``archived_at``. Rehydrating a session stamps it
+    ``rehydrated_at``, which keeps it out of the sweep for another idle
+    period. Archived messages are not covered by full-text search or
+    recall until they are rehydrated. The archive is written before the
+    session is marked and messages are removed last, so a crash at any
+    point leaves every message readable; ``rehydrate`` tolerates messages
+    present in both places. Deleted sessions get a tombstone in
+    ``session_deletions`` until their messages are gone and in-flight
+    turns have had ``RETENTION_PURGE_GRACE_SECONDS`` to finish, so purges
+    interrupted by a shutdown are picked up by ``resume``.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._sweeper: Optional[asyncio.Task] = None
+        self._purges: Dict[str, asyncio.Task] = {}
+        self.archived = 0
+        self.rehydrated = 0
+
+    def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            try:
+                archived = await self.sweep()
+                if archived:
+                    logger.info(f"Archived {archived} idle sessions")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {str(e)}")
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+    async def sweep(self, idle_days: float = RETENTION_IDLE_DAYS) -> int:
+        """Archive every session idle for more than ``idle_days``"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=idle_days)
+        archived = 0
+        skipped: List[str] = []
+        while True:
+            sessions = await self.db.chat_sessions.find(
+                {
+                    "last_message_at": {"$lt": cutoff},
+                    "archived_at": {"$exists": False},
+                    # Sessions someone opened recently would only be rehydrated again
+                    "rehydrated_at": {"$not": {"$gte": cutoff}},
+                    "id": {"$nin": skipped}
+                },
+                projection={"_id": 0, "id": 1, "last_message_at": 1}
+            ).limit(RETENTION_BATCH).to_list(RETENTION_BATCH)
+            if not sessions:
+                return archived
+            for session in sessions:
+                if await self.archive_session(session["id"], session["last_message_at"]):
+                    archived += 1
+                else:
+                    skipped.append(session["id"])
+
+    async def archive_session(self, session_id: str, last_message_at: datetime) -> bool:
+        messages = await self.db.chat_messages.find(
+            {"session_id": session_id}, projection={"_id": 0}
+        ).sort("timestamp", 1).to_list(length=None)
+        codec = archive_codec()
+        blob = await asyncio.to_thread(compress, messages, codec)
+        if len(blob) > ARCHIVE_MAX_BLOB_BYTES:
+            logger.warning(f"Session {session_id} too large to archive ({len(blob)} bytes compressed)")
+            return False
+        await self.db.chat_archives.replace_one(
+            {"session_id": session_id},
+            {
+                "session_id": session_id,
+                "codec": codec,
+                "messages": blob,
+                "message_count": len(messages),
+                "archived_at": datetime.now(timezone.utc)
+            },
+            upsert=True
+        )
+        # Only mark the session if nothing was written to it meanwhile
+        marked = await self.db.chat_sessions.update_one(
+            {"id": session_id, "last_message_at": last_message_at, "archived_at": {"$exists": False}},
+            {"$set": {"archived_at": datetime.now(timezone.utc)}}
+        )
+        if not marked.matched_count:
+            await self.db.chat_archives.delete_one({"session_id": session_id})
+            return False
+        ids = [message["id"] for message in messages]
+        for start in range(0, len(ids), RETENTION_DELETE_BATCH):
+            await self.db.chat_messages.delete_many({"id": {"$in": ids[start:start + RETENTION_DELETE_BATCH]}})
+        self.archived += 1
+        return True
+
+    async def rehydrate(self, session_id: str) -> int:
+        """Move an archived session's messages back into ``chat_messages``.
+
+        The caller that claims the archive document does the work; other
+        callers, in this or another process, wait until the archive is
+        gone. A claim abandoned by a crashed worker expires after
+        ``REHYDRATE_CLAIM_SECONDS``.
+        """
+        now = datetime.now(timezone.utc)
+        archive = await self.db.chat_archives.find_one_and_update(
+            {
+                "session_id": session_id,
+                "$or": [
+                    {"rehydrating_at": {"$exists": False}},
+                    {"rehydrating_at": {"$lt": now - timedelta(seconds=REHYDRATE_CLAIM_SECONDS)}}
+                ]
+            },
+            {"$set": {"rehydrating_at": now}}
+        )
+        if archive is None:
+            deadline = time.monotonic() + REHYDRATE_CLAIM_SECONDS
+            while await self.db.chat_archives.count_documents({"session_id": session_id}, limit=1):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Timed out waiting for session {session_id} to be rehydrated")
+                await asyncio.sleep(0.1)
+            # Nothing (left) to restore; the flag may be stale from an interrupted run
+            await self.db.chat_sessions.update_one(
+                {"id": session_id}, {"$unset": {"archived_at": ""}, "$set": {"rehydrated_at": now}}
+            )
+            return 0
+        messages = await asyncio.to_thread(decompress, archive["messages"], archive["codec"])
+        restored = 0
+        if messages:
+            try:
+                result = await self.db.chat_messages.insert_many(messages, ordered=False)
+                restored = len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Messages still in chat_messages from an interrupted archive or rehydrate run
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+                restored = e.details.get("nInserted", 0)
+        await self.db.chat_sessions.update_one(
+            {"id": session_id}, {"$unset": {"archived_at": ""}, "$set": {"rehydrated_at": now}}
+        )
+        await self.db.chat_archives.delete_one({"session_id": session_id})
+        self.rehydrated += 1
+        logger.info(f"Rehydrated {restored} messages for archived session {session_id}")
+        return restored
+
+    async def delete_session(self, session_id: str) -> Optional[Dict]:
+        """Remove the session now and purge its messages in the background.
+
+        Returns the deleted session document, or None if there was none.
+        """
+        await self.db.session_deletions.update_one(
+            {"_id": session_id},
+            {"$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        session = await self.db.chat_sessions.find_one_and_delete(
+            {"id": session_id},
+            projection={"_id": 0, "id": 1, "message_count": 1, "created_at": 1, "model_provider": 1, "model_name": 1}
+        )
+        self._start_purge(session_id)
+        return session
+
+    def _start_purge(self, session_id: str) -> None:
+        if session_id in self._purges:
+            return
+        task = asyncio.create_task(self._purge(session_id))
+        self._purges[session_id] = task
+        task.add_done_callback(lambda _: self._purges.pop(session_id, None))
+
+    async def _delete_messages(self, session_id: str) -> int:
+        deleted = 0
+        while True:
+            batch = await self.db.chat_messages.find(
+                {"session_id": session_id}, projection={"_id": 1}
+            ).limit(RETENTION_DELETE_BATCH).to_list(RETENTION_DELETE_BATCH)
+            if not batch:
+                return deleted
+            result = await self.db.chat_messages.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            deleted += result.deleted_count
+
+    async def _purge(self, session_id: str) -> None:
+        try:
+            tombstone = await self.db.session_deletions.find_one({"_id": session_id})
+            if tombstone is None:
+                return
+            await self.db.chat_archives.delete_one({"session_id": session_id})
+            deleted = await self._delete_messages(session_id)
+            # A turn in flight at delete time still writes its reply; sweep again once it must be over
+            deleted_at = tombstone["created_at"]
+            if deleted_at.tzinfo is None:
+                deleted_at = deleted_at.replace(tzinfo=timezone.utc)
+            settle = (deleted_at - datetime.now(timezone.utc)).total_seconds() + RETENTION_PURGE_GRACE_SECONDS
+            if settle > 0:
+                await asyncio.sleep(settle)
+            if await self.db.chat_sessions.find_one({"id": session_id}, projection={"_id": 1}) is None:
+                deleted += await self._delete_messages(session_id)
+            else:
+                # A new turn recreated the session under the same id; its messages stay
+                logger.info(f"Session {session_id} was recreated after its deletion")
+            await self.db.session_deletions.delete_one({"_id": session_id})
+            logger.info(f"Purged {deleted} messages of deleted session {session_id}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The tombstone stays, so the next resume retries
+            logger.error(f"Purge of session {session_id} failed: {str(e)}")
+
+    async def resume(self) -> int:
+        """Restart purges left unfinished by a previous process"""
+        pending = await self.db.session_deletions.find(projection={"_id": 1}).to_list(length=None)
+        for doc in pending:
+            self._start_purge(doc["_id"])
+        return len(pending)
+
+    async def shutdown(self) -> None:
+        tasks = list(self._purges.values())
+        if self._sweeper is not None:
+            tasks.append(self._sweeper)
+            self._sweeper = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": RETENTION_ENABLED,
+            "idle_days": RETENTION_IDLE_DAYS,
+            "codec": archive_codec(),
+            "archived": self.archived,
+            "rehydrated": self.rehydrated,
+            "pending_purges": len(self._purges)
+        }
@@ -0,0 +1,151 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import os
+import re
+
+SEARCH_SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS', '160'))
+# Deepest result a page may reach; each source is read up to offset + limit
+SEARCH_MAX_OFFSET = int(os.environ.get('SEARCH_MAX_OFFSET', '1000'))
+
+# Per source: collection, text field, date field used by the date filters, returned fields
+SOURCES: Dict[str, Dict] = {
+    "messages": {
+        "collection": "chat_messages",
+        "field": "content",
+        "date_field": "timestamp",
+        "projection": {"_id": 0, "id": 1, "session_id": 1, "role": 1, "content": 1, "timestamp": 1,
+                       "model_provider": 1, "model_name": 1},
+    },
+    "sessions": {
+        "collection": "chat_sessions",
+        "field": "title",
+        "date_field": "last_message_at",
+        "projection": {"_id": 0, "id": 1, "title": 1, "last_message_at": 1, "message_count": 1,
+                       "model_provider": 1, "model_name": 1},
+    },
+    "analyses": {
+        "collection": "document_analyses",
+        "field": "analysis_result",
+        "date_field": "created_at",
+        "projection": {"_id": 0, "id": 1, "session_id": 1, "filename": 1, "analysis_result": 1, "created_at": 1,
+                       "model_provider": 1, "model_name": 1},
+    },
+}
+
+_TERM_RE = re.compile(r'"([^"]+)"|(\S+)')
+
+def query_terms(q: str) -> List[str]:
+    """Words and quoted phrases of a $text query, without negated terms"""
+    terms = []
+    for phrase, word in _TERM_RE.findall(q):
+        term = phrase or word
+        if term.startswith("-"):
+            continue
+        term = term.strip().lower()
+        if term:
+            terms.append(term)
+    return terms
+
+def build_snippet(text: str, terms: List[str], width: int = SEARCH_SNIPPET_CHARS) -> Tuple[str, List[List[int]]]:
+    """A window of ``text`` around the first matching term, with [start, end] offsets of the matches in it.
+
+    Matching is a case-insensitive prefix match, which approximates the
+    stemming done by the text index closely enough for highlighting.
+    """
+    if not text:
+        return "", []
+    lowered = text.lower()
+    first = min((position for position in (lowered.find(term) for term in terms) if position != -1), default=0)
+    start = max(0, first - width // 3)
+    end = min(len(text), start + width)
+    start = max(0, end - width)
+    # Snap to word boundaries so the window does not cut words in half
+    if start > 0:
+        space = text.find(" ", start, first if first > start else end)
+        if space != -1:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        if space > start:
+            end = space
+    window = text[start:end]
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    snippet = prefix + window + suffix
+    highlights = []
+    lowered_window = window.lower()
+    for term in terms:
+        position = lowered_window.find(term)
+        while position != -1:
+            highlights.append([len(prefix) + position, len(prefix) + position + len(term)])
+            position = lowered_window.find(term, position + len(term))
+    highlights.sort()
+    return snippet, highlights
+
+def build_filter(source: Dict, q: str, provider: Optional[str], model: Optional[str],
+                 since: Optional[datetime], until: Optional[datetime], session_id: Optional[str]) -> Dict:
+    query: Dict = {"$text": {"$search": q}}
+    if provider:
+        query["model_provider"] = provider
+    if model:
+        query["model_name"] = model
+    if since or until:
+        dates = {}
+        if since:
+            dates["$gte"] = since
+        if until:
+            dates["$lt"] = until
+        query[source["date_field"]] = dates
+    if session_id:
+        query["id" if source["collection"] == "chat_sessions" else "session_id"] = session_id
+    return query
+
+def to_hit(kind: str, doc: Dict, terms: List[str]) -> Dict:
+    source = SOURCES[kind]
+    snippet, highlights = build_snippet(doc.pop(source["field"], ""), terms)
+    session_id = doc["id"] if kind == "sessions" else doc.get("session_id")
+    return {
+        "type": kind[:-1],
+        "id": doc["id"],
+        "session_id": session_id,
+        "score": round(doc.pop("score"), 4),
+        "snippet": snippet,
+        "highlights": highlights,
+        "date": doc.pop(source["date_field"], None),
+        **doc
+    }
+
+async def search(db, q: str, kinds: List[str], provider: Optional[str] = None, model: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 session_id: Optional[str] = None, limit: int = 20, offset: int = 0) -> Dict:
+    """Ranked hits across the requested sources, served by their text indexes.
+
+    Each source returns its best ``offset + limit`` matches sorted by text
+    score; the lists are merged by score and the requested page is cut
+    from the merge. Only the snippet of each matched text is returned.
+    Messages of archived sessions are not in ``chat_messages`` and so not
+    found until the session is rehydrated; its title still is.
+    """
+    terms = query_terms(q)
+    fetch = offset + limit + 1
+
+    async def run(kind: str) -> List[Dict]:
+        source = SOURCES[kind]
+        cursor = db[source["collection"]].find(
+            build_filter(source, q, provider, model, since, until, session_id),
+            projection={**source["projection"], "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(fetch)
+        return [to_hit(kind, doc, terms) async for doc in cursor]
+
+    results = await asyncio.gather(*(run(kind) for kind in kinds))
+    hits = sorted((hit for hits in results for hit in hits), key=lambda hit: hit["score"], reverse=True)
+    page = hits[offset:offset + limit]
+    return {
+        "query": q,
+        "results": page,
+        "offset": offset,
+        "limit": limit,
+        "has_more": len(hits) > offset + limit,
+        "next_offset": offset + limit if len(hits) > offset + limit else None
+    }
@@ -1,18 +1,48 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any, Dict
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, Any, Dict, AsyncIterator, Tuple
 from datetime import datetime, timezone, timedelta
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import os
 import logging
 import uuid
-import json
+import orjson
 from pathlib import Path
-import aiofiles
-import base64
+import hashlib
+from indexes import ensure_indexes, verify_query_plans
+from llm_pool import LlmClientPool
+from llm_scheduler import BATCH, INTERACTIVE, LlmOverloaded, LlmScheduler
+from llm_policy import LlmPolicy, ProviderUnavailable
+from context import ConversationContext, build_context, estimate_tokens, schedule_summary_refresh
+from response_cache import ResponseCache, cache_key
+from uploads import MAX_UPLOAD_BYTES, UploadTooLarge, read_upload
+from doc_analysis import ANALYSIS_PROMPT_VERSION, ANALYSIS_SYSTEM_MESSAGE, ProgressCallback, analyze_large_document
+from extractors import ExtractionError, detect_kind, extract_text, needs_extraction, shutdown_extractors
+from document_store import find_reusable_analysis, record_upload, store_text
+from analysis_jobs import (
+    TERMINAL_STATUSES as JOB_TERMINAL_STATUSES, AnalysisJobRunner, JobQueueFull, create_job, get_job, watch_job
+)
+from chat_batches import (
+    BATCH_MAX_BYTES, BatchFormatError, BatchRunner, create_batch, get_batch, iter_results, parse_batch, watch_batch
+)
+from recall import RECALL_ENABLED, RECALL_TOP_K, RecallIndex, format_recall
+from search import SEARCH_MAX_OFFSET, SOURCES as SEARCH_SOURCES, search
+from chat_ws import WS_MAX_INFLIGHT, ChatHub, Connection
+from retention import RETENTION_ENABLED, RetentionManager
+import stats
+import metrics
+import versions
+from metrics import MongoCommandListener, record_span, span, timed
+from pagination import fetch_keyset_page, fetch_keyset_range
+import time
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -20,11 +50,67 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Datetimes are stored as BSON dates and read back as timezone-aware UTC
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
 
+# Pooled LLM clients, reused across turns of the same session
+llm_pool = LlmClientPool(
+    api_key=os.environ.get('EMERGENT_LLM_KEY'),
+    max_size=int(os.environ.get('LLM_POOL_SIZE', '256')),
+    ttl_seconds=float(os.environ.get('LLM_POOL_TTL_SECONDS', '900'))
+)
+
+# Concurrency limits for outbound LLM calls; model limits are keyed "provider/model"
+llm_scheduler = LlmScheduler(
+    provider_limits=orjson.loads(os.environ.get('LLM_PROVIDER_CONCURRENCY', '{}')),
+    model_limits=orjson.loads(os.environ.get('LLM_MODEL_CONCURRENCY', '{}')),
+    default_provider_limit=int(os.environ.get('LLM_DEFAULT_PROVIDER_CONCURRENCY', '16')),
+    default_model_limit=int(os.environ.get('LLM_DEFAULT_MODEL_CONCURRENCY', '8')),
+    max_queue=int(os.environ.get('LLM_QUEUE_SIZE', '256')),
+    batch_share=float(os.environ.get('LLM_BATCH_SHARE', '0.75'))
+)
+# Longest a call may wait for a slot before it is refused
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', '15'))
+LLM_BATCH_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_BATCH_QUEUE_TIMEOUT_SECONDS', '120'))
+
+# Timeout, retry, circuit breaker and fallback rules for model calls.
+# LLM_FALLBACK_CHAIN is a comma-separated provider order, e.g. "anthropic,openai,gemini"
+llm_policy = LlmPolicy(
+    timeouts=orjson.loads(os.environ.get('LLM_TIMEOUTS', '{}')),
+    default_timeout=float(os.environ.get('LLM_TIMEOUT_SECONDS', '60')),
+    max_retries=int(os.environ.get('LLM_MAX_RETRIES', '2')),
+    base_delay=float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.5')),
+    max_delay=float(os.environ.get('LLM_RETRY_MAX_DELAY', '8')),
+    fallback_chain=[p.strip() for p in os.environ.get('LLM_FALLBACK_CHAIN', '').split(',') if p.strip()],
+    fallback_models=orjson.loads(os.environ.get('LLM_FALLBACK_MODELS', '{}')) or {
+        "anthropic": "claude-sonnet-4-20250514",
+        "openai": "gpt-4o",
+        "gemini": "gemini-2.0-flash"
+    },
+    breaker_failures=int(os.environ.get('LLM_BREAKER_FAILURES', '5')),
+    breaker_cooldown=float(os.environ.get('LLM_BREAKER_COOLDOWN_SECONDS', '30'))
+)
+
+# Opt-in cache of model responses for repeated prompts
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+response_cache = ResponseCache(
+    db=db if os.environ.get('RESPONSE_CACHE_SHARED', 'false').lower() == 'true' else None,
+    max_entries=int(os.environ.get('RESPONSE_CACHE_SIZE', '1024')),
+    ttl_seconds=int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '3600'))
+)
+
+# Open WebSocket connections, for pushing session list changes
+chat_hub = ChatHub()
+
+# Opt-in recall of related snippets from other sessions, from a local vector index
+recall_index = RecallIndex() if RECALL_ENABLED else None
+
+# Characters of document text included in the analysis prompt
+ANALYSIS_TEXT_LIMIT = int(os.environ.get('ANALYSIS_TEXT_LIMIT', '5000'))
+
 # FastAPI app setup
-app = FastAPI(title="AJ STUDIOZ - Agentic AI Platform", version="1.0.0")
+app = FastAPI(title="AJ STUDIOZ - Agentic AI Platform", version="1.0.0", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Configure logging
@@ -43,6 +129,8 @@ class ChatMessage(BaseModel):
     session_id: str
     model_provider: Optional[str] = None
     model_name: Optional[str] = None
+    # "provider/model" originally requested when a fallback model answered
+    fallback_from: Optional[str] = None
 
 class ChatSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -59,6 +147,10 @@ class ChatRequest(BaseModel):
     model_provider: Optional[str] = "anthropic"
     model_name: Optional[str] = "claude-sonnet-4-20250514"
     system_message: Optional[str] = "You are AJ STUDIOZ AI, a highly advanced agentic AI assistant specializing in web development, coding, analysis, and creative problem-solving. You provide comprehensive, accurate, and innovative solutions."
+    bypass_cache: bool = False
+    # Seconds this request may wait for an LLM slot; capped by LLM_QUEUE_TIMEOUT_SECONDS
+    deadline_seconds: Optional[float] = Field(None, gt=0)
+    allow_fallback: bool = True
 
 class DocumentAnalysis(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -67,28 +159,24 @@ class DocumentAnalysis(BaseModel):
     analysis_result: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     session_id: str
+    chunk_count: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None
+    content_hash: Optional[str] = None
+    model_provider: Optional[str] = None
+    model_name: Optional[str] = None
+    prompt_version: Optional[str] = None
+    mode: Optional[str] = None
 
 # Helper functions
-def prepare_for_mongo(data: Dict) -> Dict:
-    """Convert datetime objects to ISO strings for MongoDB storage"""
-    for key, value in data.items():
-        if isinstance(value, datetime):
-            data[key] = value.isoformat()
-    return data
-
-def parse_from_mongo(item: Dict) -> Dict:
-    """Parse datetime strings back to datetime objects and remove MongoDB _id"""
-    # Remove MongoDB ObjectId which causes serialization issues
-    if '_id' in item:
-        del item['_id']
-    
-    for key, value in item.items():
-        if key in ['timestamp', 'created_at', 'last_message_at'] and isinstance(value, str):
-            try:
-                item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-            except:
-                pass
-    return item
+# Fields returned by the listing endpoints; everything else stays in Mongo
+SESSION_LIST_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "created_at": 1, "last_message_at": 1,
+    "message_count": 1, "model_provider": 1, "model_name": 1
+}
+MESSAGE_PROJECTION = {
+    "_id": 0, "id": 1, "role": 1, "content": 1, "timestamp": 1,
+    "session_id": 1, "model_provider": 1, "model_name": 1, "fallback_from": 1
+}
 
 # API Routes
 
@@ -100,220 +188,1076 @@ async def root():
 async def health_check():
     return {"status": "healthy", "platform": "AJ STUDIOZ", "version": "1.0.0"}
 
+def sse_event(event: str, data: Dict) -> str:
+    """Encode a single Server-Sent Events frame"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+def build_session_title(message: str) -> str:
+    return message[:50] + "..." if len(message) > 50 else message
+
+async def ensure_session(request: ChatRequest, session_id: str) -> Dict:
+    """Fetch the chat session, creating it on its first message.
+
+    A single upsert with $setOnInsert both reads and creates, so two
+    concurrent first messages cannot create the session twice. The
+    pre-image tells whether this call created it.
+    """
+    session_data = ChatSession(
+        id=session_id,
+        title=build_session_title(request.message),
+        model_provider=request.model_provider,
+        model_name=request.model_name
+    ).dict()
+    try:
+        existing = await db.chat_sessions.find_one_and_update(
+            {"id": session_id},
+            {"$setOnInsert": session_data},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        if existing is not None:
+            return existing
+        stats.record_session_created(db, request.model_provider, request.model_name, session_data["created_at"])
+        session_data.pop('_id', None)
+        return session_data
+    except DuplicateKeyError:
+        # Lost the insert race against a concurrent upsert; the session exists now
+        return await db.chat_sessions.find_one({"id": session_id}, projection={"_id": 0})
+
+def queue_timeout(request: ChatRequest) -> float:
+    if request.deadline_seconds is None:
+        return LLM_QUEUE_TIMEOUT_SECONDS
+    return min(request.deadline_seconds, LLM_QUEUE_TIMEOUT_SECONDS)
+
+def overloaded_error(e: Exception) -> HTTPException:
+    """429 for local back-pressure, 503 when the provider circuits are open"""
+    status_code = 503 if isinstance(e, ProviderUnavailable) else 429
+    return HTTPException(status_code=status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def build_llm_chat(session_id: str, system_message: str, provider: str, model: str,
+                   context: Optional[ConversationContext] = None) -> LlmChat:
+    """Fetch a configured LLM client from the pool"""
+    if not llm_pool.api_key:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    chat = llm_pool.get(session_id, system_message, provider, model, context)
+    if context is not None:
+        # Attempts run one after another, so the last client fetched answered
+        context.client = chat
+    return chat
+
+async def recall_for_prompt(message: str, session_id: str) -> Optional[str]:
+    """Related snippets from other sessions; a failing lookup just means no recall"""
+    try:
+        return format_recall(await recall_index.recall(db, message, exclude_session=session_id))
+    except Exception as e:
+        logger.error(f"Recall lookup failed: {str(e)}")
+        return None
+
+async def count_user_message(session_id: str) -> None:
+    """Count a stored user message on its session, bumping the session and list versions"""
+    bump = versions.session_bump()
+    await db.chat_sessions.update_one(
+        {"id": session_id},
+        {"$set": bump["$set"], "$inc": {"message_count": 1, **bump["$inc"]}}
+    )
+    await versions.list_changed(db)
+
+async def prepare_chat_turn(request: ChatRequest, session_id: str):
+    """Store the user message and load the session history for the model"""
+    session, user_message = await asyncio.gather(
+        timed("session_lookup", ensure_session(request, session_id)),
+        timed("user_insert", store_user_message(request, session_id))
+    )
+    # Counted now, so turns that fail later still match what chat_messages holds
+    stats.record_messages(db, [user_message["timestamp"]], request.model_provider, request.model_name)
+    if session.get("archived_at"):
+        # History must be back in chat_messages before the context is built
+        await timed("rehydrate", retention_manager.rehydrate(session_id))
+    
+    # The session counter update for the stored user message overlaps the context load
+    if recall_index is not None:
+        context, recalled, _ = await asyncio.gather(
+            timed("context_load", build_context(db, session, session_id, request.model_name, exclude_id=user_message["id"])),
+            timed("recall", recall_for_prompt(request.message, session_id)),
+            count_user_message(session_id)
+        )
+        context.recall = recalled
+    else:
+        with span("context_load"):
+            context, _ = await asyncio.gather(
+                build_context(db, session, session_id, request.model_name, exclude_id=user_message["id"]),
+                count_user_message(session_id)
+            )
+    system_message = context.system_message(
+        request.system_message or "You are AJ STUDIOZ AI, a highly advanced agentic AI assistant."
+    )
+    return user_message, context, system_message
+
+async def lookup_cached_response(request: ChatRequest, context: ConversationContext,
+                                 system_message: str) -> Tuple[Optional[str], Optional[str]]:
+    """Return (cached response, cache key); the key is None when caching is off"""
+    if not RESPONSE_CACHE_ENABLED or request.bypass_cache:
+        return None, None
+    key = cache_key(request.message, system_message, request.model_provider, request.model_name, context.fingerprint())
+    with span("cache_lookup"):
+        return await response_cache.get(key), key
+
+def finish_chat_turn(request: ChatRequest, session_id: str, context: ConversationContext,
+                     system_message: str, user_message: Dict, ai_message: Dict, cached: bool = False):
+    """Sync the pooled client with the stored turn and refresh the summary if needed"""
+    if cached:
+        llm_pool.turn_stored(session_id)
+    else:
+        # The client that answered may be a fallback model's
+        llm_pool.advance(
+            session_id, system_message, ai_message["model_provider"], ai_message["model_name"],
+            client=context.client, marker=ai_message["id"],
+            tokens=estimate_tokens(user_message["content"]) + estimate_tokens(ai_message["content"])
+        )
+    schedule_summary_refresh(db, llm_pool, session_id, context, request.model_provider, request.model_name,
+                             scheduler=llm_scheduler)
+    if recall_index is not None:
+        stats.spawn(recall_index.add_messages([user_message, ai_message]))
+
+async def stream_ai_response(chat: LlmChat, message: UserMessage,
+                             idle_timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """Yield the reply as deltas.
+
+    emergentintegrations' ``LlmChat`` only exposes ``send_message``, so in
+    practice this is simulated streaming: one delta carrying the full
+    completion, sent once the provider has finished. Clients still get
+    the ``session`` event early, but time to first token equals the full
+    reply time. A client offering ``stream_message`` (an async iterator of
+    deltas) is streamed incrementally, with ``idle_timeout`` bounding the
+    wait for each delta rather than the whole reply.
+    """
+    stream_message = getattr(chat, "stream_message", None)
+    if stream_message is None:
+        yield str(await asyncio.wait_for(chat.send_message(message), idle_timeout))
+        return
+    deltas = stream_message(message).__aiter__()
+    while True:
+        try:
+            delta = await asyncio.wait_for(deltas.__anext__(), idle_timeout)
+        except StopAsyncIteration:
+            break
+        if delta:
+            yield str(delta)
+
+async def call_chat_model(request: ChatRequest, session_id: str, system_message: str,
+                          context: ConversationContext) -> Tuple[str, str, str]:
+    """Get a reply under the scheduler and call policy; returns (reply, provider, model)"""
+    message = UserMessage(text=context.prompt(request.message))
+    
+    async def attempt(provider: str, model: str, timeout: float) -> str:
+        async with llm_scheduler.slot(provider, model, INTERACTIVE, timeout=queue_timeout(request)):
+            chat = build_llm_chat(session_id, system_message, provider, model, context)
+            return str(await asyncio.wait_for(chat.send_message(message), timeout))
+    
+    with span("llm"):
+        return await llm_policy.run(request.model_provider, request.model_name, attempt,
+                                    allow_fallback=request.allow_fallback)
+
+async def stream_chat_model(request: ChatRequest, session_id: str, system_message: str,
+                            context: ConversationContext, chosen: Dict) -> AsyncIterator[str]:
+    """Stream a reply under the scheduler and call policy.
+
+    Retries and fallbacks only happen before the first delta is sent; the
+    model that answered is written to ``chosen``.
+    """
+    message = UserMessage(text=context.prompt(request.message))
+    deltas: asyncio.Queue = asyncio.Queue()
+    started = False
+    llm_started = time.perf_counter()
+    
+    async def attempt(provider: str, model: str, timeout: float) -> None:
+        nonlocal started
+        async with llm_scheduler.slot(provider, model, INTERACTIVE, timeout=queue_timeout(request)):
+            chat = build_llm_chat(session_id, system_message, provider, model, context)
+            async for delta in stream_ai_response(chat, message, idle_timeout=timeout):
+                started = True
+                await deltas.put(delta)
+    
+    async def produce():
+        try:
+            _, chosen["provider"], chosen["model"] = await llm_policy.run(
+                request.model_provider, request.model_name, attempt,
+                allow_fallback=request.allow_fallback, can_retry=lambda: not started
+            )
+        finally:
+            await deltas.put(None)
+    
+    producer = asyncio.create_task(produce())
+    first = True
+    try:
+        while (delta := await deltas.get()) is not None:
+            if first:
+                record_span("llm_ttft", time.perf_counter() - llm_started)
+                first = False
+            yield delta
+        await producer
+        record_span("llm", time.perf_counter() - llm_started)
+    finally:
+        # The client went away mid-stream
+        producer.cancel()
+
+async def store_message(message: ChatMessage) -> Dict:
+    """Insert a chat message and return the stored document"""
+    doc = message.dict()
+    await db.chat_messages.insert_one(doc)
+    doc.pop('_id', None)
+    return doc
+
+async def store_user_message(request: ChatRequest, session_id: str) -> Dict:
+    return await store_message(ChatMessage(
+        role="user",
+        content=request.message,
+        session_id=session_id,
+        model_provider=request.model_provider,
+        model_name=request.model_name
+    ))
+
+async def complete_chat_turn(request: ChatRequest, session_id: str, content: str,
+                             provider: Optional[str] = None, model: Optional[str] = None) -> Tuple[Dict, Dict]:
+    """Persist the assistant reply and bump the session counters.
+
+    ``provider``/``model`` name the model that actually answered when it
+    differs from the requested one. Returns the stored assistant message
+    and the updated session summary.
+    """
+    provider = provider or request.model_provider
+    model = model or request.model_name
+    requested = f"{request.model_provider}/{request.model_name}"
+    ai_message = ChatMessage(
+        role="assistant",
+        content=content,
+        session_id=session_id,
+        model_provider=provider,
+        model_name=model,
+        fallback_from=requested if f"{provider}/{model}" != requested else None
+    )
+    
+    # The session update also bumps its version, so it must follow the insert it covers
+    ai_message = await timed("assistant_insert", store_message(ai_message))
+    bump = versions.session_bump()
+    session = await timed("session_update", db.chat_sessions.find_one_and_update(
+        {"id": session_id},
+        {
+            "$set": {
+                "last_message_at": ai_message["timestamp"],
+                **bump["$set"]
+            },
+            # The user message was counted when it was stored
+            "$inc": {"message_count": 1, **bump["$inc"]}
+        },
+        projection={"_id": 0, "id": 1, "title": 1, "last_message_at": 1, "message_count": 1},
+        return_document=ReturnDocument.AFTER
+    ))
+    await versions.list_changed(db)
+    stats.record_messages(db, [ai_message["timestamp"]], provider, model)
+    if session:
+        chat_hub.publish({"type": "session_update", "session": session})
+    return ai_message, session
+
 # Chat API endpoints
-@api_router.post("/chat", response_model=Dict)
+@api_router.post("/chat")
 async def chat_with_ai(request: ChatRequest):
     try:
-        # Get or create session
+        # Get or create session, store the user message and load history
         session_id = request.session_id or str(uuid.uuid4())
+        user_message, context, system_message = await prepare_chat_turn(request, session_id)
         
-        # Check if session exists
-        session = await db.chat_sessions.find_one({"id": session_id})
-        if not session:
-            # Create new session
-            session_data = ChatSession(
-                id=session_id,
-                title=request.message[:50] + "..." if len(request.message) > 50 else request.message,
-                model_provider=request.model_provider,
-                model_name=request.model_name
-            )
-            await db.chat_sessions.insert_one(prepare_for_mongo(session_data.dict()))
-        
-        # Store user message
-        user_message = ChatMessage(
-            role="user",
-            content=request.message,
-            session_id=session_id,
-            model_provider=request.model_provider,
-            model_name=request.model_name
-        )
-        await db.chat_messages.insert_one(prepare_for_mongo(user_message.dict()))
+        cached_response, key = await lookup_cached_response(request, context, system_message)
+        provider, model = request.model_provider, request.model_name
+        if cached_response is not None:
+            ai_response = cached_response
+        else:
+            # Get AI response once the provider has capacity
+            ai_response, provider, model = await call_chat_model(request, session_id, system_message, context)
+            if key and (provider, model) == (request.model_provider, request.model_name):
+                await response_cache.set(key, str(ai_response), {"provider": provider, "model": model})
         
-        # Initialize AI chat with emergent LLM key
-        emergent_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not emergent_key:
-            raise HTTPException(status_code=500, detail="AI service not configured")
+        # Store AI response and update session
+        ai_message, session = await complete_chat_turn(request, session_id, str(ai_response), provider, model)
+        finish_chat_turn(request, session_id, context, system_message, user_message, ai_message,
+                         cached=cached_response is not None)
         
-        chat = LlmChat(
-            api_key=emergent_key,
-            session_id=session_id,
-            system_message=request.system_message or "You are AJ STUDIOZ AI, a highly advanced agentic AI assistant."
-        ).with_model(request.model_provider, request.model_name)
+        return {
+            "response": str(ai_response),
+            "session_id": session_id,
+            "model_info": {
+                "provider": provider,
+                "model": model,
+                "fallback_from": ai_message["fallback_from"]
+            },
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "user_message": user_message,
+            "assistant_message": ai_message,
+            "session": session,
+            "cached": cached_response is not None
+        }
         
-        # Create user message for AI
-        ai_user_message = UserMessage(text=request.message)
+    except (LlmOverloaded, ProviderUnavailable) as e:
+        logger.warning(f"Chat rejected: {str(e)}")
+        raise overloaded_error(e)
+    except asyncio.TimeoutError:
+        logger.error("Chat error: model call timed out")
+        raise HTTPException(status_code=504, detail="Model call timed out")
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
+
+async def chat_stream_events(request: ChatRequest, session_id: str) -> AsyncIterator[Tuple[str, Dict]]:
+    """Run one streamed chat turn as (event, data) pairs.
+
+    Yields ``session`` up front, ``delta`` as text arrives and ``done`` once
+    the assembled reply has been persisted, or a final ``error``. Shared by
+    the SSE endpoint and the WebSocket channel.
+    """
+    try:
+        yield "session", {"session_id": session_id}
         
-        # Get AI response
-        ai_response = await chat.send_message(ai_user_message)
+        user_message, context, system_message = await prepare_chat_turn(request, session_id)
         
-        # Store AI response
-        ai_message = ChatMessage(
-            role="assistant",
-            content=str(ai_response),
-            session_id=session_id,
-            model_provider=request.model_provider,
-            model_name=request.model_name
-        )
-        await db.chat_messages.insert_one(prepare_for_mongo(ai_message.dict()))
+        parts = []
+        chosen = {"provider": request.model_provider, "model": request.model_name}
+        cached_response, key = await lookup_cached_response(request, context, system_message)
+        if cached_response is not None:
+            parts.append(cached_response)
+            yield "delta", {"content": cached_response}
+        else:
+            # The scheduler slot is held until the provider finishes streaming
+            async for delta in stream_chat_model(request, session_id, system_message, context, chosen):
+                parts.append(delta)
+                yield "delta", {"content": delta}
+            if key and (chosen["provider"], chosen["model"]) == (request.model_provider, request.model_name):
+                await response_cache.set(key, "".join(parts), chosen)
         
-        # Update session
-        await db.chat_sessions.update_one(
-            {"id": session_id},
-            {
-                "$set": {
-                    "last_message_at": datetime.now(timezone.utc).isoformat()
-                },
-                "$inc": {"message_count": 2}  # user + assistant message
-            }
+        # Persist the assembled reply once the stream is complete
+        ai_message, session = await complete_chat_turn(
+            request, session_id, "".join(parts), chosen["provider"], chosen["model"]
         )
+        finish_chat_turn(request, session_id, context, system_message, user_message, ai_message,
+                         cached=cached_response is not None)
         
-        return {
-            "response": str(ai_response),
+        yield "done", {
+            "response": "".join(parts),
             "session_id": session_id,
             "model_info": {
-                "provider": request.model_provider,
-                "model": request.model_name
+                "provider": chosen["provider"],
+                "model": chosen["model"],
+                "fallback_from": ai_message["fallback_from"]
             },
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "user_message": user_message,
+            "assistant_message": ai_message,
+            "session": session,
+            "cached": cached_response is not None
         }
-        
+    except (LlmOverloaded, ProviderUnavailable) as e:
+        # Headers are already sent, so the back-off hint travels in the frame
+        logger.warning(f"Chat stream rejected: {str(e)}")
+        yield "error", {"detail": str(e), "status": overloaded_error(e).status_code, "retry_after": e.retry_after}
+    except asyncio.TimeoutError:
+        logger.error("Chat stream error: model call timed out")
+        yield "error", {"detail": "Model call timed out", "status": 504}
     except Exception as e:
-        logger.error(f"Chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Chat processing failed: {str(e)}")
+        logger.error(f"Chat stream error: {str(e)}")
+        yield "error", {"detail": f"Chat processing failed: {str(e)}"}
+
+@api_router.post("/chat/stream")
+async def chat_with_ai_stream(request: ChatRequest):
+    """Stream the assistant reply as Server-Sent Events.
+
+    Emits a ``session`` frame up front, ``delta`` frames as text arrives and
+    a final ``done`` frame once the assembled reply has been persisted.
+    """
+    if not llm_pool.api_key:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    async def event_stream():
+        async for event, data in chat_stream_events(request, session_id):
+            yield sse_event(event, data)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def run_socket_turn(connection: Connection, request_id: str, request: ChatRequest) -> None:
+    session_id = request.session_id or str(uuid.uuid4())
+    try:
+        async for event, data in chat_stream_events(request, session_id):
+            connection.send({"type": event, "request_id": request_id, **data})
+    except asyncio.CancelledError:
+        # Cancelling stops the provider stream and frees its scheduler slot
+        connection.send({"type": "cancelled", "request_id": request_id, "session_id": session_id})
+        raise
+    finally:
+        connection.turns.pop(request_id, None)
+
+@api_router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """Chat over one long-lived connection.
+
+    Client frames are JSON objects with a ``type``:
 
-@api_router.get("/chat/sessions", response_model=List[Dict])
-async def get_chat_sessions():
+    - ``chat``: a ChatRequest plus a client-chosen ``request_id``; answered
+      with ``session``, ``delta`` and ``done`` (or ``error``) frames tagged
+      with that id. Turns for different sessions run concurrently.
+    - ``cancel``: stops the generation with the given ``request_id``; a
+      ``cancelled`` frame confirms it.
+    - ``ping``: answered with ``pong``.
+
+    Every connection also receives ``session_update`` and
+    ``session_deleted`` frames whenever the session list changes.
+    """
+    await websocket.accept()
+    connection = chat_hub.connect(websocket)
     try:
-        sessions = await db.chat_sessions.find().sort("last_message_at", -1).to_list(length=50)
-        return [parse_from_mongo(session) for session in sessions]
+        while True:
+            try:
+                frame = orjson.loads(await websocket.receive_text())
+                kind = frame.get("type")
+                request_id = str(frame.get("request_id") or uuid.uuid4())
+            except (orjson.JSONDecodeError, AttributeError):
+                connection.send({"type": "error", "detail": "Frames must be JSON objects", "status": 400})
+                continue
+            
+            if kind == "chat":
+                if not llm_pool.api_key:
+                    connection.send({"type": "error", "request_id": request_id, "detail": "AI service not configured", "status": 500})
+                    continue
+                if request_id in connection.turns:
+                    connection.send({"type": "error", "request_id": request_id, "detail": "request_id already in use", "status": 409})
+                    continue
+                if len(connection.turns) >= WS_MAX_INFLIGHT:
+                    connection.send({"type": "error", "request_id": request_id,
+                                     "detail": f"At most {WS_MAX_INFLIGHT} generations per connection", "status": 429})
+                    continue
+                try:
+                    request = ChatRequest.model_validate({
+                        key: value for key, value in frame.items() if key not in ("type", "request_id")
+                    })
+                except ValidationError as e:
+                    error = e.errors()[0]
+                    connection.send({"type": "error", "request_id": request_id, "status": 422,
+                                     "detail": f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"})
+                    continue
+                connection.turns[request_id] = asyncio.create_task(run_socket_turn(connection, request_id, request))
+            elif kind == "cancel":
+                task = connection.turns.get(request_id)
+                if task is None:
+                    connection.send({"type": "error", "request_id": request_id, "detail": "No such generation", "status": 404})
+                else:
+                    task.cancel()
+            elif kind == "ping":
+                connection.send({"type": "pong"})
+            else:
+                connection.send({"type": "error", "request_id": request_id, "detail": f"Unknown frame type {kind!r}", "status": 400})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await chat_hub.disconnect(connection)
+
+@api_router.get("/chat/sessions")
+async def get_chat_sessions(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None
+):
+    """List sessions newest first.
+
+    Without paging parameters this returns the 50 most recent sessions as a
+    plain list. With ``limit``/``before``/``after`` it returns a page object
+    with ``items`` and ``next_cursor``. Responses carry an ETag from the
+    session list version; a matching If-None-Match gets 304 without
+    querying the sessions.
+    """
+    try:
+        version, modified = await versions.list_version(db)
+        headers = versions.validator_headers(versions.etag("l", version), modified)
+        if versions.is_not_modified(request.headers, headers["ETag"], modified):
+            return Response(status_code=304, headers=headers)
+        
+        if limit is None and before is None and after is None:
+            sessions = await db.chat_sessions.find(projection=SESSION_LIST_PROJECTION).sort("last_message_at", -1).to_list(length=50)
+            return ORJSONResponse(sessions, headers=headers)
+        
+        sessions, next_cursor = await fetch_keyset_page(
+            db.chat_sessions, {}, "last_message_at", limit or 50, before, after,
+            projection=SESSION_LIST_PROJECTION
+        )
+        return ORJSONResponse({"items": sessions, "next_cursor": next_cursor}, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching sessions: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch chat sessions")
 
-@api_router.get("/chat/sessions/{session_id}/messages", response_model=List[Dict])
-async def get_session_messages(session_id: str):
+@api_router.get("/chat/sessions/{session_id}/messages")
+async def get_session_messages(
+    request: Request,
+    session_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[str] = None
+):
+    """Return a session's messages in chronological order.
+
+    Without paging parameters this returns up to 1000 messages as a plain
+    list. With ``limit``/``before``/``after`` it returns a page object; the
+    first page holds the newest messages and ``next_cursor`` passed as
+    ``before`` loads the page of older ones. ``since`` takes a message id or
+    an ISO timestamp and returns only the messages written after it, with
+    ``next_cursor`` usable as ``after`` when more remain. Responses carry
+    an ETag from the session version; a matching If-None-Match gets 304
+    after a single session lookup.
+    """
     try:
-        messages = await db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1).to_list(length=1000)
-        return [parse_from_mongo(message) for message in messages]
+        headers = {}
+        session = await db.chat_sessions.find_one(
+            {"id": session_id},
+            projection={"_id": 0, "version": 1, "updated_at": 1, "last_message_at": 1, "archived_at": 1}
+        )
+        if session is not None:
+            version, modified = versions.session_version(session)
+            headers = versions.validator_headers(versions.etag("s", version), modified)
+            if versions.is_not_modified(request.headers, headers["ETag"], modified):
+                return Response(status_code=304, headers=headers)
+            if session.get("archived_at"):
+                await retention_manager.rehydrate(session_id)
+        
+        if since is not None:
+            key = await resolve_since(session_id, since)
+            messages, next_cursor = await fetch_keyset_range(
+                db.chat_messages, {"session_id": session_id}, "timestamp", limit or 200, key, newer=True,
+                projection=MESSAGE_PROJECTION
+            )
+            messages.reverse()
+            return ORJSONResponse({"items": messages, "next_cursor": next_cursor}, headers=headers)
+        
+        if limit is None and before is None and after is None:
+            messages = await db.chat_messages.find(
+                {"session_id": session_id}, projection=MESSAGE_PROJECTION
+            ).sort("timestamp", 1).to_list(length=1000)
+            return ORJSONResponse(messages, headers=headers)
+        
+        messages, next_cursor = await fetch_keyset_page(
+            db.chat_messages, {"session_id": session_id}, "timestamp", limit or 50, before, after,
+            projection=MESSAGE_PROJECTION
+        )
+        messages.reverse()
+        return ORJSONResponse({"items": messages, "next_cursor": next_cursor}, headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching messages: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch messages")
 
+async def resolve_since(session_id: str, since: str) -> Tuple[Any, str]:
+    """Turn a ``since`` message id or timestamp into a keyset position"""
+    anchor = await db.chat_messages.find_one(
+        {"session_id": session_id, "id": since},
+        projection={"_id": 0, "timestamp": 1, "id": 1}
+    )
+    if anchor:
+        return anchor["timestamp"], anchor["id"]
+    
+    try:
+        timestamp = datetime.fromisoformat(since.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be a message id or ISO timestamp")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    # Ids never sort above "~", so this skips every message at that instant
+    return timestamp.astimezone(timezone.utc), "~"
+
 @api_router.delete("/chat/sessions/{session_id}")
 async def delete_session(session_id: str):
+    """Delete the session at once; its messages are purged in the background"""
     try:
-        # Delete session and all its messages
-        await db.chat_sessions.delete_one({"id": session_id})
-        await db.chat_messages.delete_many({"session_id": session_id})
+        session = await retention_manager.delete_session(session_id)
+        if session is not None:
+            stats.record_session_deleted(
+                db, session.get("message_count", 0), session.get("created_at"),
+                session.get("model_provider"), session.get("model_name")
+            )
+            await versions.list_changed(db)
+            chat_hub.publish({"type": "session_deleted", "session_id": session_id})
         return {"message": "Session deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting session: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to delete session")
 
+# Batch chat jobs
+async def run_batch_prompt(item: Dict) -> Tuple[str, str, str]:
+    """One single-turn batch prompt under the scheduler (batch priority) and call policy"""
+    async def attempt(provider: str, model: str, timeout: float) -> str:
+        async with llm_scheduler.slot(provider, model, BATCH, timeout=LLM_BATCH_QUEUE_TIMEOUT_SECONDS):
+            # Fresh client per prompt; batch prompts carry no history
+            chat = llm_pool.create(f"batch_{item['batch_id']}_{item['index']}", item["system_message"], provider, model)
+            return str(await asyncio.wait_for(chat.send_message(UserMessage(text=item["prompt"])), timeout))
+    
+    return await llm_policy.run(item["model_provider"], item["model_name"], attempt)
+
+batch_runner = BatchRunner(db, run_batch_prompt)
+retention_manager = RetentionManager(db)
+
+metrics.registry.gauge("llm_queue_depth", "LLM calls waiting for a scheduler slot",
+                       lambda: [({}, llm_scheduler.stats()["queue_depth"])])
+metrics.registry.gauge("llm_lane_active", "LLM calls in flight per scheduler lane",
+                       lambda: [({"lane": lane}, info["active"]) for lane, info in llm_scheduler.stats()["lanes"].items()])
+metrics.registry.gauge("analysis_jobs", "Background document analyses by state",
+                       lambda: [({"state": "queued"}, analysis_runner.stats()["queued"]),
+                                ({"state": "running"}, analysis_runner.stats()["running"])])
+metrics.registry.gauge("session_purges", "Deleted sessions whose messages are still being purged",
+                       lambda: [({}, retention_manager.stats()["pending_purges"])])
+metrics.registry.gauge("ws_connections", "Open chat WebSocket connections",
+                       lambda: [({}, chat_hub.stats()["connections"])])
+metrics.registry.gauge("llm_pool_clients", "Warm LLM clients in the pool",
+                       lambda: [({}, llm_pool.stats()["size"])])
+
+def batch_summary(job: Dict) -> Dict:
+    return {
+        **job,
+        "status_url": f"/api/chat/batch/{job['id']}",
+        "results_url": f"/api/chat/batch/{job['id']}/results"
+    }
+
+@api_router.post("/chat/batch", status_code=202)
+async def submit_chat_batch(
+    request: Request,
+    model_provider: str = "anthropic",
+    model_name: str = "claude-sonnet-4-20250514",
+    system_message: Optional[str] = None,
+    stream: bool = False
+):
+    """Queue a JSONL body of prompts for background processing.
+
+    Each line is an object with ``prompt`` and optional ``session_id``,
+    ``model_provider``, ``model_name``, ``system_message`` and
+    ``custom_id``; the query parameters give the defaults. Returns the job
+    right away, or with ``stream`` an NDJSON feed of job progress until it
+    finishes. Results are fetched from ``results_url``.
+    """
+    if not llm_pool.api_key:
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_BYTES} byte limit")
+    try:
+        prompts = parse_batch(bytes(body))
+    except BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        job = await create_batch(
+            db, prompts, model_provider, model_name,
+            system_message or ChatRequest.model_fields["system_message"].default
+        )
+        batch_runner.start(job["id"])
+    except Exception as e:
+        logger.error(f"Batch submission error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to queue batch")
+    
+    if not stream:
+        return batch_summary(job)
+    
+    async def progress():
+        # The job keeps running if the client disconnects
+        async for update in watch_batch(db, job["id"]):
+            yield orjson.dumps(batch_summary(update)) + b"\n"
+    
+    return StreamingResponse(progress(), status_code=202, media_type="application/x-ndjson")
+
+@api_router.get("/chat/batch/{batch_id}")
+async def get_chat_batch(batch_id: str):
+    job = await get_batch(db, batch_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_summary(job)
+
+@api_router.get("/chat/batch/{batch_id}/results")
+async def get_chat_batch_results(batch_id: str):
+    """Per-prompt outcomes as JSONL in submission order; pending items have no response yet"""
+    if await get_batch(db, batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return StreamingResponse(
+        iter_results(db, batch_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="batch-{batch_id}.jsonl"'}
+    )
+
 # File upload and analysis
-@api_router.post("/upload/analyze")
-async def analyze_document(file: UploadFile = File(...), session_id: str = Form(...)):
+async def run_document_analysis(file: UploadFile, session_id: str, large_document: bool = False,
+                                reuse: bool = True, on_progress: Optional[ProgressCallback] = None) -> Dict:
+    """Read, extract and analyze one document, reusing earlier work where possible.
+
+    Text is pulled from plain text uploads while streaming and from PDF,
+    DOCX, HTML, CSV and JSON by the extractor pool. Uploads are registered
+    by SHA-256 in the ``documents`` store, so repeated bytes skip extraction
+    and, with ``reuse``, return the stored analysis for the same model and
+    prompt version without calling the provider. ``on_progress`` is called
+    with (stage, done, total) as the work advances.
+    """
+    provider, model = "anthropic", "claude-sonnet-4-20250514"
+    upload = None
+    
+    async def report(stage: str, done: int, total: int):
+        if on_progress is not None:
+            await on_progress(stage, done, total)
+    
     try:
-        # Save uploaded file temporarily
-        upload_dir = Path("/tmp/uploads")
-        upload_dir.mkdir(exist_ok=True)
+        started = time.perf_counter()
+        kind = detect_kind(file.filename, file.content_type)
+        
+        # Stream the upload; binary formats are spooled for the extractors
+        spool = needs_extraction(kind)
+        if not kind or spool:
+            text_limit = 0
+        else:
+            text_limit = None if large_document else ANALYSIS_TEXT_LIMIT
+        await report("read", 0, 1)
+        upload = await read_upload(file, text_limit=text_limit, spool=spool)
+        document = await record_upload(
+            db, upload.sha256, upload.size, file.filename, file.content_type, kind, session_id
+        )
+        timings = {"read": round(time.perf_counter() - started, 3)}
         
-        file_path = upload_dir / f"{uuid.uuid4()}_{file.filename}"
+        text = document.get("text")
+        if text is None and spool:
+            try:
+                await report("extract", 0, 1)
+                extract_started = time.perf_counter()
+                text = await extract_text(kind, upload.spool_path)
+                timings["extract"] = round(time.perf_counter() - extract_started, 3)
+                await store_text(db, upload.sha256, text)
+            except ExtractionError as e:
+                logger.warning(f"Could not extract text from {file.filename}: {str(e)}")
+        elif text is None and kind:
+            text = upload.text
+            if not upload.text_truncated:
+                await store_text(db, upload.sha256, text)
+        
+        is_text = bool(text and text.strip())
+        map_reduce = large_document and is_text
+        if map_reduce:
+            mode = "map_reduce"
+        elif is_text:
+            mode = f"prefix_{ANALYSIS_TEXT_LIMIT}"
+        else:
+            mode = "generic"
         
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
+        if reuse:
+            existing = await find_reusable_analysis(db, upload.sha256, provider, model, ANALYSIS_PROMPT_VERSION, mode)
+            if existing:
+                timings["total"] = round(time.perf_counter() - started, 3)
+                return {
+                    "analysis": existing["analysis_result"],
+                    "filename": file.filename,
+                    "file_type": file.content_type,
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "chunks": existing.get("chunk_count"),
+                    "timings": timings,
+                    "analysis_id": existing["id"],
+                    "content_hash": upload.sha256,
+                    "reused": True
+                }
         
-        # Initialize AI for document analysis
-        emergent_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not emergent_key:
+        if not llm_pool.api_key:
             raise HTTPException(status_code=500, detail="AI service not configured")
         
-        chat = LlmChat(
-            api_key=emergent_key,
-            session_id=f"analysis_{session_id}",
-            system_message="You are AJ STUDIOZ AI document analyzer. Analyze uploaded documents and provide comprehensive insights."
-        ).with_model("anthropic", "claude-sonnet-4-20250514")
-        
-        # Read file content for analysis
-        if file.content_type and file.content_type.startswith('text/'):
-            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-                file_content = await f.read()
-            analysis_prompt = f"Analyze this document and provide key insights, summary, and recommendations:\n\n{file_content[:5000]}"  # Limit content
+        chunk_count = None
+        if map_reduce:
+            result = await analyze_large_document(
+                db, llm_pool, text, file.filename, provider, model,
+                on_progress=on_progress, scheduler=llm_scheduler,
+                queue_timeout=LLM_BATCH_QUEUE_TIMEOUT_SECONDS, policy=llm_policy
+            )
+            analysis_result = result["analysis"]
+            chunk_count = result["chunk_count"]
+            timings.update(result["timings"])
         else:
-            analysis_prompt = f"I've uploaded a {file.content_type or 'unknown'} file named '{file.filename}'. Please provide analysis guidance for this type of document."
-        
-        # Get AI analysis
-        ai_message = UserMessage(text=analysis_prompt)
-        analysis_result = await chat.send_message(ai_message)
+            if is_text:
+                analysis_prompt = f"Analyze this document and provide key insights, summary, and recommendations:\n\n{text[:ANALYSIS_TEXT_LIMIT]}"
+            else:
+                analysis_prompt = f"I've uploaded a {file.content_type or 'unknown'} file named '{file.filename}'. Please provide analysis guidance for this type of document."
+            
+            async def attempt(attempt_provider: str, attempt_model: str, timeout: float) -> str:
+                async with llm_scheduler.slot(attempt_provider, attempt_model, BATCH,
+                                              timeout=LLM_BATCH_QUEUE_TIMEOUT_SECONDS):
+                    # A fresh client per call; a pooled one would replay earlier documents
+                    chat = llm_pool.create(f"analysis_{uuid.uuid4()}", ANALYSIS_SYSTEM_MESSAGE, attempt_provider, attempt_model)
+                    return str(await asyncio.wait_for(chat.send_message(UserMessage(text=analysis_prompt)), timeout))
+            
+            # Get AI analysis; a fallback model's result is stored under that model
+            await report("analyze", 0, 1)
+            llm_started = time.perf_counter()
+            analysis_result, provider, model = await llm_policy.run(provider, model, attempt)
+            await report("analyze", 1, 1)
+            timings["llm"] = round(time.perf_counter() - llm_started, 3)
+        timings["total"] = round(time.perf_counter() - started, 3)
         
         # Store analysis result
         analysis = DocumentAnalysis(
             filename=file.filename,
             file_type=file.content_type or "unknown",
             analysis_result=str(analysis_result),
-            session_id=session_id
+            session_id=session_id,
+            chunk_count=chunk_count,
+            timings=timings,
+            content_hash=upload.sha256,
+            model_provider=provider,
+            model_name=model,
+            prompt_version=ANALYSIS_PROMPT_VERSION,
+            mode=mode
         )
-        await db.document_analyses.insert_one(prepare_for_mongo(analysis.dict()))
-        
-        # Clean up temp file
-        file_path.unlink(missing_ok=True)
+        await db.document_analyses.insert_one(analysis.dict())
+        stats.record_analysis(db, provider, model, analysis.created_at)
+        if recall_index is not None:
+            stats.spawn(recall_index.add_analysis(analysis.dict()))
         
         return {
             "analysis": str(analysis_result),
             "filename": file.filename,
             "file_type": file.content_type,
-            "timestamp": datetime.now(timezone.utc).isoformat()
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "chunks": chunk_count,
+            "timings": timings,
+            "analysis_id": analysis.id,
+            "content_hash": upload.sha256,
+            "reused": False
         }
-        
+    finally:
+        if upload is not None:
+            upload.cleanup()
+
+def analysis_error(e: Exception) -> HTTPException:
+    """Map a document analysis failure to the HTTP error reported for it"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, UploadTooLarge):
+        return HTTPException(status_code=413, detail=str(e))
+    if isinstance(e, (LlmOverloaded, ProviderUnavailable)):
+        logger.warning(f"Document analysis rejected: {str(e)}")
+        return overloaded_error(e)
+    if isinstance(e, asyncio.TimeoutError):
+        logger.error("Document analysis error: model call timed out")
+        return HTTPException(status_code=504, detail="Model call timed out")
+    logger.error(f"Document analysis error: {str(e)}")
+    return HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
+
+async def run_analysis_job(job: Dict, on_progress: ProgressCallback) -> Dict:
+    """Analyze the upload spooled for a background job"""
+    path = Path(job["upload_path"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Upload is no longer available")
+    with path.open('rb') as handle:
+        file = UploadFile(
+            handle, size=job["size"], filename=job["filename"],
+            headers=Headers({"content-type": job["content_type"] or ""})
+        )
+        try:
+            return await run_document_analysis(file, job["session_id"], job["large_document"], job["reuse"], on_progress)
+        except LlmOverloaded:
+            # The runner backs off and retries these
+            raise
+        except Exception as e:
+            raise analysis_error(e)
+
+analysis_runner = AnalysisJobRunner(db, run_analysis_job)
+
+def job_summary(job: Dict) -> Dict:
+    return {
+        **job,
+        "status_url": f"/api/jobs/{job['id']}",
+        "events_url": f"/api/jobs/{job['id']}/events"
+    }
+
+async def submit_analysis_job(file: UploadFile, session_id: str, large_document: bool, reuse: bool) -> ORJSONResponse:
+    try:
+        analysis_runner.check_capacity()
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    upload = None
+    try:
+        upload = await read_upload(file, text_limit=0, spool=True)
+        job = await create_job(
+            db, upload.spool_path, upload.size, upload.sha256, file.filename, file.content_type,
+            session_id, large_document, reuse
+        )
+        analysis_runner.submit(job["id"])
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Analysis job submission error: {str(e)}")
+        if upload is not None:
+            upload.cleanup()
+        raise HTTPException(status_code=500, detail="Failed to queue document analysis")
+    
+    job.pop("upload_path")
+    return ORJSONResponse(job_summary(job), status_code=202)
+
+@api_router.post("/upload/analyze")
+async def analyze_document(
+    file: UploadFile = File(...),
+    session_id: str = Form(...),
+    large_document: bool = Form(False),
+    reuse: bool = Form(True),
+    background: bool = Form(False)
+):
+    """Analyze an uploaded document.
+
+    By default only the first ANALYSIS_TEXT_LIMIT characters of text reach
+    the model; with ``large_document`` the whole text is analyzed map-reduce
+    style. Set ``reuse`` to false to force a fresh analysis of content that
+    was analyzed before. With ``background`` the upload is stored and a
+    queued job is returned with 202; follow it at ``status_url`` or
+    ``events_url``.
+    """
+    if background:
+        return await submit_analysis_job(file, session_id, large_document, reuse)
+    try:
+        return await run_document_analysis(file, session_id, large_document, reuse)
     except Exception as e:
-        logger.error(f"Document analysis error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Document analysis failed: {str(e)}")
+        raise analysis_error(e)
+
+@api_router.get("/jobs/{job_id}")
+async def get_analysis_job(job_id: str):
+    job = await get_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_summary(job)
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_analysis_job(job_id: str):
+    """Server-Sent Events with the job on every progress change; the last event is named after its final status"""
+    if await get_job(db, job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    async def event_stream() -> AsyncIterator[str]:
+        async for update in watch_job(db, job_id):
+            event = update["status"] if update["status"] in JOB_TERMINAL_STATUSES else "progress"
+            yield sse_event(event, job_summary(update))
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Model management
-@api_router.get("/models")
-async def get_available_models():
-    return {
-        "providers": {
-            "openai": [
-                "gpt-5", "gpt-5-mini", "gpt-5-nano", "gpt-4.1", "gpt-4.1-mini", 
-                "gpt-4.1-nano", "o4-mini", "o3-mini", "o3", "o1-mini", "gpt-4o-mini", 
-                "gpt-4.5-preview", "gpt-4o", "o1", "o1-pro"
-            ],
-            "anthropic": [
-                "claude-sonnet-4-20250514", "claude-opus-4-20250514", "claude-3-7-sonnet-20250219",
-                "claude-3-5-haiku-20241022", "claude-3-5-sonnet-20241022"
-            ],
-            "gemini": [
-                "gemini-2.5-flash-preview-04-17", "gemini-2.5-pro-preview-05-06", "gemini-2.0-flash",
-                "gemini-2.0-flash-preview-image-generation", "gemini-2.0-flash-lite", "gemini-1.5-flash",
-                "gemini-1.5-flash-8b", "gemini-1.5-pro"
-            ]
-        },
-        "default": {
-            "provider": "anthropic",
-            "model": "claude-sonnet-4-20250514"
-        }
+MODEL_CATALOG = {
+    "providers": {
+        "openai": [
+            "gpt-5", "gpt-5-mini", "gpt-5-nano", "gpt-4.1", "gpt-4.1-mini", 
+            "gpt-4.1-nano", "o4-mini", "o3-mini", "o3", "o1-mini", "gpt-4o-mini", 
+            "gpt-4.5-preview", "gpt-4o", "o1", "o1-pro"
+        ],
+        "anthropic": [
+            "claude-sonnet-4-20250514", "claude-opus-4-20250514", "claude-3-7-sonnet-20250219",
+            "claude-3-5-haiku-20241022", "claude-3-5-sonnet-20241022"
+        ],
+        "gemini": [
+            "gemini-2.5-flash-preview-04-17", "gemini-2.5-pro-preview-05-06", "gemini-2.0-flash",
+            "gemini-2.0-flash-preview-image-generation", "gemini-2.0-flash-lite", "gemini-1.5-flash",
+            "gemini-1.5-flash-8b", "gemini-1.5-pro"
+        ]
+    },
+    "provider_labels": {
+        "anthropic": "Anthropic",
+        "openai": "OpenAI",
+        "gemini": "Google Gemini"
+    },
+    "labels": {
+        "gpt-5": "GPT-5", "gpt-5-mini": "GPT-5 Mini", "gpt-5-nano": "GPT-5 Nano",
+        "gpt-4.1": "GPT-4.1", "gpt-4.1-mini": "GPT-4.1 Mini", "gpt-4.1-nano": "GPT-4.1 Nano",
+        "o4-mini": "o4-mini", "o3-mini": "o3-mini", "o3": "o3", "o1-mini": "o1-mini",
+        "gpt-4o-mini": "GPT-4o Mini", "gpt-4.5-preview": "GPT-4.5 Preview", "gpt-4o": "GPT-4o",
+        "o1": "o1", "o1-pro": "o1-pro",
+        "claude-sonnet-4-20250514": "Claude Sonnet 4", "claude-opus-4-20250514": "Claude Opus 4",
+        "claude-3-7-sonnet-20250219": "Claude 3.7 Sonnet", "claude-3-5-haiku-20241022": "Claude 3.5 Haiku",
+        "claude-3-5-sonnet-20241022": "Claude 3.5 Sonnet",
+        "gemini-2.5-flash-preview-04-17": "Gemini 2.5 Flash Preview",
+        "gemini-2.5-pro-preview-05-06": "Gemini 2.5 Pro Preview", "gemini-2.0-flash": "Gemini 2.0 Flash",
+        "gemini-2.0-flash-preview-image-generation": "Gemini 2.0 Flash Image Generation",
+        "gemini-2.0-flash-lite": "Gemini 2.0 Flash Lite", "gemini-1.5-flash": "Gemini 1.5 Flash",
+        "gemini-1.5-flash-8b": "Gemini 1.5 Flash 8B", "gemini-1.5-pro": "Gemini 1.5 Pro"
+    },
+    "default": {
+        "provider": "anthropic",
+        "model": "claude-sonnet-4-20250514"
     }
+}
+# The catalog only changes with a deploy, so its ETag is a content hash
+MODEL_CATALOG_BODY = orjson.dumps(MODEL_CATALOG)
+MODEL_CATALOG_HEADERS = versions.validator_headers(
+    versions.etag("m", hashlib.sha256(MODEL_CATALOG_BODY).hexdigest()[:16]), None,
+    cache_control="public, max-age=86400"
+)
+
+@api_router.get("/models")
+async def get_available_models(request: Request):
+    if versions.is_not_modified(request.headers, MODEL_CATALOG_HEADERS["ETag"], None):
+        return Response(status_code=304, headers=MODEL_CATALOG_HEADERS)
+    return Response(MODEL_CATALOG_BODY, media_type="application/json", headers=MODEL_CATALOG_HEADERS)
+
+@api_router.get("/retention")
+async def get_retention_stats():
+    return retention_manager.stats()
+
+@api_router.get("/llm/pool")
+async def get_llm_pool_stats():
+    return llm_pool.stats()
+
+@api_router.get("/llm/scheduler")
+async def get_llm_scheduler_stats():
+    return llm_scheduler.stats()
+
+@api_router.get("/llm/policy")
+async def get_llm_policy_stats():
+    return llm_policy.stats()
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the request, span and MongoDB histograms"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/metrics/slow")
+async def get_slow_requests():
+    return {"enabled": metrics.PROFILE_SLOW_REQUESTS, "threshold_ms": metrics.PROFILE_SLOW_MS,
+            "requests": list(metrics.slow_requests)}
+
+@api_router.get("/llm/cache")
+async def get_response_cache_stats():
+    return {"enabled": RESPONSE_CACHE_ENABLED, **response_cache.stats()}
 
 # Analytics and usage stats
 @api_router.get("/analytics/stats")
 async def get_analytics():
+    """Platform totals, served from the incrementally maintained counters"""
     try:
-        total_sessions = await db.chat_sessions.count_documents({})
-        total_messages = await db.chat_messages.count_documents({})
-        total_analyses = await db.document_analyses.count_documents({})
-        
-        # Recent activity (last 7 days)
-        recent_date = datetime.now(timezone.utc) - timedelta(days=7)
-        recent_sessions = await db.chat_sessions.count_documents({
-            "created_at": {"$gte": recent_date.isoformat()}
-        })
+        # Recent activity (last 7 days) is summed from the hourly rollups
+        totals, recent_sessions = await asyncio.gather(
+            stats.get_totals(db),
+            stats.count_recent(db, "sessions", days=7)
+        )
         
         return {
-            "total_sessions": total_sessions,
-            "total_messages": total_messages,
-            "total_analyses": total_analyses,
+            "total_sessions": totals["sessions"],
+            "total_messages": totals["messages"],
+            "total_analyses": totals["analyses"],
             "recent_sessions": recent_sessions,
             "platform": "AJ STUDIOZ"
         }
@@ -321,6 +1265,128 @@ async def get_analytics():
         logger.error(f"Analytics error: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch analytics")
 
+@api_router.get("/analytics/timeseries")
+async def get_analytics_timeseries(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    days: int = Query(7, ge=1, le=366),
+    provider: Optional[str] = None,
+    model: Optional[str] = None
+):
+    """Sessions, messages and analyses per bucket, with per-model totals.
+
+    Reads only the rollup buckets, so the cost depends on the window and
+    the number of models, not on how much chat data is stored.
+    """
+    try:
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        buckets = await stats.get_rollups(db, granularity, since, provider, model)
+        return {
+            "granularity": granularity,
+            "since": stats.bucket_key(granularity, since),
+            **stats.build_timeseries(buckets)
+        }
+    except Exception as e:
+        logger.error(f"Analytics timeseries error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch analytics")
+
+@api_router.get("/search")
+async def search_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: str = Query("messages,sessions,analyses"),
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    session_id: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET)
+):
+    """Full-text search over messages, session titles and document analyses.
+
+    ``q`` uses MongoDB text search syntax: words, "quoted phrases" and
+    -excluded words. Hits come back ranked by text score with a snippet
+    around the first match and the offsets of the matched terms in it.
+    ``since`` and ``until`` filter on the message time, the session's last
+    message and the analysis time respectively. Messages of sessions
+    archived by the retention sweep are not searched until the session is
+    opened again.
+    """
+    kinds = [kind.strip() for kind in types.split(",") if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in SEARCH_SOURCES]
+    if unknown or not kinds:
+        raise HTTPException(status_code=422, detail=f"types must be a subset of {', '.join(SEARCH_SOURCES)}")
+    try:
+        return await search(
+            db, q, kinds, provider=provider, model=model, since=since, until=until,
+            session_id=session_id, limit=limit, offset=offset
+        )
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Search failed")
+
+@api_router.get("/recall")
+async def recall_related(
+    q: str = Query(..., min_length=1, max_length=2000),
+    exclude_session: Optional[str] = None,
+    k: int = Query(RECALL_TOP_K, ge=1, le=50)
+):
+    """Earlier messages and analyses most similar to ``q``, as used for prompt recall"""
+    if recall_index is None:
+        raise HTTPException(status_code=404, detail="Recall is not enabled")
+    try:
+        return {"results": await recall_index.recall(db, q, exclude_session=exclude_session, k=k, min_score=0.0)}
+    except Exception as e:
+        logger.error(f"Recall error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Recall failed")
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuse uploads by Content-Length before the multipart body is parsed"""
+    if request.url.path.startswith("/api/upload"):
+        content_length = request.headers.get("content-length")
+        # Allow some headroom for the multipart framing around the file
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit"}
+            )
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request, report its spans as Server-Timing and feed the histograms.
+
+    Streamed responses get the spans known when headers go out; their
+    latency and size are recorded once the body has been sent.
+    """
+    timing = metrics.begin_request()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    labels = (request.method, getattr(route, "path", "unmatched"), response.status_code)
+    content_length = request.headers.get("content-length")
+    request_bytes = int(content_length) if content_length and content_length.isdigit() else None
+    
+    response_length = response.headers.get("content-length")
+    if response_length is not None:
+        total = metrics.observe_request(*labels, timing, request_bytes, int(response_length))
+        response.headers["Server-Timing"] = timing.server_timing(total)
+        return response
+    
+    response.headers["Server-Timing"] = timing.server_timing(time.perf_counter() - timing.started)
+    body = response.body_iterator
+    
+    async def counted_body():
+        size = 0
+        try:
+            async for chunk in body:
+                size += len(chunk)
+                yield chunk
+        finally:
+            metrics.observe_request(*labels, timing, request_bytes, size)
+    
+    response.body_iterator = counted_body()
+    return response
+
 # Include router in app
 app.include_router(api_router)
 
@@ -333,9 +1399,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    await ensure_indexes(db)
+    try:
+        await stats.bootstrap_stats(db)
+    except Exception as e:
+        logger.error(f"Failed to bootstrap analytics counters: {str(e)}")
+    if RESPONSE_CACHE_ENABLED:
+        await response_cache.ensure_indexes()
+    if os.environ.get('VERIFY_QUERY_PLANS', 'false').lower() == 'true':
+        await verify_query_plans(db)
+    resumed = await batch_runner.resume()
+    if resumed:
+        logger.info(f"Resumed {resumed} unfinished batch jobs")
+    batch_runner.start_reclaimer()
+    resumed = await analysis_runner.resume()
+    if resumed:
+        logger.info(f"Resumed {resumed} unfinished analysis jobs")
+    analysis_runner.start()
+    resumed = await retention_manager.resume()
+    if resumed:
+        logger.info(f"Resumed {resumed} unfinished session purges")
+    if RETENTION_ENABLED:
+        retention_manager.start()
+    if recall_index is not None:
+        recall_index.open()
+        recall_index.start(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await batch_runner.shutdown()
+    await analysis_runner.shutdown()
+    await retention_manager.shutdown()
+    if recall_index is not None:
+        recall_index.close()
     client.close()
+    shutdown_extractors()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,227 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from typing import Dict, List, Optional
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_ID = "global"
+BUCKET_FORMATS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+METRICS = ("sessions", "messages", "analyses")
+
+# Strong references to in-flight background writes
+_pending = set()
+
+# Documents timestamped before this were counted by the bootstrap scan, so
+# live updates skip them. Every process loads it in bootstrap_stats before
+# serving; None (legacy counters or no bootstrap) means count everything.
+_cutoff: Optional[datetime] = None
+
+def bucket_key(granularity: str, at: datetime) -> str:
+    return at.astimezone(timezone.utc).strftime(BUCKET_FORMATS[granularity])
+
+def spawn(coro) -> None:
+    """Run a stats write in the background so it stays off the request path"""
+    task = asyncio.create_task(coro)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+def _before(field: str, cutoff: datetime) -> Dict:
+    # Dates still stored as strings or missing predate the BSON date migration
+    return {"$or": [{field: {"$lt": cutoff}}, {field: {"$not": {"$type": "date"}}}]}
+
+def _counted_live(timestamp: Optional[datetime]) -> bool:
+    if _cutoff is None or timestamp is None:
+        return True
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp >= _cutoff
+
+async def _record(db, increments: Dict[str, int], provider: Optional[str], model: Optional[str],
+                  at: Optional[datetime] = None, rollup: bool = True,
+                  rollup_increments: Optional[Dict[str, int]] = None, condition: Optional[Dict] = None) -> None:
+    """Apply ``increments`` to the totals and (unless ``rollup`` is off) the buckets of ``at``.
+
+    With a ``condition`` on the counters document, nothing is written
+    when it does not match.
+    """
+    at = at or datetime.now(timezone.utc)
+    try:
+        counter_query = {"_id": GLOBAL_ID, **(condition or {})}
+        counted = db.stats_counters.update_one(counter_query, {"$inc": increments}, upsert=condition is None)
+        if condition is not None:
+            if not (await counted).matched_count:
+                return
+            writes = []
+        else:
+            writes = [counted]
+        if rollup:
+            operations = []
+            for granularity in BUCKET_FORMATS:
+                bucket = bucket_key(granularity, at)
+                operations.append(UpdateOne(
+                    {"_id": f"{granularity}|{bucket}|{provider}|{model}"},
+                    {
+                        "$setOnInsert": {
+                            "granularity": granularity,
+                            "bucket": bucket,
+                            "provider": provider,
+                            "model": model
+                        },
+                        "$inc": rollup_increments or increments
+                    },
+                    upsert=True
+                ))
+            writes.append(db.stats_rollups.bulk_write(operations, ordered=False))
+        await asyncio.gather(*writes)
+    except Exception as e:
+        logger.error(f"Stats update failed: {str(e)}")
+
+def record_session_created(db, provider: Optional[str], model: Optional[str],
+                           created_at: Optional[datetime] = None) -> None:
+    if _counted_live(created_at):
+        spawn(_record(db, {"sessions": 1}, provider, model))
+
+def record_messages(db, timestamps: List[datetime], provider: Optional[str], model: Optional[str]) -> None:
+    count = sum(1 for timestamp in timestamps if _counted_live(timestamp))
+    if count:
+        spawn(_record(db, {"messages": count}, provider, model))
+
+def record_analysis(db, provider: Optional[str], model: Optional[str],
+                    created_at: Optional[datetime] = None) -> None:
+    if _counted_live(created_at):
+        spawn(_record(db, {"analyses": 1}, provider, model))
+
+def record_session_deleted(db, message_count: int, created_at: Optional[datetime],
+                           provider: Optional[str], model: Optional[str]) -> None:
+    """Shrink the totals and take the session out of its creation buckets.
+
+    Message buckets keep the historical activity. A session created
+    before the cutoff and deleted while the bootstrap scan is still
+    running may or may not have been counted by it; such deletes are
+    skipped, so the totals can stay one high until the next delete.
+    """
+    condition = None if _counted_live(created_at) else {"bootstrapping": {"$exists": False}}
+    spawn(_record(
+        db, {"sessions": -1, "messages": -message_count}, provider, model,
+        at=created_at, rollup=created_at is not None, rollup_increments={"sessions": -1}, condition=condition
+    ))
+
+async def bootstrap_stats(db) -> None:
+    """Seed the counters and rollups from the raw collections, once per database.
+
+    The sentinel fixes a cutoff first; the scans count only documents
+    timestamped before it and live updates only those at or after it, so
+    nothing is counted twice. Processes that find the sentinel load its
+    cutoff.
+    """
+    global _cutoff
+    cutoff = datetime.now(timezone.utc)
+    try:
+        await db.stats_counters.insert_one({"_id": GLOBAL_ID, "bootstrapping": True, "cutoff": cutoff})
+    except DuplicateKeyError:
+        doc = await db.stats_counters.find_one({"_id": GLOBAL_ID}, projection={"cutoff": 1})
+        _cutoff = doc.get("cutoff") if doc else None
+        if _cutoff is not None and _cutoff.tzinfo is None:
+            _cutoff = _cutoff.replace(tzinfo=timezone.utc)
+        return
+    _cutoff = cutoff
+
+    logger.info("Bootstrapping analytics counters from raw collections")
+    try:
+        sessions, messages, analyses = await asyncio.gather(
+            db.chat_sessions.count_documents(_before("created_at", cutoff)),
+            db.chat_messages.count_documents(_before("timestamp", cutoff)),
+            db.document_analyses.count_documents(_before("created_at", cutoff))
+        )
+        await db.stats_counters.update_one(
+            {"_id": GLOBAL_ID},
+            {"$inc": {"sessions": sessions, "messages": messages, "analyses": analyses},
+             "$unset": {"bootstrapping": ""}}
+        )
+    except Exception:
+        # Let the next startup retry from scratch
+        _cutoff = None
+        await db.stats_counters.delete_one({"_id": GLOBAL_ID})
+        raise
+
+    # Rebuild rollup buckets server-side; $toDate accepts both ISO strings and dates
+    try:
+        for collection, field, metric in (
+            ("chat_sessions", "created_at", "sessions"),
+            ("chat_messages", "timestamp", "messages"),
+            ("document_analyses", "created_at", "analyses"),
+        ):
+            for granularity, fmt in BUCKET_FORMATS.items():
+                bucket = {"$dateToString": {"format": fmt, "date": {"$toDate": f"${field}"}}}
+                await db[collection].aggregate([
+                    {"$match": _before(field, cutoff)},
+                    {"$group": {
+                        "_id": {"bucket": bucket, "provider": "$model_provider", "model": "$model_name"},
+                        "count": {"$sum": 1}
+                    }},
+                    {"$project": {
+                        "_id": {"$concat": [
+                            granularity, "|", "$_id.bucket", "|",
+                            {"$ifNull": ["$_id.provider", "None"]}, "|", {"$ifNull": ["$_id.model", "None"]}
+                        ]},
+                        "granularity": granularity,
+                        "bucket": "$_id.bucket",
+                        "provider": "$_id.provider",
+                        "model": "$_id.model",
+                        metric: "$count"
+                    }},
+                    # Add to buckets that live updates after the cutoff already created
+                    {"$merge": {
+                        "into": "stats_rollups", "on": "_id",
+                        "whenMatched": [{"$set": {metric: {"$add": [{"$ifNull": [f"${metric}", 0]}, f"$$new.{metric}"]}}}],
+                        "whenNotMatched": "insert"
+                    }}
+                ]).to_list(length=None)
+    except Exception as e:
+        # Totals are already seeded; only the historical series is missing
+        logger.error(f"Rollup backfill failed: {str(e)}")
+
+async def get_totals(db) -> Dict[str, int]:
+    doc = await db.stats_counters.find_one({"_id": GLOBAL_ID}) or {}
+    return {metric: doc.get(metric, 0) for metric in METRICS}
+
+async def get_rollups(db, granularity: str, since: datetime, provider: Optional[str] = None,
+                      model: Optional[str] = None) -> List[Dict]:
+    query = {"granularity": granularity, "bucket": {"$gte": bucket_key(granularity, since)}}
+    if provider:
+        query["provider"] = provider
+    if model:
+        query["model"] = model
+    return await db.stats_rollups.find(query, projection={"_id": 0}).sort("bucket", 1).to_list(length=None)
+
+async def count_recent(db, metric: str, days: int = 7) -> int:
+    """Sum of the last ``days`` of hourly buckets.
+
+    For sessions this is sessions created in the window that still exist,
+    since deletes decrement their creation bucket; messages and analyses
+    count activity, including that of deleted sessions.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    buckets = await get_rollups(db, "hour", since)
+    return sum(bucket.get(metric, 0) for bucket in buckets)
+
+def build_timeseries(buckets: List[Dict]) -> Dict:
+    """Fold rollup documents into a series plus per-model totals"""
+    series: Dict[str, Dict[str, int]] = {}
+    by_model: Dict[tuple, Dict[str, int]] = {}
+    for doc in buckets:
+        point = series.setdefault(doc["bucket"], {metric: 0 for metric in METRICS})
+        totals = by_model.setdefault((doc.get("provider"), doc.get("model")), {metric: 0 for metric in METRICS})
+        for metric in METRICS:
+            point[metric] += doc.get(metric, 0)
+            totals[metric] += doc.get(metric, 0)
+    return {
+        "series": [{"bucket": bucket, **values} for bucket, values in sorted(series.items())],
+        "by_model": [
+            {"provider": provider, "model": model, **values}
+            for (provider, model), values in sorted(by_model.items(), key=lambda item: -item[1]["messages"])
+        ]
+    }
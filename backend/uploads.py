@@ -0,0 +1,104 @@
+from fastapi import UploadFile
+from pathlib import Path
+from typing import Optional
+import aiofiles
+import codecs
+import hashlib
+import os
+import uuid
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(64 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', '/tmp/uploads'))
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds the {limit} byte limit")
+        self.limit = limit
+
+class UploadResult:
+    """What the pipeline kept from an upload"""
+
+    def __init__(self):
+        self.size = 0
+        self.text = ""
+        self.text_truncated = False
+        self.spool_path: Optional[Path] = None
+        # SHA-256 of the content; only set when the whole upload was read
+        self.sha256: Optional[str] = None
+
+    def cleanup(self) -> None:
+        if self.spool_path is not None:
+            self.spool_path.unlink(missing_ok=True)
+            self.spool_path = None
+
+async def read_upload(file: UploadFile, text_limit: Optional[int] = None, spool: bool = False,
+                      hash_content: bool = True, max_bytes: int = MAX_UPLOAD_BYTES) -> UploadResult:
+    """Stream an upload in fixed-size chunks.
+
+    Decodes at most ``text_limit`` characters of UTF-8 text (all of it when
+    None, nothing when 0) and only writes the bytes to a temp file when
+    ``spool`` is set. The SHA-256 of the content is computed on the way
+    through; without ``hash_content`` reading stops as soon as neither text
+    nor spool needs more bytes. An oversized upload raises UploadTooLarge
+    without being consumed.
+    The caller owns ``result.cleanup()`` for the spooled file.
+    """
+    result = UploadResult()
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    want_text = text_limit != 0
+    parts = []
+    decoded = 0
+    digest = hashlib.sha256()
+    complete = True
+    out = None
+    try:
+        if spool:
+            UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+            result.spool_path = UPLOAD_DIR / f"{uuid.uuid4()}_{Path(file.filename or 'upload').name}"
+            out = await aiofiles.open(result.spool_path, 'wb')
+
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            result.size += len(chunk)
+            if result.size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+
+            if out is not None:
+                await out.write(chunk)
+            if want_text:
+                text = decoder.decode(chunk)
+                if text_limit is not None and decoded + len(text) >= text_limit:
+                    parts.append(text[:text_limit - decoded])
+                    decoded = text_limit
+                    result.text_truncated = True
+                    want_text = False
+                else:
+                    parts.append(text)
+                    decoded += len(text)
+            if not want_text and out is None and not hash_content and file.size is not None:
+                # Size is already known to be within the limit
+                complete = False
+                break
+
+        if want_text:
+            parts.append(decoder.decode(b"", final=True))
+        result.text = "".join(parts)
+        if complete:
+            result.sha256 = digest.hexdigest()
+    except BaseException:
+        if out is not None:
+            await out.close()
+            out = None
+        result.cleanup()
+        raise
+    finally:
+        if out is not None:
+            await out.close()
+    return result
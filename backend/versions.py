@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_LIST = "sessions"
+
+# Version counters drive the ETags of the session list and message history.
+# A counter is bumped after the write it covers has completed, and before
+# the response to that write is sent, so a reader that sees version N also
+# sees every write made before N, and a client revalidating right after its
+# own write always gets the new data. Chat turns fold the session bump into
+# their session update (see ``session_bump``).
+
+def session_bump() -> Dict:
+    """Update operators that bump a session's version, to merge into a write on the session"""
+    return {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+
+async def _bump_list(db) -> None:
+    await db.resource_versions.update_one(
+        {"_id": SESSION_LIST},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def list_changed(db) -> None:
+    """Bump the session list version alone, e.g. after deletes or writes that bumped their session inline"""
+    try:
+        await _bump_list(db)
+    except Exception as e:
+        logger.error(f"Version bump failed for the session list: {str(e)}")
+
+async def list_version(db) -> Tuple[int, Optional[datetime]]:
+    doc = await db.resource_versions.find_one({"_id": SESSION_LIST})
+    if doc is None:
+        return 0, None
+    return doc["version"], doc.get("updated_at")
+
+def session_version(session: Dict) -> Tuple[int, Optional[datetime]]:
+    """Version of a session document; sessions written before versioning count as 0"""
+    return session.get("version", 0), session.get("updated_at") or session.get("last_message_at")
+
+def _utc(moment: datetime) -> datetime:
+    # Mongo returns naive datetimes that are UTC
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+def etag(prefix: str, version: int) -> str:
+    return f'"{prefix}{version}"'
+
+def validator_headers(tag: str, modified: Optional[datetime], cache_control: str = "no-cache") -> Dict[str, str]:
+    """ETag, Last-Modified and Cache-Control; ``no-cache`` makes clients revalidate every time"""
+    headers = {"ETag": tag, "Cache-Control": cache_control}
+    if modified is not None:
+        headers["Last-Modified"] = format_datetime(_utc(modified), usegmt=True)
+    return headers
+
+def is_not_modified(request_headers, tag: str, modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no ETag was sent"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        # Weak comparison, as required for If-None-Match
+        return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return _utc(modified).replace(microsecond=0) <= _utc(since)
+    return False
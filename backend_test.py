@@ -144,6 +144,52 @@ class AJStudiozAPITester:
             self.log_test("Chat Functionality", False, f"Exception: {str(e)}")
             return False
 
+    def test_chat_stream(self):
+        """Test streaming chat API over Server-Sent Events"""
+        try:
+            chat_data = {
+                "message": "Count from one to five.",
+                "session_id": self.session_id,
+                "model_provider": "anthropic",
+                "model_name": "claude-sonnet-4-20250514"
+            }
+            
+            print("    Streaming chat request (this may take a few seconds)...")
+            start = time.time()
+            first_delta_at = None
+            events = []
+            with requests.post(f"{self.api_url}/chat/stream", json=chat_data, stream=True, timeout=60) as response:
+                success = response.status_code == 200
+                if success:
+                    event = None
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line.startswith("event:"):
+                            event = line[6:].strip()
+                        elif line.startswith("data:"):
+                            if event == "delta" and first_delta_at is None:
+                                first_delta_at = time.time()
+                            events.append((event, json.loads(line[5:])))
+            
+            data = None
+            if success:
+                names = [name for name, _ in events]
+                details = f"Events: {len(events)}"
+                if first_delta_at:
+                    details += f", time to first delta: {first_delta_at - start:.2f}s"
+                if "done" not in names or "delta" not in names:
+                    success = False
+                    details += f" - Expected delta and done events, got {names}"
+                    data = {"events": events}
+            else:
+                details = f"HTTP {response.status_code}"
+                
+            self.log_test("Chat Stream", success, details, data)
+            return success
+            
+        except Exception as e:
+            self.log_test("Chat Stream", False, f"Exception: {str(e)}")
+            return False
+
     def test_get_sessions(self):
         """Test getting chat sessions"""
         try:
@@ -296,6 +342,7 @@ class AJStudiozAPITester:
         
         # Core functionality tests
         chat_ok = self.test_chat_functionality()
+        stream_ok = self.test_chat_stream()
         sessions_ok = self.test_get_sessions()
         messages_ok = self.test_get_session_messages()
         
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Offline load test for the backend.
+
+Starts a throwaway mongod and the FastAPI app (with the mock LLM provider
+from ``mock_llm``), drives concurrent load against the hot endpoints and
+reports latency percentiles and throughput per scenario. Results can be
+saved as a baseline and later runs compared against it.
+
+    python benchmarks/bench.py --concurrency 32 --duration 30
+    python benchmarks/bench.py --save-baseline
+    python benchmarks/bench.py --mongo-url mongodb://localhost:27017   # reuse a running mongod
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+BENCH_DIR = Path(__file__).parent
+BACKEND_DIR = BENCH_DIR.parent / "backend"
+MOCK_DIR = BENCH_DIR / "mock_llm"
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+SCENARIOS = ("chat", "messages", "upload", "analytics")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+class LocalMongo:
+    """A mongod on a temp dbpath, removed again on exit"""
+
+    def __init__(self, binary: str):
+        self.binary = binary
+        self.port = free_port()
+        self.dbpath = tempfile.mkdtemp(prefix="bench-mongo-")
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"mongodb://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "LocalMongo":
+        if shutil.which(self.binary) is None:
+            raise SystemExit(f"{self.binary} not found; install MongoDB or pass --mongo-url")
+        self.process = subprocess.Popen(
+            [self.binary, "--dbpath", self.dbpath, "--port", str(self.port), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+class AppServer:
+    """uvicorn running server:app with the mock provider first on the path"""
+
+    def __init__(self, mongo_url: str, env: Dict[str, str], workers: int):
+        self.port = free_port()
+        self.mongo_url = mongo_url
+        self.env = env
+        self.workers = workers
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "AppServer":
+        env = {
+            **os.environ,
+            "MONGO_URL": self.mongo_url,
+            "DB_NAME": f"bench_{uuid.uuid4().hex[:8]}",
+            "EMERGENT_LLM_KEY": "mock-key",
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(MOCK_DIR), os.environ.get("PYTHONPATH")])),
+            **self.env
+        }
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(self.port),
+             "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+async def run_scenario(name: str, client: httpx.AsyncClient, concurrency: int, duration: float,
+                       context: Dict) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def request(worker: int) -> httpx.Response:
+        if name == "chat":
+            session_id = context["chat_sessions"].setdefault(worker, str(uuid.uuid4()))
+            return await client.post("/api/chat", json={
+                "message": f"Benchmark prompt {random.randint(0, 10 ** 6)}: summarize the latest results",
+                "session_id": session_id
+            })
+        if name == "messages":
+            return await client.get(f"/api/chat/sessions/{context['seed_session']}/messages", params={"limit": 50})
+        if name == "upload":
+            return await client.post("/api/upload/analyze", data={"session_id": "bench", "reuse": "false"},
+                                     files={"file": ("bench.txt", context["document"], "text/plain")})
+        return await client.get("/api/analytics/stats")
+
+    async def worker(index: int):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await request(index)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0
+    }
+
+async def run_load(base_url: str, scenarios: List[str], concurrency: int, duration: float, seed_turns: int) -> Dict:
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        # Seed a session with history for the message listing scenario
+        seed_session = str(uuid.uuid4())
+        for turn in range(seed_turns):
+            response = await client.post("/api/chat", json={"message": f"Seed turn {turn}", "session_id": seed_session})
+            response.raise_for_status()
+        context = {
+            "seed_session": seed_session,
+            "chat_sessions": {},
+            "document": ("Benchmark document line with some numbers 12345.\n" * 1500).encode()
+        }
+        results = {}
+        for name in scenarios:
+            print(f"Running {name} for {duration}s at concurrency {concurrency}...", flush=True)
+            results[name] = await run_scenario(name, client, concurrency, duration, context)
+        return results
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Scenarios whose p95 grew or throughput dropped by more than ``tolerance``"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {previous['rps']} -> {current['rps']}")
+    return regressions
+
+def print_table(results: Dict, baseline: Dict) -> None:
+    header = f"{'scenario':<10} {'reqs':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'base p95':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        base = baseline.get(name, {}).get("p95_ms", "-")
+        print(f"{name:<10} {r['requests']:>7} {r['errors']:>5} {r['rps']:>9} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {base:>9}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed-turns", type=int, default=25)
+    parser.add_argument("--mongo-url", help="use this MongoDB instead of starting a local mongod")
+    parser.add_argument("--mongod", default="mongod", help="mongod binary")
+    parser.add_argument("--server-url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80)
+    parser.add_argument("--llm-response-tokens", type=int, default=120)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression, default 20%%")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    mock_env = {
+        "MOCK_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "MOCK_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "MOCK_LLM_RESPONSE_TOKENS": str(args.llm_response_tokens),
+        "MOCK_LLM_ERROR_RATE": str(args.llm_error_rate),
+    }
+
+    def load(base_url: str) -> Dict:
+        return asyncio.run(run_load(base_url, scenarios, args.concurrency, args.duration, args.seed_turns))
+
+    if args.server_url:
+        results = load(args.server_url)
+    elif args.mongo_url:
+        with AppServer(args.mongo_url, mock_env, args.workers) as server:
+            results = load(server.url)
+    else:
+        with LocalMongo(args.mongod) as mongo, AppServer(mongo.url, mock_env, args.workers) as server:
+            results = load(server.url)
+
+    baseline = json.loads(args.baseline.read_text())["results"] if args.baseline.exists() else {}
+    print()
+    print_table(results, baseline)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": {"concurrency": args.concurrency, "duration": args.duration, "workers": args.workers, **mock_env},
+        "results": results
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2))
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    if baseline:
+        print("\nNo regressions against baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Stand-in for ``emergentintegrations.llm.chat`` used by the benchmarks.
+
+Mirrors the LlmChat interface the backend relies on (the constructor
+with ``initial_messages``, ``with_model`` and ``send_message``; there is
+no incremental output) and simulates a provider with configurable
+latency, token rate and error rate:
+
+    MOCK_LLM_LATENCY_MS          time before generation starts (default 300)
+    MOCK_LLM_JITTER_MS           uniform jitter added to the latency (default 100)
+    MOCK_LLM_TOKENS_PER_SECOND   generation rate (default 80)
+    MOCK_LLM_RESPONSE_TOKENS     tokens per reply (default 120)
+    MOCK_LLM_ERROR_RATE          fraction of calls failing with RateLimitError (default 0)
+"""
+from typing import Dict, List, Optional
+import asyncio
+import os
+import random
+
+LATENCY_MS = float(os.environ.get('MOCK_LLM_LATENCY_MS', '300'))
+JITTER_MS = float(os.environ.get('MOCK_LLM_JITTER_MS', '100'))
+TOKENS_PER_SECOND = float(os.environ.get('MOCK_LLM_TOKENS_PER_SECOND', '80'))
+RESPONSE_TOKENS = int(os.environ.get('MOCK_LLM_RESPONSE_TOKENS', '120'))
+ERROR_RATE = float(os.environ.get('MOCK_LLM_ERROR_RATE', '0'))
+
+class RateLimitError(Exception):
+    pass
+
+class UserMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+class LlmChat:
+    def __init__(self, api_key: str, session_id: str, system_message: str,
+                 initial_messages: Optional[List[Dict[str, str]]] = None):
+        self.api_key = api_key
+        self.session_id = session_id
+        self.system_message = system_message
+        self.messages = list(initial_messages or [])
+        self.provider = None
+        self.model = None
+
+    def with_model(self, provider: str, model: str) -> "LlmChat":
+        self.provider = provider
+        self.model = model
+        return self
+
+    def _tokens(self, message: UserMessage) -> List[str]:
+        words = message.text.split() or ["..."]
+        return [f"{words[i % len(words)]} " for i in range(RESPONSE_TOKENS)]
+
+    async def send_message(self, message: UserMessage) -> str:
+        # Like the real client, the reply arrives in one piece after the full generation time
+        await asyncio.sleep((LATENCY_MS + random.uniform(0, JITTER_MS)) / 1000)
+        if random.random() < ERROR_RATE:
+            raise RateLimitError(f"Mock {self.provider} rate limit exceeded")
+        tokens = self._tokens(message)
+        await asyncio.sleep(len(tokens) / TOKENS_PER_SECOND)
+        reply = "".join(tokens)
+        self.messages.append({"role": "user", "content": message.text})
+        self.messages.append({"role": "assistant", "content": reply})
+        return reply
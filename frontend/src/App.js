@@ -23,7 +23,8 @@ import {
   Terminal,
   Cpu,
   Database,
-  Cloud
+  Cloud,
+  Square
 } from 'lucide-react';
 import { Button } from './components/ui/button';
 import { Input } from './components/ui/input';
@@ -39,6 +40,7 @@ import './App.css';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const WS_URL = `${(BACKEND_URL || window.location.origin).replace(/^http/, 'ws')}/api/ws`;
 
 // Landing Page Component
 const LandingPage = ({ onGetStarted }) => {
@@ -276,25 +278,27 @@ const ChatInterface = ({ onBackToLanding }) => {
   const [modelProvider, setModelProvider] = useState('anthropic');
   const [modelName, setModelName] = useState('claude-sonnet-4-20250514');
   const [availableModels, setAvailableModels] = useState(null);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
   const fileInputRef = useRef(null);
+  // One WebSocket per client; turns are matched to their handlers by request_id
+  const socketRef = useRef(null);
+  const turnHandlersRef = useRef(new Map());
+  const activeRequestRef = useRef(null);
+  // Aborts the SSE fallback request, which has no socket to send a cancel on
+  const streamAbortRef = useRef(null);
 
   // Available models by provider
-  const modelOptions = {
-    anthropic: [
-      { value: 'claude-sonnet-4-20250514', label: 'Claude Sonnet 4' },
-      { value: 'claude-opus-4-20250514', label: 'Claude Opus 4' },
-      { value: 'claude-3-5-sonnet-20241022', label: 'Claude 3.5 Sonnet' }
-    ],
-    openai: [
-      { value: 'gpt-5', label: 'GPT-5' },
-      { value: 'o3', label: 'GPT-O3' },
-      { value: 'gpt-4o', label: 'GPT-4O' }
-    ],
-    gemini: [
-      { value: 'gemini-2.0-flash', label: 'Gemini 2.0 Flash' },
-      { value: 'gemini-1.5-pro', label: 'Gemini 1.5 Pro' }
-    ]
+  const providerOptions = Object.keys(availableModels?.providers || {});
+  const modelLabel = (model) => availableModels?.labels?.[model] || model;
+
+  const handleProviderChange = (provider) => {
+    setModelProvider(provider);
+    const models = availableModels?.providers?.[provider] || [];
+    if (models.length > 0 && !models.includes(modelName)) {
+      setModelName(models[0]);
+    }
   };
 
   useEffect(() => {
@@ -303,8 +307,52 @@ const ChatInterface = ({ onBackToLanding }) => {
   }, []);
 
   useEffect(() => {
+    let closed = false;
+    let retryDelay = 1000;
+    let retryTimer = null;
+
+    const connect = () => {
+      const socket = new WebSocket(WS_URL);
+      socketRef.current = socket;
+      socket.onopen = () => {
+        retryDelay = 1000;
+      };
+      socket.onmessage = (event) => {
+        const frame = JSON.parse(event.data);
+        if (frame.type === 'session_update') {
+          mergeSession(frame.session);
+        } else if (frame.type === 'session_deleted') {
+          setSessions(prev => prev.filter(s => s.id !== frame.session_id));
+        } else if (frame.request_id) {
+          turnHandlersRef.current.get(frame.request_id)?.(frame.type, frame);
+        }
+      };
+      socket.onclose = () => {
+        socketRef.current = null;
+        // Turns still waiting on this socket will never finish
+        turnHandlersRef.current.forEach(handler => handler('error', { detail: 'Connection lost' }));
+        turnHandlersRef.current.clear();
+        if (!closed) {
+          retryTimer = setTimeout(connect, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, 30000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      socketRef.current?.close();
+    };
+  }, []);
+
+  const lastMessage = messages[messages.length - 1];
+
+  useEffect(() => {
+    // Only follow the tail; prepending older pages keeps the scroll position
     scrollToBottom();
-  }, [messages]);
+  }, [lastMessage?.id, lastMessage?.content]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -329,52 +377,235 @@ const ChatInterface = ({ onBackToLanding }) => {
     }
   };
 
+  const MESSAGE_PAGE_SIZE = 50;
+
   const fetchMessages = async (sessionId) => {
     try {
-      const response = await axios.get(`${API}/chat/sessions/${sessionId}/messages`);
-      setMessages(response.data);
+      // Newest page first; older pages are loaded on demand
+      const response = await axios.get(`${API}/chat/sessions/${sessionId}/messages`, {
+        params: { limit: MESSAGE_PAGE_SIZE }
+      });
+      setMessages(response.data.items);
+      setOlderCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching messages:', error);
       toast.error('Failed to load messages');
     }
   };
 
+  const fetchOlderMessages = async () => {
+    if (!currentSession || !olderCursor || isLoadingOlder) return;
+
+    setIsLoadingOlder(true);
+    try {
+      const response = await axios.get(`${API}/chat/sessions/${currentSession.id}/messages`, {
+        params: { limit: MESSAGE_PAGE_SIZE, before: olderCursor }
+      });
+      setMessages(prev => [...response.data.items, ...prev]);
+      setOlderCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching older messages:', error);
+      toast.error('Failed to load older messages');
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
+  const streamChat = async (payload, onEvent) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      return streamChatOverSocket(socket, payload, onEvent);
+    }
+    // Fall back to Server-Sent Events while the socket is (re)connecting
+    const controller = new AbortController();
+    streamAbortRef.current = controller;
+    try {
+      const response = await fetch(`${API}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+        body: JSON.stringify(payload),
+        signal: controller.signal
+      });
+      if (!response.ok || !response.body) {
+        throw new Error(`Chat stream failed with HTTP ${response.status}`);
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // SSE frames are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const frame = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          let event = 'message';
+          let data = '';
+          frame.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          });
+          if (data) onEvent(event, JSON.parse(data));
+        }
+      }
+    } catch (error) {
+      // Closing the request makes the server cancel the generation
+      if (error.name !== 'AbortError') throw error;
+      onEvent('cancelled', {});
+    } finally {
+      if (streamAbortRef.current === controller) streamAbortRef.current = null;
+    }
+  };
+
+  const streamChatOverSocket = (socket, payload, onEvent) => new Promise((resolve) => {
+    const requestId = `req-${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    activeRequestRef.current = requestId;
+    turnHandlersRef.current.set(requestId, (event, data) => {
+      onEvent(event, data);
+      if (event === 'done' || event === 'error' || event === 'cancelled') {
+        turnHandlersRef.current.delete(requestId);
+        if (activeRequestRef.current === requestId) activeRequestRef.current = null;
+        resolve();
+      }
+    });
+    socket.send(JSON.stringify({ type: 'chat', request_id: requestId, ...payload }));
+  });
+
+  const cancelGeneration = () => {
+    const requestId = activeRequestRef.current;
+    if (requestId && socketRef.current?.readyState === WebSocket.OPEN) {
+      socketRef.current.send(JSON.stringify({ type: 'cancel', request_id: requestId }));
+    }
+    streamAbortRef.current?.abort();
+  };
+
+  const mergeSession = (session) => {
+    if (!session) return;
+    // Pushed updates carry the changed fields; the session moves to the top
+    setSessions(prev => {
+      const existing = prev.find(s => s.id === session.id);
+      return [{ ...existing, ...session }, ...prev.filter(s => s.id !== session.id)];
+    });
+    setCurrentSession(prev => (prev?.id === session.id ? { ...prev, ...session } : prev));
+  };
+
   const sendMessage = async () => {
     if (!inputMessage.trim() || isLoading) return;
 
     const messageText = inputMessage;
+    const pendingId = `pending-${Date.now()}`;
     setInputMessage('');
     setIsLoading(true);
 
+    // Show the user turn right away
+    setMessages(prev => [
+      ...prev,
+      { id: `${pendingId}-user`, role: 'user', content: messageText, timestamp: new Date().toISOString() }
+    ]);
+
+    let sessionId = currentSession?.id;
+    const lastKnownId = messages[messages.length - 1]?.id;
+
     try {
-      const response = await axios.post(`${API}/chat`, {
+      let streamError = null;
+      let result = null;
+      let cancelled = false;
+
+      await streamChat({
         message: messageText,
         session_id: currentSession?.id,
         model_provider: modelProvider,
         model_name: modelName
+      }, (event, data) => {
+        if (event === 'session') {
+          sessionId = data.session_id;
+        } else if (event === 'delta') {
+          setMessages(prev => (
+            prev.some(m => m.id === `${pendingId}-assistant`)
+              ? prev.map(m => (
+                  m.id === `${pendingId}-assistant` ? { ...m, content: m.content + data.content } : m
+                ))
+              : [...prev, { id: `${pendingId}-assistant`, role: 'assistant', content: data.content, timestamp: new Date().toISOString() }]
+          ));
+        } else if (event === 'done') {
+          result = data;
+        } else if (event === 'error') {
+          streamError = data;
+        } else if (event === 'cancelled') {
+          cancelled = true;
+        }
       });
 
-      const { session_id } = response.data;
-      
-      if (!currentSession || currentSession.id !== session_id) {
-        // New session created or switched
-        await fetchSessions();
-        const newSession = sessions.find(s => s.id === session_id) || 
-          { id: session_id, title: messageText.substring(0, 50) };
-        setCurrentSession(newSession);
+      if (cancelled) {
+        toast.info('Generation stopped');
+        return;
+      }
+
+      if (streamError) {
+        const error = new Error(streamError.detail);
+        error.retryAfter = streamError.retry_after;
+        throw error;
+      }
+
+      if (result) {
+        // Swap the optimistic bubbles for the persisted messages
+        setMessages(prev => [
+          ...prev.filter(m => !m.id.startsWith(pendingId)),
+          result.user_message,
+          result.assistant_message
+        ]);
+        applySessionUpdate(result.session);
+      } else {
+        await fetchNewMessages(sessionId, lastKnownId, pendingId);
       }
-      
-      // Refresh messages
-      await fetchMessages(session_id);
       toast.success('Message sent successfully');
     } catch (error) {
       console.error('Error sending message:', error);
-      toast.error('Failed to send message');
+      setMessages(prev => prev.filter(m => m.id !== `${pendingId}-assistant`));
+      if (error.retryAfter) {
+        toast.error(`AI service is busy, please retry in ${error.retryAfter}s`);
+      } else {
+        toast.error('Failed to send message');
+      }
     } finally {
       setIsLoading(false);
     }
   };
 
+  const applySessionUpdate = (session) => {
+    if (!session) return;
+    setSessions(prev => [session, ...prev.filter(s => s.id !== session.id)]);
+    setCurrentSession(prev => (prev?.id === session.id ? { ...prev, ...session } : session));
+  };
+
+  const fetchNewMessages = async (sessionId, sinceId, pendingId) => {
+    if (!sessionId) return;
+    try {
+      // Only pull what was written after the last message we already have
+      const useSince = sinceId && !sinceId.startsWith('pending-');
+      const response = await axios.get(`${API}/chat/sessions/${sessionId}/messages`, {
+        params: useSince ? { since: sinceId } : { limit: MESSAGE_PAGE_SIZE }
+      });
+      setMessages(prev => (
+        useSince
+          ? [...prev.filter(m => !m.id.startsWith(pendingId)), ...response.data.items]
+          : response.data.items
+      ));
+      if (!currentSession || currentSession.id !== sessionId) {
+        setCurrentSession({ id: sessionId, title: response.data.items[0]?.content?.substring(0, 50) });
+        await fetchSessions();
+      }
+    } catch (error) {
+      console.error('Error fetching new messages:', error);
+    }
+  };
+
   const selectSession = async (session) => {
     setCurrentSession(session);
     await fetchMessages(session.id);
@@ -383,6 +614,7 @@ const ChatInterface = ({ onBackToLanding }) => {
   const createNewSession = () => {
     setCurrentSession(null);
     setMessages([]);
+    setOlderCursor(null);
     toast.success('New chat session started');
   };
 
@@ -393,6 +625,7 @@ const ChatInterface = ({ onBackToLanding }) => {
       if (currentSession?.id === sessionId) {
         setCurrentSession(null);
         setMessages([]);
+        setOlderCursor(null);
       }
       toast.success('Session deleted');
     } catch (error) {
@@ -408,27 +641,50 @@ const ChatInterface = ({ onBackToLanding }) => {
     const formData = new FormData();
     formData.append('file', file);
     formData.append('session_id', currentSession?.id || 'temp');
+    formData.append('background', 'true');
+    event.target.value = '';
 
-    setIsLoading(true);
+    // The analysis runs as a background job, so chatting stays available meanwhile
+    const toastId = toast.loading(`Uploading "${file.name}"...`);
     try {
       const response = await axios.post(`${API}/upload/analyze`, formData, {
         headers: { 'Content-Type': 'multipart/form-data' }
       });
-      
-      toast.success(`File "${file.name}" analyzed successfully`);
-      
-      // If we have a current session, refresh messages
-      if (currentSession) {
-        await fetchMessages(currentSession.id);
-      }
+      followAnalysisJob(response.data, file.name, toastId, currentSession?.id);
     } catch (error) {
       console.error('Error uploading file:', error);
-      toast.error('Failed to analyze file');
-    } finally {
-      setIsLoading(false);
+      toast.error('Failed to analyze file', { id: toastId });
     }
   };
 
+  const followAnalysisJob = (job, fileName, toastId, sessionId) => {
+    const source = new EventSource(`${BACKEND_URL}${job.events_url}`);
+    source.addEventListener('progress', (event) => {
+      const { progress } = JSON.parse(event.data);
+      const detail = progress.total > 1 ? ` ${progress.done}/${progress.total}` : '';
+      toast.loading(`Analyzing "${fileName}" (${progress.stage}${detail})`, { id: toastId });
+    });
+    source.addEventListener('completed', async () => {
+      source.close();
+      toast.success(`File "${fileName}" analyzed successfully`, { id: toastId });
+      if (sessionId) {
+        await fetchMessages(sessionId);
+      }
+    });
+    source.addEventListener('failed', (event) => {
+      source.close();
+      const { error } = JSON.parse(event.data);
+      toast.error(`Failed to analyze file: ${error}`, { id: toastId });
+    });
+    source.onerror = () => {
+      // The browser reconnects on its own and the stream resends the current state;
+      // only a connection it gave up on is reported
+      if (source.readyState === EventSource.CLOSED) {
+        toast.error(`Lost track of the analysis of "${fileName}"`, { id: toastId });
+      }
+    };
+  };
+
   return (
     <div className="min-h-screen bg-gradient-to-br from-slate-900 via-slate-800 to-indigo-900 text-white" data-testid="chat-interface">
       <div className="flex h-screen">
@@ -510,14 +766,16 @@ const ChatInterface = ({ onBackToLanding }) => {
             <div className="space-y-3">
               <div>
                 <label className="text-xs text-slate-400 mb-2 block">AI Provider</label>
-                <Select value={modelProvider} onValueChange={setModelProvider}>
+                <Select value={modelProvider} onValueChange={handleProviderChange}>
                   <SelectTrigger className="w-full bg-slate-700/50 border-slate-600 text-white" data-testid="model-provider-select">
                     <SelectValue />
                   </SelectTrigger>
                   <SelectContent className="bg-slate-800 border-slate-600">
-                    <SelectItem value="anthropic">Anthropic</SelectItem>
-                    <SelectItem value="openai">OpenAI</SelectItem>
-                    <SelectItem value="gemini">Google Gemini</SelectItem>
+                    {providerOptions.map((provider) => (
+                      <SelectItem key={provider} value={provider}>
+                        {availableModels.provider_labels?.[provider] || provider}
+                      </SelectItem>
+                    ))}
                   </SelectContent>
                 </Select>
               </div>
@@ -529,9 +787,9 @@ const ChatInterface = ({ onBackToLanding }) => {
                     <SelectValue />
                   </SelectTrigger>
                   <SelectContent className="bg-slate-800 border-slate-600">
-                    {modelOptions[modelProvider]?.map((model) => (
-                      <SelectItem key={model.value} value={model.value}>
-                        {model.label}
+                    {availableModels?.providers?.[modelProvider]?.map((model) => (
+                      <SelectItem key={model} value={model}>
+                        {modelLabel(model)}
                       </SelectItem>
                     ))}
                   </SelectContent>
@@ -551,7 +809,7 @@ const ChatInterface = ({ onBackToLanding }) => {
                   {currentSession?.title || 'AJ STUDIOZ AI Assistant'}
                 </h1>
                 <p className="text-slate-400 text-sm mt-1">
-                  Powered by {modelOptions[modelProvider]?.find(m => m.value === modelName)?.label || modelName}
+                  Powered by {modelLabel(modelName)}
                 </p>
               </div>
               <div className="flex items-center space-x-2">
@@ -560,7 +818,7 @@ const ChatInterface = ({ onBackToLanding }) => {
                   ref={fileInputRef}
                   onChange={handleFileUpload}
                   className="hidden"
-                  accept=".txt,.pdf,.doc,.docx,.md"
+                  accept=".txt,.pdf,.doc,.docx,.md,.html,.htm,.csv,.json"
                 />
                 <Button
                   variant="outline"
@@ -583,6 +841,20 @@ const ChatInterface = ({ onBackToLanding }) => {
           {/* Messages Area */}
           <ScrollArea className="flex-1 p-6" data-testid="messages-area">
             <div className="max-w-4xl mx-auto space-y-6">
+              {olderCursor && (
+                <div className="text-center">
+                  <Button
+                    variant="ghost"
+                    size="sm"
+                    onClick={fetchOlderMessages}
+                    disabled={isLoadingOlder}
+                    className="text-slate-400 hover:text-white"
+                    data-testid="load-older-messages-btn"
+                  >
+                    {isLoadingOlder ? 'Loading...' : 'Load earlier messages'}
+                  </Button>
+                </div>
+              )}
               {messages.length === 0 ? (
                 <motion.div 
                   className="text-center py-12"
@@ -662,7 +934,7 @@ const ChatInterface = ({ onBackToLanding }) => {
                 ))
               )}
               
-              {isLoading && (
+              {isLoading && messages[messages.length - 1]?.role !== 'assistant' && (
                 <motion.div 
                   className="flex items-start space-x-4"
                   initial={{ opacity: 0 }}
@@ -712,6 +984,16 @@ const ChatInterface = ({ onBackToLanding }) => {
                     disabled={isLoading}
                   />
                 </div>
+                {isLoading && (
+                  <Button
+                    onClick={cancelGeneration}
+                    variant="outline"
+                    className="border-slate-600 text-slate-300 hover:bg-slate-700/30 px-4 py-3 rounded-xl"
+                    data-testid="stop-generation-btn"
+                  >
+                    <Square className="w-5 h-5" />
+                  </Button>
+                )}
                 <Button
                   onClick={sendMessage}
                   disabled={!inputMessage.trim() || isLoading}
@@ -0,0 +1,31 @@
+import pytest
+
+doc_analysis = pytest.importorskip("doc_analysis")
+split_into_chunks = doc_analysis.split_into_chunks
+
+
+def test_short_text_is_one_chunk():
+    assert split_into_chunks("  hello world  ", chunk_tokens=100) == ["hello world"]
+    assert split_into_chunks("", chunk_tokens=100) == []
+
+
+def test_chunks_respect_the_size_limit_and_keep_all_text():
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunks = split_into_chunks(text, chunk_tokens=50)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    # Without line or sentence breaks the cut is a hard one, possibly mid-word
+    assert "".join(chunks).replace(" ", "") == text.replace(" ", "")
+
+
+def test_chunks_break_at_paragraphs_when_possible():
+    paragraphs = ["a" * 120, "b" * 120, "c" * 120]
+    chunks = split_into_chunks("\n\n".join(paragraphs), chunk_tokens=50)
+    assert chunks == paragraphs
+
+
+def test_falls_back_to_sentence_breaks():
+    text = ". ".join(["x" * 90] * 4)
+    chunks = split_into_chunks(text, chunk_tokens=50)
+    assert all(chunk.startswith("x") and len(chunk) <= 200 for chunk in chunks)
+    assert chunks[0].endswith(".")
@@ -0,0 +1,118 @@
+import asyncio
+import zipfile
+
+import pytest
+
+import extractors
+from extractors import ExtractionError, detect_kind, extract_docx, extract_html, extract_text, needs_extraction
+
+_DOCX_BODY = (
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    '<w:p><w:r><w:t>First </w:t></w:r><w:r><w:t>paragraph</w:t></w:r></w:p>'
+    '<w:p></w:p>'
+    '<w:p><w:r><w:t>Second paragraph</w:t></w:r></w:p>'
+    '</w:body></w:document>'
+)
+
+
+def _write_docx(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", _DOCX_BODY)
+    return str(path)
+
+
+def _write_pdf(path, lines):
+    """Smallest PDF pypdf can read text from: one page per line"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for line in lines:
+        stream = f"BT /F1 12 Tf 72 720 Td ({line}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    path.write_bytes(out)
+    return str(path)
+
+
+def test_detect_kind_prefers_extension_then_mime():
+    assert detect_kind("report.PDF", "text/plain") == "pdf"
+    assert detect_kind("upload", "application/json; charset=utf-8") == "json"
+    assert detect_kind(None, "text/x-log") == "text"
+    assert detect_kind("blob.bin", "application/octet-stream") is None
+    assert needs_extraction("docx") and not needs_extraction("markdown") and not needs_extraction(None)
+
+
+def test_docx_paragraphs(tmp_path):
+    assert extract_docx(_write_docx(tmp_path / "a.docx")) == "First paragraph\nSecond paragraph"
+
+
+def test_invalid_docx(tmp_path):
+    path = tmp_path / "a.docx"
+    path.write_bytes(b"not a zip")
+    with pytest.raises(ExtractionError):
+        extract_docx(str(path))
+
+
+def test_html_skips_scripts_and_breaks_blocks(tmp_path):
+    path = tmp_path / "a.html"
+    path.write_text("<html><head><style>p {}</style><script>var x = 1;</script></head>"
+                    "<body><h1>Title</h1><p>Hello <b>world</b></p><div>Bye</div></body></html>")
+    assert extract_html(str(path)) == "Title\nHello world\nBye"
+
+
+def test_pdf_pages(tmp_path):
+    pytest.importorskip("pypdf")
+    text = extractors.extract_pdf(_write_pdf(tmp_path / "a.pdf", ["Hello PDF", "Second page"]))
+    assert "[Page 1]\nHello PDF" in text
+    assert "[Page 2]\nSecond page" in text
+
+
+def test_pdf_stops_reading_pages_past_the_limit(tmp_path, monkeypatch):
+    pytest.importorskip("pypdf")
+    monkeypatch.setattr(extractors, "MAX_EXTRACTED_CHARS", 5)
+    text = extractors.extract_pdf(_write_pdf(tmp_path / "a.pdf", ["Hello PDF", "Second page"]))
+    assert "[Page 2]" not in text
+
+
+def test_output_is_truncated_to_max_chars(tmp_path, monkeypatch):
+    monkeypatch.setattr(extractors, "MAX_EXTRACTED_CHARS", 10)
+    # The docx extractor reads the whole archive; pretty-printed JSON grows past its raw input
+    assert extractors._run_extractor("docx", _write_docx(tmp_path / "a.docx")) == "First para"
+    path = tmp_path / "a.json"
+    path.write_text('[1,2,3]')
+    assert len(extractors._run_extractor("json", str(path))) == 10
+
+
+def test_parser_errors_become_extraction_errors(tmp_path):
+    pytest.importorskip("pypdf")
+    path = tmp_path / "a.pdf"
+    path.write_bytes(b"%PDF-1.4 garbage")
+    with pytest.raises(ExtractionError):
+        extractors._run_extractor("pdf", str(path))
+
+
+def test_extract_text_runs_in_the_process_pool(tmp_path):
+    path = _write_docx(tmp_path / "a.docx")
+    try:
+        assert asyncio.run(extract_text("docx", path)).startswith("First paragraph")
+    finally:
+        extractors.shutdown_extractors()
+
+
+def test_oversized_docx_body_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(extractors, "DOCX_MAX_XML_BYTES", 100)
+    with pytest.raises(ExtractionError):
+        extract_docx(_write_docx(tmp_path / "a.docx"))
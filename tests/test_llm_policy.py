@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+from llm_policy import CircuitBreaker, LlmPolicy, ProviderUnavailable, is_transient
+from llm_scheduler import LlmOverloaded
+
+
+class FlakyAttempt:
+    """Fails with the queued errors in order, then succeeds"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def __call__(self, provider, model, timeout):
+        self.calls.append((provider, model))
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"{provider}/{model}"
+
+
+def _policy(**kwargs):
+    options = dict(max_retries=2, base_delay=0, max_delay=0,
+                   fallback_chain=["anthropic", "openai"],
+                   fallback_models={"anthropic": "claude", "openai": "gpt"})
+    options.update(kwargs)
+    return LlmPolicy(**options)
+
+
+def test_is_transient():
+    assert is_transient(asyncio.TimeoutError())
+    assert is_transient(RuntimeError("Rate limit exceeded"))
+    assert not is_transient(ValueError("invalid api key"))
+
+
+def test_transient_errors_are_retried():
+    policy = _policy()
+    attempt = FlakyAttempt(TimeoutError(), TimeoutError())
+    result = asyncio.run(policy.run("openai", "gpt", attempt))
+    assert result == ("openai/gpt", "openai", "gpt")
+    assert len(attempt.calls) == 3
+    assert policy.retries == 2
+    assert policy.breaker("openai").failures == 0
+
+
+def test_permanent_error_is_raised_without_retry_or_fallback():
+    policy = _policy()
+    attempt = FlakyAttempt(ValueError("bad request"))
+    with pytest.raises(ValueError):
+        asyncio.run(policy.run("openai", "gpt", attempt))
+    assert attempt.calls == [("openai", "gpt")]
+
+
+def test_falls_back_after_retries_are_exhausted():
+    policy = _policy()
+    attempt = FlakyAttempt(*[TimeoutError()] * 3)
+    result = asyncio.run(policy.run("openai", "gpt", attempt))
+    assert result == ("anthropic/claude", "anthropic", "claude")
+    assert policy.fallbacks == 1
+
+
+def test_no_fallback_when_disallowed_or_output_started():
+    policy = _policy()
+    with pytest.raises(TimeoutError):
+        asyncio.run(policy.run("openai", "gpt", FlakyAttempt(*[TimeoutError()] * 3), allow_fallback=False))
+
+    attempt = FlakyAttempt(TimeoutError())
+    with pytest.raises(TimeoutError):
+        asyncio.run(policy.run("openai", "gpt", attempt, can_retry=lambda: False))
+    assert attempt.calls == [("openai", "gpt")]
+
+
+def test_overloaded_moves_on_without_tripping_the_breaker():
+    policy = _policy()
+    attempt = FlakyAttempt(LlmOverloaded("queue full", 1))
+    result = asyncio.run(policy.run("openai", "gpt", attempt))
+    assert result[1] == "anthropic"
+    assert policy.breaker("openai").failures == 0
+
+
+def test_open_circuit_skips_the_provider():
+    policy = _policy(breaker_failures=1, fallback_chain=[])
+    with pytest.raises(TimeoutError):
+        asyncio.run(policy.run("openai", "gpt", FlakyAttempt(TimeoutError()), allow_fallback=False))
+    assert policy.breaker("openai").state == "open"
+
+    attempt = FlakyAttempt()
+    with pytest.raises(ProviderUnavailable) as unavailable:
+        asyncio.run(policy.run("openai", "gpt", attempt))
+    assert attempt.calls == []
+    assert unavailable.value.retry_after >= 1
+
+
+def test_breaker_half_open_trial(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("llm_policy.time.monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, cooldown_seconds=10)
+
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 1
+    assert not breaker.allow()
+
+    clock[0] += 10
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.trips == 2
+
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
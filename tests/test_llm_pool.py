@@ -0,0 +1,38 @@
+import pytest
+
+llm_pool = pytest.importorskip("llm_pool")
+context = pytest.importorskip("context")
+
+KEY = ("s", "sys", "openai", "gpt")
+
+
+def _turn(pool, marker):
+    return pool.get(*KEY, context.ConversationContext(marker=marker))
+
+
+def _finish(pool, client, marker):
+    pool.advance(*KEY, client=client, marker=marker, tokens=10)
+
+
+def test_sequential_turns_reuse_the_client():
+    pool = llm_pool.LlmClientPool("key")
+    first = _turn(pool, "m0")
+    _finish(pool, first, "a1")
+    assert _turn(pool, "a1") is first
+
+
+def test_overlapping_turns_do_not_credit_a_client_that_missed_a_reply():
+    pool = llm_pool.LlmClientPool("key")
+    first = _turn(pool, "m0")
+    second = _turn(pool, "m0")
+    assert second is not first
+
+    _finish(pool, first, "a1")
+    _finish(pool, second, "a2")
+    assert _turn(pool, "a2") is not second
+
+
+def test_failed_turn_forces_a_rebuild():
+    pool = llm_pool.LlmClientPool("key")
+    first = _turn(pool, "m0")
+    assert _turn(pool, "m0") is not first
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from llm_scheduler import BATCH, INTERACTIVE, LlmOverloaded, LlmScheduler
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_provider_lane_limits_concurrent_calls():
+    async def scenario():
+        scheduler = LlmScheduler(provider_limits={"openai": 2})
+        await scheduler.acquire("openai", "a")
+        await scheduler.acquire("openai", "b")
+        third = asyncio.create_task(scheduler.acquire("openai", "c"))
+        await _settle()
+        assert not third.done()
+        assert scheduler.stats()["lanes"]["provider:openai"]["active"] == 2
+
+        scheduler._release("openai", "a")
+        await _settle()
+        assert third.done()
+        assert scheduler.stats()["lanes"]["model:openai/c"]["active"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_model_lane_does_not_block_other_models():
+    async def scenario():
+        scheduler = LlmScheduler(model_limits={"openai/a": 1})
+        await scheduler.acquire("openai", "a")
+        blocked = asyncio.create_task(scheduler.acquire("openai", "a"))
+        await _settle()
+        assert not blocked.done()
+
+        await asyncio.wait_for(scheduler.acquire("openai", "b"), 1)
+        blocked.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_interactive_waiters_are_served_before_batch():
+    async def scenario():
+        scheduler = LlmScheduler(provider_limits={"openai": 1})
+        await scheduler.acquire("openai", "m")
+        order = []
+
+        async def call(name, priority):
+            await scheduler.acquire("openai", "m", priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(call("batch-1", BATCH))]
+        await _settle()
+        tasks.append(asyncio.create_task(call("interactive-1", INTERACTIVE)))
+        await _settle()
+        tasks.append(asyncio.create_task(call("interactive-2", INTERACTIVE)))
+        await _settle()
+
+        for _ in range(3):
+            scheduler._release("openai", "m")
+            await _settle()
+        await asyncio.gather(*tasks)
+        assert order == ["interactive-1", "interactive-2", "batch-1"]
+
+    asyncio.run(scenario())
+
+
+def test_batch_is_capped_at_its_share_of_a_lane():
+    async def scenario():
+        scheduler = LlmScheduler(provider_limits={"openai": 4}, batch_share=0.5)
+        await scheduler.acquire("openai", "m", BATCH)
+        await scheduler.acquire("openai", "m", BATCH)
+        batch = asyncio.create_task(scheduler.acquire("openai", "m", BATCH))
+        await _settle()
+        assert not batch.done()
+
+        await asyncio.wait_for(scheduler.acquire("openai", "m", INTERACTIVE), 1)
+        batch.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_and_deadline_raise_overloaded():
+    async def scenario():
+        scheduler = LlmScheduler(provider_limits={"openai": 1}, max_queue=1)
+        await scheduler.acquire("openai", "m")
+        with pytest.raises(LlmOverloaded) as timed_out:
+            await scheduler.acquire("openai", "m", timeout=0.01)
+        assert timed_out.value.retry_after >= 1
+        assert scheduler.timed_out == 1
+
+        queued = asyncio.create_task(scheduler.acquire("openai", "m"))
+        await _settle()
+        with pytest.raises(LlmOverloaded):
+            await scheduler.acquire("openai", "m")
+        assert scheduler.rejected == 1
+        queued.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_slot_releases_on_exit_and_error():
+    async def scenario():
+        scheduler = LlmScheduler(provider_limits={"openai": 1})
+        async with scheduler.slot("openai", "m"):
+            assert scheduler.stats()["lanes"]["provider:openai"]["active"] == 1
+        with pytest.raises(RuntimeError):
+            async with scheduler.slot("openai", "m"):
+                raise RuntimeError("boom")
+        assert scheduler.stats()["lanes"]["provider:openai"]["active"] == 0
+
+    asyncio.run(scenario())
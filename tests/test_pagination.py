@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor, fetch_keyset_page
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_cursor_round_trip_keeps_datetimes():
+    value, item_id = decode_cursor(encode_cursor(BASE, "msg-1"))
+    assert item_id == "msg-1"
+    assert isinstance(value, datetime)
+    assert value.replace(tzinfo=timezone.utc) == BASE
+
+
+def test_invalid_cursor_is_a_400():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("not-a-cursor")
+    assert error.value.status_code == 400
+
+
+def test_before_and_after_together_are_rejected():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(fetch_keyset_page(None, {}, "timestamp", 10, before="a", after="b"))
+    assert error.value.status_code == 400
+
+
+def _collection():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["messages"]
+    # Two messages share each timestamp so the id tie-break is exercised
+    docs = [
+        {"id": f"m{i:02d}", "session_id": "s", "timestamp": BASE + timedelta(seconds=i // 2)}
+        for i in range(7)
+    ]
+    asyncio.run(collection.insert_many(docs))
+    return collection
+
+
+def _walk(collection, **direction):
+    async def scenario():
+        seen = []
+        page, cursor = await fetch_keyset_page(collection, {"session_id": "s"}, "timestamp", 3,
+                                               projection={"_id": 0}, **direction)
+        seen.append([doc["id"] for doc in page])
+        key = "after" if "after" in direction else "before"
+        while cursor:
+            page, cursor = await fetch_keyset_page(collection, {"session_id": "s"}, "timestamp", 3,
+                                                   projection={"_id": 0}, **{key: cursor})
+            seen.append([doc["id"] for doc in page])
+        return seen
+
+    return asyncio.run(scenario())
+
+
+def test_pages_walk_towards_older_documents():
+    collection = _collection()
+    assert _walk(collection) == [["m06", "m05", "m04"], ["m03", "m02", "m01"], ["m00"]]
+
+
+def test_after_pages_walk_towards_newer_documents():
+    collection = _collection()
+    start = encode_cursor(BASE, "m00")
+    # Each page is still returned newest first
+    assert _walk(collection, after=start) == [["m03", "m02", "m01"], ["m06", "m05", "m04"]]
@@ -0,0 +1,52 @@
+import numpy as np
+
+from recall import HashingVectorizer, VectorIndex
+
+
+def _vectors(texts):
+    return HashingVectorizer(64).transform(texts)
+
+
+def test_second_process_opens_read_only_and_sees_new_rows(tmp_path):
+    writer, reader = VectorIndex(tmp_path, 64), VectorIndex(tmp_path, 64)
+    writer.open()
+    reader.open()
+    assert writer.writable and not reader.writable
+
+    writer.append([("message", "m1", "s1"), ("message", "m2", "s2")], _vectors(["red apples", "blue sky"]))
+    assert reader.count == 0
+    assert reader.refresh() == 2
+    hits = reader.search(_vectors(["blue sky"])[0], 1)
+    assert hits[0][1] == ("message", "m2", "s2")
+
+    writer.close()
+    reader.close()
+
+
+def test_append_skips_rows_already_indexed(tmp_path):
+    index = VectorIndex(tmp_path, 64)
+    index.open()
+    assert index.append([("message", "m1", "s1")], _vectors(["one"])) == 1
+    assert index.append([("message", "m1", "s1"), ("message", "m2", "s1")], _vectors(["one", "two"])) == 1
+    assert index.count == 2
+    index.close()
+
+
+def test_reader_takes_over_when_the_writer_closes(tmp_path):
+    writer, reader = VectorIndex(tmp_path, 64), VectorIndex(tmp_path, 64)
+    writer.open()
+    reader.open()
+    writer.append([("message", "m1", "s1")], _vectors(["one"]))
+    assert not reader.promote()
+
+    writer.close()
+    assert reader.promote()
+    assert reader.writable and reader.count == 1
+    reader.append([("message", "m2", "s1")], _vectors(["two"]))
+    reader.close()
+
+    reopened = VectorIndex(tmp_path, 64)
+    reopened.open()
+    assert reopened.count == 2
+    assert np.allclose(reopened.search(_vectors(["two"])[0], 1)[0][0], 1.0)
+    reopened.close()
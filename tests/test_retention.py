@@ -0,0 +1,43 @@
+import gzip
+from datetime import datetime, timezone
+
+import bson
+import pytest
+
+import retention
+from retention import compress, decompress
+
+MESSAGES = [
+    {"id": "m1", "role": "user", "content": "héllo", "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc)},
+    {"id": "m2", "role": "assistant", "content": "hi " * 500, "timestamp": datetime(2024, 1, 1, 0, 0, 5)},
+]
+
+
+def _naive(messages):
+    # BSON drops tzinfo; timestamps come back as naive UTC, like Mongo reads
+    return [{**m, "timestamp": m["timestamp"].replace(tzinfo=None)} for m in messages]
+
+
+def test_gzip_round_trip():
+    blob = compress(MESSAGES, "gzip")
+    assert gzip.decompress(blob)
+    assert decompress(blob, "gzip") == _naive(MESSAGES)
+
+
+def test_empty_round_trip():
+    assert decompress(compress([], "gzip"), "gzip") == []
+
+
+def test_zstd_round_trip():
+    pytest.importorskip("zstandard")
+    blob = compress(MESSAGES, "zstd")
+    assert decompress(blob, "zstd") == _naive(MESSAGES)
+    assert len(blob) < len(bson.encode({"messages": MESSAGES}))
+
+
+def test_zstd_falls_back_to_gzip_without_zstandard(monkeypatch):
+    monkeypatch.setattr(retention, "ARCHIVE_CODEC", "zstd")
+    monkeypatch.setattr(retention, "_zstd", lambda: None)
+    assert retention.archive_codec() == "gzip"
+    with pytest.raises(RuntimeError):
+        decompress(b"", "zstd")
@@ -0,0 +1,50 @@
+from datetime import datetime, timezone
+
+from starlette.datastructures import Headers
+
+from versions import etag, is_not_modified, validator_headers
+
+MODIFIED = datetime(2024, 5, 1, 12, 30, 15, 500000, tzinfo=timezone.utc)
+TAG = etag("s", 7)
+
+
+def _headers(**values):
+    return Headers({name.replace("_", "-"): value for name, value in values.items()})
+
+
+def test_no_validators_means_modified():
+    assert not is_not_modified(_headers(), TAG, MODIFIED)
+
+
+def test_if_none_match():
+    assert is_not_modified(_headers(if_none_match='"s7"'), TAG, MODIFIED)
+    assert is_not_modified(_headers(if_none_match='"s6", W/"s7"'), TAG, MODIFIED)
+    assert is_not_modified(_headers(if_none_match="*"), TAG, MODIFIED)
+    assert not is_not_modified(_headers(if_none_match='"s6"'), TAG, MODIFIED)
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    headers = _headers(if_none_match='"s6"', if_modified_since="Wed, 01 May 2024 12:30:15 GMT")
+    assert not is_not_modified(headers, TAG, MODIFIED)
+
+
+def test_if_modified_since_uses_second_precision():
+    assert is_not_modified(_headers(if_modified_since="Wed, 01 May 2024 12:30:15 GMT"), TAG, MODIFIED)
+    assert not is_not_modified(_headers(if_modified_since="Wed, 01 May 2024 12:30:14 GMT"), TAG, MODIFIED)
+    # Naive datetimes from Mongo are UTC
+    assert is_not_modified(_headers(if_modified_since="Wed, 01 May 2024 12:30:15 GMT"), TAG,
+                           MODIFIED.replace(tzinfo=None))
+
+
+def test_bad_or_unusable_if_modified_since():
+    assert not is_not_modified(_headers(if_modified_since="yesterday"), TAG, MODIFIED)
+    assert not is_not_modified(_headers(if_modified_since="Wed, 01 May 2024 12:30:15 GMT"), TAG, None)
+
+
+def test_validator_headers_round_trip():
+    headers = validator_headers(TAG, MODIFIED)
+    assert headers["ETag"] == '"s7"'
+    assert headers["Cache-Control"] == "no-cache"
+    assert headers["Last-Modified"] == "Wed, 01 May 2024 12:30:15 GMT"
+    assert is_not_modified(_headers(if_none_match=headers["ETag"]), TAG, MODIFIED)
+    assert is_not_modified(_headers(if_modified_since=headers["Last-Modified"]), TAG, MODIFIED)